@@ -0,0 +1,248 @@
+"""
+Benchmarks the simulation stages of a single model package.
+
+This script is started by `run.py` in a fresh process for every model, with the
+model's `src` directory as working directory, because the packages share module
+names (priors, context, ...) and resolve their data relative to `src`. It prints
+its results as JSON to stdout.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+
+def rlwm_stages():
+    import priors
+    import context
+    import model
+    import configurator
+
+    def sample_context(s):
+        s["context"] = context.generate_contexts(s["batch_size"], s["num_steps"])
+
+    def sample_prior(s):
+        batch_size = s["batch_size"]
+        s["eta"] = np.stack([priors.sample_eta() for _ in range(batch_size)])
+        s["kappa"] = np.stack([priors.sample_kappa() for _ in range(batch_size)])
+        s["theta"] = np.stack([
+            priors.sample_random_walk(s["eta"][i], s["context"][i, :, 2]) for i in range(batch_size)
+        ])
+
+    def simulate(s):
+        s["sim_data"] = np.stack([
+            model.sample_rlwm(s["theta"][i], s["kappa"][i], s["context"][i])
+            for i in range(s["batch_size"])
+        ])
+
+    def configure(s):
+        configurator.configure_input({
+            "sim_data": s["sim_data"].astype(np.int32),
+            "batchable_context": s["context"].astype(np.int32),
+            "non_batchable_context": s["num_steps"],
+            "local_parameters": s["theta"],
+            "global_parameters": s["eta"],
+            "shared_parameters": s["kappa"],
+        })
+
+    def end_to_end(s):
+        configurator.configure_input(model.generative_model(s["batch_size"]))
+
+    stages = dict(context=sample_context, prior=sample_prior, likelihood=simulate,
+                  configurator=configure)
+    return stages, end_to_end, (context.MIN_STEPS, context.MAX_STEPS)
+
+
+def reversal_learning_stages():
+    import priors
+    import context
+    import likelihood
+    import configurator
+
+    def sample_context(s):
+        s["context"] = context.generate_contexts(s["batch_size"])[:, :s["num_steps"]]
+
+    def sample_prior(s):
+        batch_size = s["batch_size"]
+        s["eta"] = np.stack([priors.sample_eta() for _ in range(batch_size)])
+        seeds = np.random.SeedSequence().generate_state(batch_size)
+        s["theta"] = priors.sample_theta_t_batch(s["eta"], s["num_steps"], seeds)
+
+    def simulate(s):
+        s["sim_data"] = np.stack([
+            likelihood.sample_softmax_rl(s["theta"][i], s["context"][i])
+            for i in range(s["batch_size"])
+        ])
+
+    def configure(s):
+        configurator.configure_input({
+            "sim_data": s["sim_data"],
+            "sim_batchable_context": s["context"],
+            "local_prior_draws": s["theta"],
+            "hyper_prior_draws": s["eta"],
+        })
+
+    stages = dict(context=sample_context, prior=sample_prior, likelihood=simulate,
+                  configurator=configure)
+    return stages, None, (1, priors.NUM_STEPS)
+
+
+def three_blocks_stages():
+    import priors
+    import context
+    import likelihood
+    import configurator
+
+    def sample_context(s):
+        s["context"] = context.generate_contexts(s["batch_size"])[:, :s["num_steps"]]
+
+    def sample_prior(s):
+        batch_size = s["batch_size"]
+        s["eta"] = np.stack([priors.sample_rw_eta() for _ in range(batch_size)])
+        seeds = np.random.SeedSequence().generate_state(batch_size)
+        s["theta"] = priors.sample_random_walk_batch(s["eta"], s["num_steps"], seeds)
+
+    def simulate(s):
+        s["sim_data"] = np.stack([
+            likelihood.sample_softmax_rl(s["theta"][i], s["context"][i])
+            for i in range(s["batch_size"])
+        ])
+
+    def configure(s):
+        configurator.configure_input({
+            "sim_data": s["sim_data"],
+            "sim_batchable_context": s["context"],
+            "local_prior_draws": s["theta"],
+            "hyper_prior_draws": s["eta"],
+        })
+
+    stages = dict(context=sample_context, prior=sample_prior, likelihood=simulate,
+                  configurator=configure)
+    return stages, None, (1, 240)
+
+
+def three_alt_full_feedback_stages():
+    import priors
+    import context
+    import model
+    import configurator
+
+    def sample_context(s):
+        s["context"] = context.generate_contexts(s["batch_size"])[:, :s["num_steps"]]
+
+    def sample_prior(s):
+        batch_size = s["batch_size"]
+        s["eta"] = np.stack([priors.sample_eta() for _ in range(batch_size)])
+        s["theta"] = np.stack([
+            priors.sample_random_walk(s["eta"][i], s["num_steps"]) for i in range(batch_size)
+        ])
+
+    def simulate(s):
+        seeds = np.random.SeedSequence().generate_state(s["batch_size"])
+        s["sim_data"] = model.sample_softmax_rl_batch(s["theta"], s["context"], seeds)
+
+    def configure(s):
+        configurator.configure_input({
+            "sim_data": s["sim_data"],
+            "sim_batchable_context": s["context"],
+            "local_prior_draws": s["theta"],
+            "hyper_prior_draws": s["eta"],
+        })
+
+    stages = dict(context=sample_context, prior=sample_prior, likelihood=simulate,
+                  configurator=configure)
+    return stages, None, (1, context.NUM_STEPS)
+
+
+MODELS = {
+    "rlwm": rlwm_stages,
+    "reversal_learning": reversal_learning_stages,
+    "three_blocks": three_blocks_stages,
+    "three_alt_full_feedback": three_alt_full_feedback_stages,
+}
+
+
+def run_pipeline(stages, state):
+    """Runs all stages once and returns the wall time of each stage."""
+    timings = {}
+    for name, stage in stages.items():
+        start = time.perf_counter()
+        stage(state)
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def peak_memory(stages, state):
+    """Runs all stages once under tracemalloc and returns the peak traced bytes of each stage."""
+    peaks = {}
+    tracemalloc.start()
+    for name, stage in stages.items():
+        tracemalloc.reset_peak()
+        stage(state)
+        peaks[name] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peaks
+
+
+def benchmark(model, batch_sizes, num_steps_list, repeats):
+    start = time.perf_counter()
+    stages, end_to_end, (min_steps, max_steps) = MODELS[model]()
+    import_time = time.perf_counter() - start
+
+    # the first pass compiles all jitted functions and is reported separately
+    warmup = run_pipeline(stages, dict(batch_size=2, num_steps=max_steps))
+    if end_to_end is not None:
+        t = time.perf_counter()
+        end_to_end(dict(batch_size=2, num_steps=max_steps))
+        warmup["end_to_end"] = time.perf_counter() - t
+
+    results = []
+    for num_steps in num_steps_list or [max_steps]:
+        if not min_steps <= num_steps <= max_steps:
+            print(f"{model}: skipping {num_steps} trials (supported: {min_steps}-{max_steps})",
+                  file=sys.stderr)
+            continue
+        for batch_size in batch_sizes:
+            state = dict(batch_size=batch_size, num_steps=num_steps)
+            runs = [run_pipeline(stages, state) for _ in range(repeats)]
+            peaks = peak_memory(stages, state)
+            if end_to_end is not None:
+                e2e = []
+                for _ in range(repeats):
+                    t = time.perf_counter()
+                    end_to_end(state)
+                    e2e.append(time.perf_counter() - t)
+                runs = [dict(run, end_to_end=e) for run, e in zip(runs, e2e)]
+            for stage in runs[0]:
+                times = np.array([run[stage] for run in runs])
+                result = dict(
+                    model=model, stage=stage, batch_size=batch_size, num_steps=num_steps,
+                    median_s=float(np.median(times)), min_s=float(times.min()),
+                    peak_traced_bytes=peaks.get(stage),
+                )
+                if stage == "end_to_end":
+                    result["sims_per_s"] = float(batch_size / result["median_s"])
+                results.append(result)
+            total = np.median([sum(run[s] for s in stages) for run in runs])
+            results.append(dict(
+                model=model, stage="total", batch_size=batch_size, num_steps=num_steps,
+                median_s=float(total), min_s=float(total), peak_traced_bytes=max(peaks.values()),
+                sims_per_s=float(batch_size / total),
+            ))
+
+    return dict(model=model, import_s=import_time, warmup_s=warmup, results=results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("model", choices=list(MODELS))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32])
+    parser.add_argument("--num-steps", type=int, nargs="*", default=None)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    sys.path.insert(0, os.getcwd())
+    json.dump(benchmark(args.model, args.batch_sizes, args.num_steps, args.repeats), sys.stdout)
@@ -0,0 +1,87 @@
+"""
+Cold-start benchmark: time from a fresh python process to the first simulated batch.
+
+Every model is started twice in a new process with an empty numba cache directory
+(`NUMBA_CACHE_DIR`): the first start compiles all kernels and writes them to the cache,
+the second one loads them from it. Each start reports the time to import the model
+modules, to run `warmup()` and to simulate and configure the first batch.
+
+    python benchmarks/cold_start.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+MODELS = ["rlwm", "reversal_learning", "three_blocks", "three_alt_full_feedback"]
+
+
+def worker(model, batch_size):
+    start = time.perf_counter()
+    sys.path.insert(0, os.getcwd())
+    import warmup
+    import bench_model
+    stages, _, (_, max_steps) = bench_model.MODELS[model]()
+    timings = dict(import_s=time.perf_counter() - start)
+
+    t = time.perf_counter()
+    warmup.warmup()
+    timings["warmup_s"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    bench_model.run_pipeline(stages, dict(batch_size=batch_size, num_steps=max_steps))
+    timings["first_batch_s"] = time.perf_counter() - t
+    timings["total_s"] = time.perf_counter() - start
+    return timings
+
+
+def run(model, batch_size, cache_dir):
+    env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(Path(__file__).parent), env.get("PYTHONPATH")]))
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, __file__, "--worker", model, "--batch-size", str(batch_size)],
+        cwd=ROOT / model / "src", env=env, capture_output=True, text=True,
+    )
+    if out.returncode != 0:
+        raise RuntimeError(f"Cold start of {model} failed:\n{out.stderr}")
+    timings = json.loads(out.stdout)
+    timings["process_s"] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=MODELS, choices=MODELS)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        json.dump(worker(args.worker, args.batch_size), sys.stdout)
+        return
+
+    results = {}
+    print(f"{'model':<24}{'cache':<7}{'import [s]':>11}{'warmup [s]':>11}{'batch [s]':>11}{'process [s]':>12}")
+    for model in args.models:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            results[model] = dict(
+                compile=run(model, args.batch_size, cache_dir),
+                cached=run(model, args.batch_size, cache_dir),
+            )
+        for kind, r in results[model].items():
+            print(f"{model:<24}{kind:<7}{r['import_s']:>11.2f}{r['warmup_s']:>11.2f}"
+                  f"{r['first_batch_s']:>11.2f}{r['process_s']:>12.2f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
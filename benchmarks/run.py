@@ -0,0 +1,110 @@
+"""
+Simulation throughput benchmarks for all model packages.
+
+Every model is benchmarked in its own process (see `bench_model.py`). For each batch
+size and number of trials, the wall time and peak traced memory of the context, prior,
+likelihood and configurator stages are recorded, together with the resulting
+simulations per second. JIT warm-up and import times are reported separately.
+The results are written to a JSON file that can be compared against a saved baseline:
+
+    python benchmarks/run.py --output benchmarks/results.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json --output new.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+MODELS = ["rlwm", "reversal_learning", "three_blocks", "three_alt_full_feedback"]
+
+
+def run_model(model, batch_sizes, num_steps, repeats):
+    cmd = [sys.executable, str(Path(__file__).with_name("bench_model.py")), model,
+           "--batch-sizes", *map(str, batch_sizes), "--repeats", str(repeats)]
+    if num_steps:
+        cmd += ["--num-steps", *map(str, num_steps)]
+    start = time.perf_counter()
+    out = subprocess.run(cmd, cwd=ROOT / model / "src", capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"Benchmark of {model} failed:\n{out.stderr}")
+    if out.stderr:
+        print(out.stderr, file=sys.stderr, end="")
+    result = json.loads(out.stdout)
+    result["process_s"] = time.perf_counter() - start
+    return result
+
+
+def metadata():
+    import numba
+    return dict(
+        host=platform.node(), platform=platform.platform(), python=platform.python_version(),
+        numpy=np.__version__, numba=numba.__version__, cpu_count=numba.config.NUMBA_NUM_THREADS,
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the median stage timings with a baseline and returns the regressions, i.e.
+    all entries that got slower by more than the factor `tolerance`.
+    """
+    def key(r):
+        return r["model"], r["stage"], r["batch_size"], r["num_steps"]
+
+    reference = {key(r): r for r in baseline["results"]}
+    rows = []
+    for r in results["results"]:
+        if key(r) in reference:
+            ratio = r["median_s"] / reference[key(r)]["median_s"]
+            rows.append((*key(r), reference[key(r)]["median_s"], r["median_s"], ratio))
+    print(f"{'model':<24}{'stage':<14}{'batch':>6}{'steps':>6}{'base [s]':>11}{'new [s]':>11}{'ratio':>8}")
+    for row in rows:
+        flag = "  <- regression" if row[-1] > tolerance else ""
+        print(f"{row[0]:<24}{row[1]:<14}{row[2]:>6}{row[3]:>6}{row[4]:>11.4f}{row[5]:>11.4f}{row[6]:>8.2f}{flag}")
+    return [row for row in rows if row[-1] > tolerance]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=MODELS, choices=MODELS)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 256])
+    parser.add_argument("--num-steps", type=int, nargs="*", default=None,
+                        help="Trial counts to benchmark (default: the full length of each model).")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="A previous results file to compare against.")
+    parser.add_argument("--tolerance", type=float, default=1.2,
+                        help="Slowdown factor relative to the baseline that counts as a regression.")
+    args = parser.parse_args()
+
+    results = dict(meta=metadata(), models={}, results=[])
+    for model in args.models:
+        print(f"benchmarking {model} ...", file=sys.stderr)
+        out = run_model(model, args.batch_sizes, args.num_steps, args.repeats)
+        results["models"][model] = dict(
+            import_s=out["import_s"], warmup_s=out["warmup_s"], process_s=out["process_s"]
+        )
+        results["results"] += out["results"]
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    for r in results["results"]:
+        if "sims_per_s" in r:
+            print(f"{r['model']:<24}{r['stage']:<12} batch {r['batch_size']:>5} steps {r['num_steps']:>4}: "
+                  f"{r['sims_per_s']:>10.1f} sims/s")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import argparse
+import inspect
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numba
+
+# settings used for models that have not been tuned on this host; the batch size is a
+# training hyper parameter chosen by the caller, the settings are tuned for it
+DEFAULTS = dict(num_threads=None, num_workers=2, worker_threads=None, shard_size=1024)
+BATCH_SIZE = 32
+SHARD_SIZES = (256, 1024, 4096)
+# the tuned settings of all hosts, overridable for shared home directories or tests
+SETTINGS_PATH = Path(os.environ.get("AUTOTUNE_PATH", Path.home() / ".cache" / "nsrl" / "autotune.json"))
+
+# settings of the current host, loaded on first use
+_SETTINGS = None
+# whether the numba threads of the current thread have been set, which numba keeps per thread
+_THREADS = threading.local()
+
+
+def host_key():
+    """Returns the key of the current machine: its host name and number of cores."""
+    return f"{socket.gethostname()}/{os.cpu_count()}"
+
+
+def _load(path=SETTINGS_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def tuned_settings(model):
+    """
+    Returns the tuned settings of `model` on the current host, or an empty dict. A model
+    that was tuned on a machine with a different number of cores is not tuned here.
+    """
+    global _SETTINGS
+    if _SETTINGS is None:
+        _SETTINGS = _load().get(host_key(), {})
+    return _SETTINGS.get(model, {}).get("settings", {})
+
+
+def tuned(model, name, value=None, default=None):
+    """
+    Returns `value` unless it is None, else the tuned setting `name` of `model`, else
+    `default`, and the entry of DEFAULTS if that is None as well.
+    """
+    if value is not None:
+        return value
+    settings = tuned_settings(model)
+    if name in settings:
+        return settings[name]
+    return DEFAULTS[name] if default is None else default
+
+
+def save_settings(model, settings, probes=None, path=SETTINGS_PATH):
+    """Stores the settings of `model` for the current host, next to those of other hosts."""
+    global _SETTINGS
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    everything = _load(path)
+    everything.setdefault(host_key(), {})[model] = dict(
+        settings=settings, probes=probes or {}, tuned_at=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+    tmp = path.with_name(f"{path.name}.tmp{os.getpid()}")
+    with open(tmp, "w") as f:
+        json.dump(everything, f, indent=2)
+    os.replace(tmp, path)
+    if path == SETTINGS_PATH:
+        _SETTINGS = everything[host_key()]
+
+
+def model_of(simulator):
+    """
+    Returns the name of the model package that defines `simulator`, e.g. "rlwm" for
+    `rlwm/src/model.py::generative_model`, or None for simulators defined elsewhere.
+    """
+    try:
+        source = Path(inspect.getsourcefile(simulator)).resolve()
+    except TypeError:
+        return None
+    if source.parent.name != "src":
+        return None
+    return source.parents[1].name
+
+
+def pin_threads(num_threads):
+    """
+    Sets the number of numba threads of the calling thread and keeps `apply` from changing
+    it, e.g. in the workers of a `Prefetcher`, which use the tuned `worker_threads`
+    instead of the in-process `num_threads`. None keeps numba's setting.
+    """
+    if num_threads is not None:
+        numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+    _THREADS.set = True
+
+
+def apply(model):
+    """
+    Sets the number of numba threads of the calling thread to the tuned `num_threads` of
+    `model`, once. Called by every `generative_model`, so in-process simulation runs with
+    the thread count it was tuned with; threads pinned by `pin_threads` are left alone.
+    """
+    if getattr(_THREADS, "set", False):
+        return
+    pin_threads(tuned(model, "num_threads"))
+
+
+def _rate(fn, size, probe_seconds):
+    """Returns the simulations per second of `fn(size)`, after one untimed call."""
+    fn(size)
+    count = 0
+    start = time.perf_counter()
+    while True:
+        fn(size)
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= probe_seconds:
+            return count * size / elapsed
+
+
+def _powers_of_two(limit):
+    values = [1]
+    while values[-1] * 2 <= limit:
+        values.append(values[-1] * 2)
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+def _prefetch_rate(simulator, configurator, batch_size, num_workers, worker_threads, probe_seconds):
+    from prefetch import Prefetcher
+
+    with Prefetcher(simulator, configurator, batch_size=batch_size, num_workers=num_workers,
+                    queue_depth=2 * num_workers, num_threads=worker_threads) as prefetcher:
+        # the first batch of every worker includes its start-up
+        for _ in range(num_workers):
+            prefetcher()
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < probe_seconds:
+            prefetcher()
+            count += 1
+        return count * batch_size / (time.perf_counter() - start)
+
+
+def autotune(model, simulator, configurator=None, batch_size=BATCH_SIZE, shard_sizes=SHARD_SIZES,
+             worker_counts=None, probe_seconds=1.0, save=True, verbose=False):
+    """
+    Probes the simulation settings of a model package on the current machine and stores
+    the fastest ones, which `generative_model`, `prefetch.Prefetcher` and
+    `simulation_store.simulate_to_disk` then use whenever the caller leaves them unset.
+
+    The batch size is not tuned: it is a training hyper parameter, and a `Prefetcher`
+    whose batches differ from the trainer's would simulate in the trainer process. The
+    settings are tuned for the batch size the trainer uses. The probes run in three
+    steps, each with the best settings of the previous ones:
+
+    1. `num_threads`: the simulations per second of `simulator(batch_size)` (and
+       `configurator`) in this process, for every numba thread count (powers of two up
+       to the number of cores).
+    2. `num_workers` and `worker_threads`: the throughput of a `Prefetcher` with that many
+       worker processes, each limited to an equal share of the cores. Many workers with
+       few threads avoid the per-call overhead of a batch, few workers with many threads
+       the duplicate memory of the processes; which wins depends on the model.
+    3. `shard_size`: the simulations per second of simulating and writing one shard of
+       `simulate_to_disk`, with `worker_threads` threads.
+
+    Parameters
+    ----------
+    model : str
+        The name of the model package, e.g. "rlwm".
+    simulator : callable
+        The generative model, called as `simulator(batch_size)`. Must be picklable.
+    configurator : callable or None, optional
+        If given, applied to every simulated batch, as in training.
+    batch_size : int, optional
+        The batch size of training, stored with the settings (default is 32).
+    shard_sizes : tuple of int, optional
+        The candidate shard sizes.
+    worker_counts : tuple of int or None, optional
+        The candidate numbers of worker processes. Defaults to powers of two up to the
+        number of cores.
+    probe_seconds : float, optional
+        The duration of every probe (default is 1 s).
+    save : bool, optional
+        Whether to store the settings for the current host (default is True).
+    verbose : bool, optional
+        Whether to print every probe.
+
+    Returns
+    -------
+    dict
+        The 'settings' and the simulations per second of every probe ('probes').
+    """
+    from simulation_store import write_shard
+
+    def simulate(size):
+        out_dict = simulator(size)
+        return out_dict if configurator is None else configurator(out_dict)
+
+    def report(step, key, rate):
+        probes.setdefault(step, []).append([key, rate])
+        if verbose:
+            print(f"{model} {step:<10} {key!s:<10} {rate:>12.0f} sims/s")
+
+    num_cores = os.cpu_count()
+    previous_threads = numba.get_num_threads()
+    probes = {}
+    try:
+        best = (0, None)
+        for num_threads in _powers_of_two(numba.config.NUMBA_NUM_THREADS):
+            pin_threads(num_threads)
+            rate = _rate(simulate, batch_size, probe_seconds)
+            report("threads", num_threads, rate)
+            best = max(best, (rate, num_threads))
+        _, num_threads = best
+
+        best = (0, None, None)
+        for num_workers in worker_counts or _powers_of_two(num_cores):
+            worker_threads = max(1, num_cores // num_workers)
+            rate = _prefetch_rate(simulator, configurator, batch_size, num_workers, worker_threads, probe_seconds)
+            report("workers", (num_workers, worker_threads), rate)
+            best = max(best, (rate, num_workers, worker_threads))
+        _, num_workers, worker_threads = best
+
+        pin_threads(worker_threads)
+        best = (0, None)
+        with tempfile.TemporaryDirectory() as directory:
+            for shard_size in shard_sizes:
+                rate = _rate(lambda size: write_shard(directory, 0, simulate(size)), shard_size, probe_seconds)
+                report("shard", shard_size, rate)
+                best = max(best, (rate, shard_size))
+        _, shard_size = best
+    finally:
+        numba.set_num_threads(previous_threads)
+
+    settings = dict(batch_size=batch_size, num_threads=num_threads, num_workers=num_workers,
+                    worker_threads=worker_threads, shard_size=shard_size)
+    if save:
+        save_settings(model, settings, probes)
+    return dict(settings=settings, probes=probes)
+
+
+if __name__ == "__main__":
+    from simulation_store import MODELS, _load_entry_points
+
+    parser = argparse.ArgumentParser(description="Tune the simulation settings of a model package on this machine.")
+    parser.add_argument("model", choices=list(MODELS), help="The model package to tune.")
+    parser.add_argument("--configure", action="store_true", help="Include the configurator in the probes.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="The batch size of training.")
+    parser.add_argument("--probe-seconds", type=float, default=1.0, help="The duration of every probe.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the settings without storing them.")
+    args = parser.parse_args()
+
+    simulator, configurator = _load_entry_points(args.model, args.configure)
+    result = autotune(args.model, simulator, configurator, args.batch_size, probe_seconds=args.probe_seconds,
+                      save=not args.dry_run, verbose=True)
+    print(json.dumps(result["settings"], indent=2))
+    if not args.dry_run:
+        print(f"stored for {host_key()} in {SETTINGS_PATH}")
@@ -0,0 +1,146 @@
+import hashlib
+
+import numpy as np
+
+from dataset_cache import load_dataset
+
+
+class ContextStore:
+    """
+    Array-backed store of empirical contexts with a per-subject index.
+
+    The relevant columns of a data set are loaded once into a single contiguous
+    numpy array, sorted by subject. Each subject is addressed by an offset and a
+    length into that array, so drawing the context of a subject is an O(1) slice
+    instead of a boolean mask over all rows of a DataFrame.
+
+    The context array is built from the binary cache of the csv file (see
+    `dataset_cache.load_dataset`) and stored next to it, so that later imports and
+    worker processes memory-map the same read-only pages instead of parsing the csv.
+    Nothing is read until the store is first used, so that modules can create their
+    store at import time without touching the data.
+
+    Parameters
+    ----------
+    path : str
+        Path to the csv file with the trial-wise data of all subjects.
+    columns : list of str
+        The columns that make up the context, in the order the simulator expects them.
+    id_column : str, optional
+        The column identifying subjects (default is "id").
+    subjects : array_like or None, optional
+        If given, only these subjects are kept in the store.
+    dtype : np.dtype, optional
+        The dtype of the stored context array (default is np.float64).
+    scale : array_like or None, optional
+        If given, the context columns are divided by these values.
+    rng : np.random.Generator or None, optional
+        The random number generator used for drawing subjects. If None, a new default
+        generator is used.
+    """
+
+    def __init__(self, path, columns, id_column="id", subjects=None, dtype=np.float64, scale=None, rng=None):
+        self.path = path
+        self.columns = list(columns)
+        self.id_column = id_column
+        self.keep_subjects = subjects
+        self.dtype = dtype
+        self.scale = scale
+        self.rng = np.random.default_rng() if rng is None else rng
+        self._values = None
+
+    def load(self):
+        """Loads the context array and the subject index, if not done yet, and returns the store."""
+        if self._values is not None:
+            return self
+        dataset = load_dataset(self.path, self.id_column)
+        keep = np.ones(len(dataset.data), dtype=bool)
+        if self.keep_subjects is not None:
+            keep = np.isin(dataset.data[self.id_column], self.keep_subjects)
+        ids = dataset.data[self.id_column][keep]
+
+        def build(dataset):
+            values = np.stack(
+                [dataset.data[column][keep] for column in self.columns], axis=1
+            ).astype(self.dtype)
+            if self.scale is not None:
+                values = values / np.asarray(self.scale, dtype=self.dtype)
+            return values
+
+        key = repr((
+            self.columns, np.dtype(self.dtype).str,
+            None if self.keep_subjects is None else np.unique(self.keep_subjects).tolist(),
+            None if self.scale is None else np.asarray(self.scale).tolist(),
+        ))
+        self._subjects, self._offsets, self._lengths = np.unique(
+            ids, return_index=True, return_counts=True
+        )
+        self._values = dataset.derived(
+            "context_" + hashlib.sha1(key.encode()).hexdigest()[:16], build
+        )
+        return self
+
+    @property
+    def values(self):
+        return self.load()._values
+
+    @property
+    def subjects(self):
+        return self.load()._subjects
+
+    @property
+    def offsets(self):
+        return self.load()._offsets
+
+    @property
+    def lengths(self):
+        return self.load()._lengths
+
+    @property
+    def num_subjects(self):
+        return len(self.subjects)
+
+    def subject_context(self, idx):
+        """Returns the context of the subject at position `idx` of the index (a view)."""
+        start = self.offsets[idx]
+        return self.values[start:start + self.lengths[idx]]
+
+    def generate_context(self, rng=None):
+        """
+        Returns the context of a randomly drawn subject (a view), drawn with `rng` or, if
+        None, with the generator of the store.
+        """
+        rng = self.rng if rng is None else rng
+        return self.subject_context(rng.integers(self.num_subjects))
+
+    def as_blocks(self):
+        """
+        Returns all contexts as a (num_subjects, num_steps, num_features) view.
+
+        Raises
+        ------
+        ValueError
+            If the subjects do not all have the same number of trials.
+        """
+        if np.any(self.lengths != self.lengths[0]):
+            raise ValueError("Subjects differ in their number of trials and cannot be stacked.")
+        return self.values.reshape(self.num_subjects, self.lengths[0], len(self.columns))
+
+    def generate_contexts(self, batch_size, rng=None):
+        """
+        Returns the contexts of `batch_size` randomly drawn subjects as one stacked array.
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of contexts to draw.
+        rng : np.random.Generator or None, optional
+            The generator of the draw. If None, the generator of the store is used.
+
+        Returns
+        -------
+        np.ndarray
+            An array of shape (batch_size, num_steps, num_features).
+        """
+        rng = self.rng if rng is None else rng
+        return self.as_blocks()[rng.integers(self.num_subjects, size=batch_size)]
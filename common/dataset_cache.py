@@ -0,0 +1,291 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CACHE_SUFFIX = ".cache"
+FORMAT_VERSION = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Returns the sha256 hex digest of the file at `path`."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_dir(csv_path):
+    """Returns the directory holding the binary cache of `csv_path`."""
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.stem + CACHE_SUFFIX)
+
+
+@contextmanager
+def _locked(target, shared=False):
+    """
+    Holds an advisory lock on the cache `target` while the enclosed block runs: exclusive
+    for writers, shared for readers. The lock lives in a file next to the cache
+    directory, which is itself replaced on conversion. Without fcntl (Windows) this is a
+    no-op.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(target.with_name(f"{target.name}.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _to_records(data):
+    """Converts a DataFrame into a structured array with fixed-width string columns."""
+    columns = {}
+    for name in data.columns:
+        column = data[name]
+        if column.dtype.kind in "biuf":
+            columns[name] = column.to_numpy()
+        else:
+            columns[name] = column.astype(str).to_numpy().astype(np.str_)
+    dtype = [(name, values.dtype) for name, values in columns.items()]
+    records = np.empty(len(data), dtype=dtype)
+    for name, values in columns.items():
+        records[name] = values
+    return records
+
+
+def convert_dataset(csv_path, id_column="id", force=True):
+    """
+    Converts a csv file into its binary cache.
+
+    The rows are sorted by `id_column` and written as a single structured array
+    (`data.npy`), next to a subject index with one (subject, offset, length) entry
+    per subject (`index.npy`). The sha256 of the csv file is stored in `meta.json`
+    and used to invalidate the cache once the csv changes. The cache is written to a
+    temporary directory first and moved into place, so readers never see a partially
+    written cache. The conversion holds an exclusive lock on the cache, and readers of
+    `load_dataset` a shared one, so processes that find a stale cache at the same time
+    (e.g. the workers of a `Prefetcher` on first use) convert it once, and the old cache
+    is never removed while it is being opened.
+
+    Parameters
+    ----------
+    csv_path : str or Path
+        Path to the csv file.
+    id_column : str, optional
+        The column identifying subjects (default is "id").
+    force : bool, optional
+        If False, a cache that became valid while waiting for the lock, i.e. that another
+        process converted, is kept (default is True).
+
+    Returns
+    -------
+    Path
+        The directory of the cache.
+    """
+    csv_path = Path(csv_path)
+    target = cache_dir(csv_path)
+    with _locked(target):
+        if not force and is_valid(csv_path, id_column):
+            return target
+        tmp = target.with_name(f"{target.name}.tmp{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        try:
+            _write_cache(tmp, csv_path, id_column)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp, target)
+    return target
+
+
+def _write_cache(tmp, csv_path, id_column):
+    """Writes the cache files of `csv_path` into the directory `tmp`."""
+    # pandas is only needed for the conversion, keep it out of the import path of the loaders
+    import pandas as pd
+
+    data = pd.read_csv(csv_path).sort_values(id_column, kind="stable")
+    records = _to_records(data)
+    subjects, offsets, lengths = np.unique(
+        records[id_column], return_index=True, return_counts=True
+    )
+    index = np.empty(
+        len(subjects),
+        dtype=[("subject", subjects.dtype), ("offset", np.int64), ("length", np.int64)]
+    )
+    index["subject"], index["offset"], index["length"] = subjects, offsets, lengths
+    np.save(tmp / "data.npy", records)
+    np.save(tmp / "index.npy", index)
+    meta = dict(
+        source=csv_path.name,
+        sha256=file_hash(csv_path),
+        id_column=id_column,
+        format_version=FORMAT_VERSION,
+    )
+    with open(tmp / "meta.json", "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def is_valid(csv_path, id_column="id"):
+    """Checks whether the cache of `csv_path` exists and matches the current csv file."""
+    try:
+        with open(cache_dir(csv_path) / "meta.json") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return False
+    return (
+        meta.get("format_version") == FORMAT_VERSION
+        and meta.get("id_column") == id_column
+        and meta.get("sha256") == file_hash(csv_path)
+    )
+
+
+class CachedDataset:
+    """
+    Memory-mapped view of a converted data set.
+
+    Parameters
+    ----------
+    path : str or Path
+        The cache directory, as returned by `convert_dataset`.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.data = np.load(self.path / "data.npy", mmap_mode="r")
+        self.index = np.load(self.path / "index.npy")
+        with open(self.path / "meta.json") as f:
+            self.meta = json.load(f)
+
+    @property
+    def subjects(self):
+        return self.index["subject"]
+
+    def subject_rows(self, idx):
+        """Returns the rows of the subject at position `idx` of the index (a view)."""
+        offset, length = self.index["offset"][idx], self.index["length"][idx]
+        return self.data[offset:offset + length]
+
+    def to_frame(self):
+        """Returns the data set as a pandas DataFrame (a copy)."""
+        import pandas as pd
+
+        return pd.DataFrame(np.asarray(self.data))
+
+    def derived(self, name, build_fn):
+        """
+        Returns a memory-mapped array derived from the data set, building it on first use.
+
+        Derived arrays live in the cache directory and are discarded together with it,
+        so they are invalidated whenever the source csv changes.
+
+        Parameters
+        ----------
+        name : str
+            A file name that uniquely identifies the derived array.
+        build_fn : callable
+            Called with this dataset and returns the array to store.
+
+        Returns
+        -------
+        np.memmap
+            The read-only, memory-mapped array.
+        """
+        path = self.path / f"{name}.npy"
+        if not path.exists():
+            tmp = path.with_name(f"{path.stem}.tmp{os.getpid()}.npy")
+            np.save(tmp, np.ascontiguousarray(build_fn(self)))
+            os.replace(tmp, path)
+        return np.load(path, mmap_mode="r")
+
+    def derived_arrays(self, name, build_fn):
+        """
+        Returns a group of memory-mapped arrays derived from the data set, building them
+        together on first use.
+
+        The arrays are written into a temporary sub-directory that is moved into place
+        once complete, so a group is either fully present or rebuilt. If several processes
+        build the same group at once, the first one to finish is kept.
+
+        Parameters
+        ----------
+        name : str
+            A directory name that uniquely identifies the group.
+        build_fn : callable
+            Called with this dataset and returns a dict of arrays to store.
+
+        Returns
+        -------
+        dict
+            The read-only, memory-mapped arrays by key.
+        """
+        path = self.path / name
+        if not path.exists():
+            tmp = path.with_name(f"{name}.tmp{os.getpid()}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir()
+            try:
+                for key, array in build_fn(self).items():
+                    np.save(tmp / f"{key}.npy", np.ascontiguousarray(array))
+                os.replace(tmp, path)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)
+                # another process moved its identical group into place first
+                if not path.exists():
+                    raise
+            except BaseException:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+        return {p.stem: np.load(p, mmap_mode="r") for p in sorted(path.glob("*.npy"))}
+
+
+def load_dataset(csv_path, id_column="id"):
+    """
+    Loads the binary cache of a csv file, converting the csv first if the cache is
+    missing or outdated.
+
+    Parameters
+    ----------
+    csv_path : str or Path
+        Path to the csv file.
+    id_column : str, optional
+        The column identifying subjects (default is "id").
+
+    Returns
+    -------
+    CachedDataset
+        The memory-mapped data set.
+    """
+    target = cache_dir(csv_path)
+    if not is_valid(csv_path, id_column):
+        convert_dataset(csv_path, id_column, force=False)
+    with _locked(target, shared=True):
+        return CachedDataset(target)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert csv data sets into memory-mappable caches.")
+    parser.add_argument("csv_paths", nargs="+", help="The csv files to convert.")
+    parser.add_argument("--id-column", default="id", help="The column identifying subjects.")
+    parser.add_argument("--force", action="store_true", help="Rebuild caches that are still valid.")
+    args = parser.parse_args()
+    for csv_path in args.csv_paths:
+        if args.force or not is_valid(csv_path, args.id_column):
+            print(f"{csv_path} -> {convert_dataset(csv_path, args.id_column)}")
+        else:
+            print(f"{csv_path} is up to date.")
@@ -0,0 +1,81 @@
+import hashlib
+import inspect
+
+import numpy as np
+
+from dataset_cache import load_dataset, file_hash
+from posterior_sampling import pad_subjects
+
+
+def conditions_key(configure_fn, version, subjects=None):
+    """
+    Returns the name under which the empirical conditions of a configurator are cached.
+
+    The name combines the configurator version, a hash of the source file that defines
+    `configure_fn` and the selected subjects, so editing the encoding invalidates the
+    cache even if the version was not bumped.
+    """
+    key = repr((
+        version,
+        file_hash(inspect.getsourcefile(configure_fn)),
+        None if subjects is None else np.unique(subjects).tolist(),
+    ))
+    return f"conditions_v{version}_" + hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def empirical_conditions(csv_path, forward_dict_fn, configure_fn, version, id_column="id", subjects=None):
+    """
+    Encodes the trials of every subject of an empirical data set exactly like simulated
+    batches, memoized on disk.
+
+    Every subject is converted into a forward dict with a batch size of one by
+    `forward_dict_fn` and passed through `configure_fn`, the same function that
+    `configure_input` applies to simulated batches, so the encoding of the empirical
+    data cannot drift from the one the networks were trained on. The results are stored
+    as derived arrays of the binary cache of the csv (see `dataset_cache`), keyed by
+    `conditions_key`, so they are rebuilt whenever the csv or the configurator changes
+    and memory-mapped otherwise.
+
+    Parameters
+    ----------
+    csv_path : str or Path
+        Path to the csv file with the trial-wise data of all subjects.
+    forward_dict_fn : callable
+        Called with the rows of one subject (a structured array) and returns the data
+        keys of a simulated batch of size one.
+    configure_fn : callable
+        Called with that forward dict and returns a dict with the 'summary_conditions'
+        of shape (1, num_steps, num_features) and, optionally, further conditions of
+        shape (1, ...).
+    version : int
+        The version of the configurator.
+    id_column : str, optional
+        The column identifying subjects (default is "id").
+    subjects : array_like or None, optional
+        If given, only these subjects are encoded.
+
+    Returns
+    -------
+    dict
+        The 'summary_conditions' of shape (num_subjects, max_steps, num_features), padded
+        with zeros, the further conditions stacked over subjects, and the 'lengths' and
+        'subjects' as expected by `posterior_sampling.sample_subjects`.
+    """
+    dataset = load_dataset(csv_path, id_column)
+    positions = np.arange(len(dataset.subjects))
+    if subjects is not None:
+        positions = positions[np.isin(dataset.subjects, subjects)]
+
+    def build(dataset):
+        conditions = [configure_fn(forward_dict_fn(dataset.subject_rows(i))) for i in positions]
+        arrays = {
+            key: np.concatenate([c[key] for c in conditions])
+            for key in conditions[0] if key != "summary_conditions"
+        }
+        arrays["summary_conditions"], arrays["lengths"] = pad_subjects(
+            [c["summary_conditions"][0] for c in conditions]
+        )
+        arrays["subjects"] = dataset.subjects[positions]
+        return arrays
+
+    return dataset.derived_arrays(conditions_key(configure_fn, version, subjects), build)
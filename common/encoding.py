@@ -0,0 +1,49 @@
+import numpy as np
+
+
+def output_buffer(out, shape, dtype=np.float32):
+    """
+    Returns `out` if it can hold an array of the given shape and dtype, or a new empty array.
+
+    Parameters
+    ----------
+    out : np.ndarray or None
+        A buffer from a previous call, to be reused.
+    shape : tuple
+        The required shape.
+    dtype : np.dtype, optional
+        The required dtype (default is np.float32).
+
+    Returns
+    -------
+    np.ndarray
+        An uninitialized array of the given shape and dtype.
+    """
+    if out is not None and out.shape == tuple(shape) and out.dtype == dtype:
+        return out
+    return np.empty(shape, dtype=dtype)
+
+
+def one_hot_into(out, idx):
+    """
+    Writes the one-hot encoding of `idx` into `out`, in place.
+
+    This replaces `keras.utils.to_categorical` without importing tensorflow and without
+    allocating an intermediate array. Unlike `to_categorical`, the number of classes is
+    given by the last axis of `out` and does not depend on the largest index present, and
+    negative indices (e.g. missed responses in empirical data) are encoded as all zeros
+    instead of wrapping around.
+
+    Parameters
+    ----------
+    out : np.ndarray
+        An array of shape (..., num_classes), typically a column slice of the output buffer.
+    idx : np.ndarray
+        An integer-valued array of shape (...) with the class indices.
+    """
+    out[...] = 0
+    idx = idx.astype(np.intp)
+    np.put_along_axis(out, np.maximum(idx, 0)[..., None], 1, axis=-1)
+    missing = idx < 0
+    if missing.any():
+        out[missing] = 0
@@ -0,0 +1,388 @@
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True)
+def softmax(x, tau):
+    """
+    Apply the softmax function to an array of values with a temperature parameter.
+
+    The maximum is subtracted before exponentiating, so large values of `tau` (e.g. up to
+    80 in three_blocks and three_alt_full_feedback) do not overflow.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        A 1D array containing the input values over which the softmax function is to be applied.
+    tau : float
+        The temperature parameter controlling the sharpness of the softmax output.
+        Must be a positive value.
+
+    Returns
+    -------
+    np.ndarray
+        A 1D array of the same shape as `x` with the probabilities of the softmax distribution.
+    """
+    z_max = x[0] * tau
+    for k in range(1, x.shape[0]):
+        z_max = max(z_max, x[k] * tau)
+    out = np.empty(x.shape[0])
+    total = 0.0
+    for k in range(x.shape[0]):
+        out[k] = np.exp(x[k] * tau - z_max)
+        total += out[k]
+    for k in range(x.shape[0]):
+        out[k] /= total
+    return out
+
+
+@njit(cache=True)
+def log_softmax(x, tau):
+    """
+    Compute the logarithm of the softmax function with a temperature parameter.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        A 1D array containing the input values over which the softmax function is to be applied.
+    tau : float
+        The temperature parameter controlling the sharpness of the softmax output.
+        Must be a positive value.
+
+    Returns
+    -------
+    np.ndarray
+        A 1D array of the same shape as `x` with the log-probabilities of the softmax distribution.
+    """
+    z_max = x[0] * tau
+    for k in range(1, x.shape[0]):
+        z_max = max(z_max, x[k] * tau)
+    total = 0.0
+    for k in range(x.shape[0]):
+        total += np.exp(x[k] * tau - z_max)
+    log_total = np.log(total)
+    out = np.empty(x.shape[0])
+    for k in range(x.shape[0]):
+        out[k] = x[k] * tau - z_max - log_total
+    return out
+
+
+@njit(cache=True)
+def sample_categorical(p):
+    """
+    Draws an index from a categorical distribution without allocating.
+
+    The cumulative probabilities are accumulated on the fly and inverted with a single
+    uniform draw, which consumes numba's random stream exactly like
+    `np.searchsorted(np.cumsum(p), np.random.random(), side="right")`.
+
+    Parameters
+    ----------
+    p : np.ndarray
+        A 1D array of probabilities that sum to one.
+
+    Returns
+    -------
+    int
+        The drawn index.
+    """
+    u = np.random.random()
+    cum = 0.0
+    for k in range(p.shape[0] - 1):
+        cum += p[k]
+        if u < cum:
+            return k
+    return p.shape[0] - 1
+
+
+@njit(cache=True)
+def select_action(x, p):
+    """
+    Selects a random action based on a given probability distribution.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        A 1D array of actions or values to select from.
+    p : np.ndarray
+        A 1D array of probabilities associated with each action in `x`. The sum of all
+        probabilities should be 1.
+
+    Returns
+    -------
+    Any
+        A randomly selected action from `x`, chosen according to the probabilities specified in `p`.
+    """
+    return x[sample_categorical(p)]
+
+
+@njit(cache=True)
+def sample_softmax(x, tau):
+    """
+    Draws an index from the softmax distribution over `x` without allocating.
+
+    Equivalent to `sample_categorical(softmax(x, tau))`, with one uniform draw per call.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        A 1D array of values.
+    tau : float
+        The inverse temperature.
+
+    Returns
+    -------
+    int
+        The drawn index into `x`.
+    """
+    z_max = x[0] * tau
+    for k in range(1, x.shape[0]):
+        z_max = max(z_max, x[k] * tau)
+    total = 0.0
+    for k in range(x.shape[0]):
+        total += np.exp(x[k] * tau - z_max)
+    u = np.random.random() * total
+    cum = 0.0
+    for k in range(x.shape[0] - 1):
+        cum += np.exp(x[k] * tau - z_max)
+        if u < cum:
+            return k
+    return x.shape[0] - 1
+
+
+@njit(cache=True)
+def sample_softmax_at(values, idx, tau):
+    """
+    Draws from the softmax distribution over the values of a subset of alternatives
+    without gathering them into a new array.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        A 1D array with the values of all alternatives.
+    idx : np.ndarray
+        A 1D array with the indices of the available alternatives (integer or integral floats).
+    tau : float
+        The inverse temperature.
+
+    Returns
+    -------
+    int
+        The position of the drawn alternative within `idx`.
+    """
+    n = idx.shape[0]
+    z_max = values[int(idx[0])] * tau
+    for k in range(1, n):
+        z_max = max(z_max, values[int(idx[k])] * tau)
+    total = 0.0
+    for k in range(n):
+        total += np.exp(values[int(idx[k])] * tau - z_max)
+    u = np.random.random() * total
+    cum = 0.0
+    for k in range(n - 1):
+        cum += np.exp(values[int(idx[k])] * tau - z_max)
+        if u < cum:
+            return k
+    return n - 1
+
+
+@njit(cache=True)
+def log_softmax_at(values, idx, tau, k):
+    """
+    Computes the log-probability of the alternative at position `k` of `idx` under the
+    softmax distribution over the values of the alternatives in `idx`, without allocating.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        A 1D array with the values of all alternatives.
+    idx : np.ndarray
+        A 1D array with the indices of the available alternatives (integer or integral floats).
+    tau : float
+        The inverse temperature.
+    k : int
+        The position of the chosen alternative within `idx`.
+
+    Returns
+    -------
+    float
+        The log-probability of the chosen alternative.
+    """
+    n = idx.shape[0]
+    z_max = values[int(idx[0])] * tau
+    for j in range(1, n):
+        z_max = max(z_max, values[int(idx[j])] * tau)
+    total = 0.0
+    for j in range(n):
+        total += np.exp(values[int(idx[j])] * tau - z_max)
+    return values[int(idx[k])] * tau - z_max - np.log(total)
+
+
+@njit(cache=True)
+def delta_update(values, i, target, rate):
+    """
+    Applies the delta rule `values[i] += rate * (target - values[i])` in place.
+
+    Returns
+    -------
+    float
+        The prediction error `target - values[i]` before the update.
+    """
+    pe = target - values[i]
+    values[i] += rate * pe
+    return pe
+
+
+@njit(cache=True)
+def decay_toward(values, target, rate):
+    """Moves all entries of the array `values` toward `target` by the fraction `rate`, in place."""
+    flat = values.reshape(-1)
+    for k in range(flat.shape[0]):
+        flat[k] += rate * (target - flat[k])
+
+
+@njit(cache=True)
+def truncnorm_sample(loc, scale, low, high):
+    """
+    Draws a single value from a truncated normal distribution inside a jitted function.
+
+    Bounds that include the bulk of the distribution are handled by plain rejection.
+    If the mode lies outside of the bounds, the one-sided exponential proposal of
+    Robert (1995) is used, so that tails such as N(7, 1) truncated to [0, 6] are
+    still sampled efficiently.
+
+    Parameters
+    ----------
+    loc : float
+        The mean of the untruncated normal distribution.
+    scale : float
+        The standard deviation of the untruncated normal distribution.
+    low : float
+        The lower bound of the support.
+    high : float
+        The upper bound of the support.
+
+    Returns
+    -------
+    float
+        A random draw from the truncated normal distribution.
+    """
+    a = (low - loc) / scale
+    b = (high - loc) / scale
+    if a <= 0 <= b:
+        while True:
+            z = np.random.normal()
+            if a <= z <= b:
+                return loc + scale * z
+    # sample from the tail closest to the mode and mirror if needed
+    flip = b < 0
+    if flip:
+        a, b = -b, -a
+    alpha = (a + np.sqrt(a ** 2 + 4)) / 2
+    while True:
+        z = a + np.random.exponential(1 / alpha)
+        if z <= b and np.random.random() <= np.exp(-(z - alpha) ** 2 / 2):
+            break
+    if flip:
+        z = -z
+    return loc + scale * z
+
+
+@njit(parallel=True, cache=True)
+def softmax_batch(x, tau):
+    """
+    Applies `softmax` to every row of `x`.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        A 2D array of shape (num_rows, num_actions).
+    tau : np.ndarray
+        A 1D array of shape (num_rows,) with the inverse temperature of every row.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D array of the same shape as `x` with the probabilities of every row.
+    """
+    out = np.empty(x.shape)
+    for i in prange(x.shape[0]):
+        out[i] = softmax(x[i], tau[i])
+    return out
+
+
+@njit(parallel=True, cache=True)
+def log_softmax_batch(x, tau):
+    """
+    Applies `log_softmax` to every row of `x`.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        A 2D array of shape (num_rows, num_actions).
+    tau : np.ndarray
+        A 1D array of shape (num_rows,) with the inverse temperature of every row.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D array of the same shape as `x` with the log-probabilities of every row.
+    """
+    out = np.empty(x.shape)
+    for i in prange(x.shape[0]):
+        out[i] = log_softmax(x[i], tau[i])
+    return out
+
+
+@njit(parallel=True, cache=True)
+def sample_categorical_batch(p, seeds):
+    """
+    Draws one index per row of `p` with `sample_categorical`.
+
+    Every row `i` reseeds numba's random state with `seeds[i]`, so the draws are
+    reproducible regardless of the number of threads.
+
+    Parameters
+    ----------
+    p : np.ndarray
+        A 2D array of shape (num_rows, num_actions) with the probabilities of every row.
+    seeds : np.ndarray
+        A 1D array of shape (num_rows,) with one integer seed per row.
+
+    Returns
+    -------
+    np.ndarray
+        A 1D integer array of shape (num_rows,) with the drawn indices.
+    """
+    out = np.empty(p.shape[0], dtype=np.int64)
+    for i in prange(p.shape[0]):
+        np.random.seed(seeds[i])
+        out[i] = sample_categorical(p[i])
+    return out
+
+
+@njit(parallel=True, cache=True)
+def sample_softmax_batch(x, tau, seeds):
+    """
+    Draws one index per row of `x` from its softmax distribution with `sample_softmax`.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        A 2D array of shape (num_rows, num_actions) with the values of every row.
+    tau : np.ndarray
+        A 1D array of shape (num_rows,) with the inverse temperature of every row.
+    seeds : np.ndarray
+        A 1D array of shape (num_rows,) with one integer seed per row, see
+        `sample_categorical_batch`.
+
+    Returns
+    -------
+    np.ndarray
+        A 1D integer array of shape (num_rows,) with the drawn indices.
+    """
+    out = np.empty(x.shape[0], dtype=np.int64)
+    for i in prange(x.shape[0]):
+        np.random.seed(seeds[i])
+        out[i] = sample_softmax(x[i], tau[i])
+    return out
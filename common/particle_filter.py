@@ -0,0 +1,249 @@
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True)
+def systematic_resample(weights, u):
+    """
+    Draws ancestor indices by systematic resampling.
+
+    Parameters
+    ----------
+    weights : np.ndarray
+        A 1D array of normalized particle weights.
+    u : float
+        A uniform random number in [0, 1), shared by all strata.
+
+    Returns
+    -------
+    np.ndarray
+        A 1D integer array with the index of the ancestor of every new particle.
+    """
+    num_particles = weights.shape[0]
+    ancestors = np.empty(num_particles, dtype=np.int64)
+    cum_weight = weights[0]
+    j = 0
+    for i in range(num_particles):
+        position = (i + u) / num_particles
+        while position > cum_weight and j < num_particles - 1:
+            j += 1
+            cum_weight += weights[j]
+        ancestors[i] = j
+    return ancestors
+
+
+@njit(cache=True)
+def _weighted_moments(particles, weights, mean, std):
+    num_params = particles.shape[1]
+    for p in range(num_params):
+        m = 0.0
+        for j in range(particles.shape[0]):
+            m += weights[j] * particles[j, p]
+        v = 0.0
+        for j in range(particles.shape[0]):
+            v += weights[j] * (particles[j, p] - m) ** 2
+        mean[p] = m
+        std[p] = np.sqrt(v)
+
+
+@njit(cache=True)
+def _reweight(log_w, log_lik, weights):
+    """
+    Adds the log-likelihoods to the log weights, normalizes the weights into `weights` and
+    returns the log of the weighted mean likelihood and the effective sample size.
+    """
+    max_log_w = -np.inf
+    for j in range(log_w.shape[0]):
+        log_w[j] += log_lik[j]
+        max_log_w = max(max_log_w, log_w[j])
+    total = 0.0
+    for j in range(log_w.shape[0]):
+        weights[j] = np.exp(log_w[j] - max_log_w)
+        total += weights[j]
+    weights /= total
+    return max_log_w + np.log(total), 1 / np.sum(weights ** 2)
+
+
+@njit(cache=True)
+def _smooth(history, ancestry, weights):
+    """
+    Returns the moments of p(theta_t | y_1:T), estimated by tracing the ancestral lineages
+    of the final weighted particles.
+    """
+    num_steps, num_particles, num_params = history.shape
+    smoothed_mean = np.zeros((num_steps, num_params))
+    smoothed_std = np.zeros((num_steps, num_params))
+    lineage = np.arange(num_particles)
+    paths = np.empty((num_particles, num_params))
+    for t in range(num_steps - 1, -1, -1):
+        for j in range(num_particles):
+            paths[j] = history[t, lineage[j]]
+        _weighted_moments(paths, weights, smoothed_mean[t], smoothed_std[t])
+        for j in range(num_particles):
+            lineage[j] = ancestry[t, lineage[j]]
+    return smoothed_mean, smoothed_std
+
+
+# the kernels that take the model functions as arguments are not cached: numba cannot
+# cache a function whose arguments are other jitted functions, so they compile once per
+# process; the bookkeeping above is cached
+@njit(parallel=True)
+def _score(step, theta, params, values, context, data, t, log_lik):
+    for j in prange(theta.shape[0]):
+        log_lik[j] = step(theta[j], params, values[j], context, data, t)
+
+
+@njit
+def bootstrap_filter(initial, transition, step, eta, params, context, data,
+                     num_particles, num_params, num_values, ess_threshold, seed):
+    """
+    Bootstrap particle filter for time-varying learning-model parameters theta_t.
+
+    The particles are propagated with the transition kernel of the prior (the bootstrap
+    proposal), weighted with the likelihood of the observed response and resampled by
+    systematic resampling whenever the effective sample size drops below
+    `ess_threshold * num_particles`. Every particle carries its own learning state
+    (e.g. Q-values), which `step` updates in place.
+
+    All random draws (initial states, transitions, resampling) are made sequentially from
+    numba's random state seeded with `seed`, so results are reproducible regardless of the
+    number of threads. The likelihood evaluations, which dominate the cost, run in parallel.
+
+    Parameters
+    ----------
+    initial : callable
+        Jitted function `initial(theta)` that draws a particle from the prior over theta_0
+        into the 1D array `theta`.
+    transition : callable
+        Jitted function `transition(theta_prev, theta, eta, context, t)` that draws theta_t
+        given theta_{t-1} into the 1D array `theta`.
+    step : callable
+        Jitted function `step(theta, params, values, context, data, t)` that returns the
+        log-probability of the observation at trial t and updates the learning state
+        `values` in place. It is responsible for (re-)initializing `values` at t == 0.
+    eta : np.ndarray
+        The hyper parameters of the transition model.
+    params : np.ndarray
+        Time-constant parameters of the learning model passed on to `step` (may be empty).
+    context : np.ndarray
+        The context of the subject, indexed by trial along the first axis.
+    data : np.ndarray
+        The observed responses of the subject, indexed by trial along the first axis.
+    num_particles : int
+        The number of particles.
+    num_params : int
+        The number of time-varying parameters.
+    num_values : int
+        The size of the learning state of a particle.
+    ess_threshold : float
+        Relative effective sample size below which the particles are resampled.
+    seed : int
+        The seed of numba's random state.
+
+    Returns
+    -------
+    filtered_mean, filtered_std : np.ndarray
+        Arrays of shape (num_steps, num_params) with the moments of p(theta_t | y_1:t).
+    smoothed_mean, smoothed_std : np.ndarray
+        Arrays of shape (num_steps, num_params) with the moments of p(theta_t | y_1:T),
+        estimated by tracing the ancestral lineages of the final particles.
+    ess : np.ndarray
+        A 1D array of shape (num_steps,) with the effective sample size after weighting.
+    log_evidence : float
+        The estimate of log p(y_1:T).
+    """
+    np.random.seed(seed)
+    num_steps = data.shape[0]
+    theta = np.empty((num_particles, num_params))
+    theta_prev = np.empty((num_particles, num_params))
+    values = np.zeros((num_particles, num_values))
+    values_prev = np.zeros((num_particles, num_values))
+    history = np.empty((num_steps, num_particles, num_params))
+    ancestry = np.empty((num_steps, num_particles), dtype=np.int64)
+    log_w = np.full(num_particles, -np.log(num_particles))
+    log_lik = np.zeros(num_particles)
+    weights = np.full(num_particles, 1 / num_particles)
+    filtered_mean = np.zeros((num_steps, num_params))
+    filtered_std = np.zeros((num_steps, num_params))
+    ess = np.zeros(num_steps)
+    log_evidence = 0.0
+
+    for j in range(num_particles):
+        initial(theta[j])
+        ancestry[0, j] = j
+
+    for t in range(num_steps):
+        if t > 0:
+            for j in range(num_particles):
+                transition(theta_prev[j], theta[j], eta, context, t)
+        _score(step, theta, params, values, context, data, t, log_lik)
+
+        # update the evidence with the weighted mean likelihood and normalize the weights
+        log_mean_lik, ess[t] = _reweight(log_w, log_lik, weights)
+        log_evidence += log_mean_lik
+
+        history[t] = theta
+        _weighted_moments(theta, weights, filtered_mean[t], filtered_std[t])
+
+        # resample into the buffers of the previous step
+        if ess[t] < ess_threshold * num_particles:
+            ancestors = systematic_resample(weights, np.random.random())
+            log_w[:] = -np.log(num_particles)
+        else:
+            ancestors = np.arange(num_particles)
+            log_w = np.log(weights)
+        for j in range(num_particles):
+            theta_prev[j] = theta[ancestors[j]]
+            values_prev[j] = values[ancestors[j]]
+        if t < num_steps - 1:
+            ancestry[t + 1] = ancestors
+        values, values_prev = values_prev, values
+
+    smoothed_mean, smoothed_std = _smooth(history, ancestry, weights)
+    return filtered_mean, filtered_std, smoothed_mean, smoothed_std, ess, log_evidence
+
+
+def run_filter(initial, transition, step, eta, context, data, num_params, num_values,
+               params=None, num_particles=2000, ess_threshold=0.5, seed=None):
+    """
+    Runs `bootstrap_filter` for one subject and collects the results in a dictionary.
+
+    Parameters
+    ----------
+    initial, transition, step : callable
+        The jitted model kernels, see `bootstrap_filter`.
+    eta : array_like
+        The hyper parameters of the transition model, e.g. posterior means of the amortizer.
+    context : np.ndarray
+        The context of the subject.
+    data : np.ndarray
+        The observed responses of the subject.
+    num_params : int
+        The number of time-varying parameters.
+    num_values : int
+        The size of the learning state of a particle.
+    params : array_like or None, optional
+        Time-constant parameters of the learning model.
+    num_particles : int, optional
+        The number of particles (default is 2000).
+    ess_threshold : float, optional
+        Relative effective sample size below which the particles are resampled (default is 0.5).
+    seed : int or None, optional
+        The seed of the filter. If None, a random seed is drawn.
+
+    Returns
+    -------
+    dict
+        The keys 'filtered_mean', 'filtered_std', 'smoothed_mean', 'smoothed_std', 'ess'
+        and 'log_evidence'.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().generate_state(1)[0]
+    params = np.zeros(0) if params is None else np.asarray(params, dtype=np.float64)
+    results = bootstrap_filter(
+        initial, transition, step, np.asarray(eta, dtype=np.float64), params,
+        np.ascontiguousarray(context), np.ascontiguousarray(data),
+        num_particles, num_params, num_values, ess_threshold, seed
+    )
+    keys = ("filtered_mean", "filtered_std", "smoothed_mean", "smoothed_std", "ess", "log_evidence")
+    return dict(zip(keys, results))
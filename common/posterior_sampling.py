@@ -0,0 +1,255 @@
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 2 ** 30
+# assumed size of the network activations per sampled local row, relative to its condition
+ACTIVATION_FACTOR = 4
+
+
+def pad_subjects(arrays, fill_value=0.0):
+    """
+    Stacks per-subject arrays of different lengths into one padded array.
+
+    Parameters
+    ----------
+    arrays : list of np.ndarray
+        One array of shape (num_steps_i, num_features) per subject.
+    fill_value : float, optional
+        The value of the padded trials (default is 0).
+
+    Returns
+    -------
+    padded : np.ndarray
+        A float32 array of shape (num_subjects, max_steps, num_features).
+    lengths : np.ndarray
+        A 1D integer array with the number of trials of every subject.
+    """
+    lengths = np.array([len(a) for a in arrays])
+    padded = np.full((len(arrays), lengths.max(), arrays[0].shape[-1]), fill_value, dtype=np.float32)
+    for i, a in enumerate(arrays):
+        padded[i, :lengths[i]] = a
+    return padded, lengths
+
+
+def length_buckets(lengths):
+    """
+    Groups subjects by their number of trials.
+
+    Returns
+    -------
+    list of tuple
+        (num_steps, indices) for every distinct number of trials, in ascending order.
+    """
+    lengths = np.asarray(lengths)
+    return [(int(n), np.flatnonzero(lengths == n)) for n in np.unique(lengths)]
+
+
+def _chunk_sizes(num_steps, n_samples, row_bytes, max_bytes):
+    """Returns the number of subjects and samples per local sampling call within `max_bytes`."""
+    rows = max(1, max_bytes // row_bytes)
+    if num_steps * n_samples <= rows:
+        return rows // (num_steps * n_samples), n_samples
+    return 1, max(1, rows // num_steps)
+
+
+def _reshape_samples(samples, shape):
+    # bayesflow squeezes the data set axis for a single data set
+    return np.asarray(samples, dtype=np.float32).reshape(shape)
+
+
+def sample_bucket(amortizer, summary_conditions, n_samples, direct_conditions=None,
+                  max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Draws two-level posterior samples for a batch of subjects with the same number of trials.
+
+    This is the computation of `TwoLevelAmortizedPosterior.sample`, which handles a single
+    data set per call, applied to many subjects at once: the summary network runs on all
+    subjects in one forward pass, the global amortizer draws `n_samples` global samples
+    per subject, conditioned on the global summary and the direct conditions of the
+    subject, and the local amortizer draws one local sample per trial conditioned on
+    the local summary and the matching global sample. The local sampling, which dominates
+    memory, is split into chunks of subjects (and, if needed, of samples) whose condition
+    tensor fits into `max_bytes`.
+
+    Parameters
+    ----------
+    amortizer : bayesflow.amortizers.TwoLevelAmortizedPosterior
+        The trained amortizer. Its summary network must be a two-level
+        `HierarchicalNetwork`.
+    summary_conditions : np.ndarray
+        An array of shape (num_subjects, num_steps, num_features) as produced by the
+        configurator of the model.
+    n_samples : int
+        The number of posterior samples per subject.
+    direct_conditions : np.ndarray or None, optional
+        An array of shape (num_subjects, num_direct) with the 'direct_conditions' of the
+        configurator, e.g. the scaled number of trials in rlwm. Like
+        `TwoLevelAmortizedPosterior`, they are appended to the global summaries.
+    max_bytes : int, optional
+        The memory budget of a local sampling call (default is 1 GiB).
+
+    Returns
+    -------
+    global_samples : np.ndarray
+        A float32 array of shape (num_subjects, n_samples, num_global_params).
+    local_samples : np.ndarray
+        A float32 array of shape (num_subjects, num_steps, n_samples, num_local_params).
+    """
+    num_subjects, num_steps = summary_conditions.shape[:2]
+    local_summaries, global_summaries = amortizer.summary_net(
+        np.asarray(summary_conditions, dtype=np.float32), return_all=True
+    )
+    local_summaries = np.asarray(local_summaries, dtype=np.float32)
+    if direct_conditions is not None:
+        global_summaries = np.concatenate(
+            [global_summaries, np.asarray(direct_conditions, dtype=np.float32).reshape(num_subjects, -1)],
+            axis=-1,
+        )
+    global_samples = _reshape_samples(
+        amortizer.global_amortizer.sample({"direct_conditions": global_summaries}, n_samples),
+        (num_subjects, n_samples, -1),
+    )
+    num_local = amortizer.local_amortizer.inference_net.latent_dim
+    cond_dim = local_summaries.shape[-1] + global_samples.shape[-1]
+    row_bytes = 4 * (cond_dim + num_local) * ACTIVATION_FACTOR
+    subjects_per_call, samples_per_call = _chunk_sizes(num_steps, n_samples, row_bytes, max_bytes)
+
+    local_samples = np.empty((num_subjects, num_steps, n_samples, num_local), dtype=np.float32)
+    for start in range(0, num_subjects, subjects_per_call):
+        stop = min(start + subjects_per_call, num_subjects)
+        for s_start in range(0, n_samples, samples_per_call):
+            s_stop = min(s_start + samples_per_call, n_samples)
+            n, s = stop - start, s_stop - s_start
+            # condition of every (subject, trial, sample): local summary and global sample
+            local = local_summaries[start:stop, :, None]
+            glob = global_samples[start:stop, None, s_start:s_stop]
+            conditions = np.concatenate([
+                np.broadcast_to(local, (n, num_steps, s, local.shape[-1])),
+                np.broadcast_to(glob, (n, num_steps, s, glob.shape[-1])),
+            ], axis=-1).reshape(n * num_steps, s, cond_dim)
+            samples = amortizer.local_amortizer.sample({"direct_conditions": conditions}, s)
+            local_samples[start:stop, :, s_start:s_stop] = _reshape_samples(samples, (n, num_steps, s, num_local))
+    return global_samples, local_samples
+
+
+def sample_subjects(amortizer, summary_conditions, n_samples, lengths=None, subjects=None,
+                    direct_conditions=None, output=None, max_bytes=DEFAULT_MAX_BYTES, seed=None):
+    """
+    Draws two-level posterior samples for all subjects of a study.
+
+    Subjects are grouped into buckets of equal length and every bucket is sampled with
+    `sample_bucket`. Padded trials are never passed through the summary network, since
+    its recurrent layers are not mask-aware and padding would change the summaries. The
+    results are stored padded to the longest subject, with NaN local samples and a
+    False mask on the padded trials.
+
+    Parameters
+    ----------
+    amortizer : bayesflow.amortizers.TwoLevelAmortizedPosterior
+        The trained amortizer.
+    summary_conditions : np.ndarray or list of np.ndarray
+        Either a padded array of shape (num_subjects, max_steps, num_features) together
+        with `lengths`, or one (num_steps_i, num_features) array per subject.
+    n_samples : int
+        The number of posterior samples per subject.
+    lengths : array_like or None, optional
+        The number of trials of every subject. Inferred if `summary_conditions` is a list;
+        if None for a padded array, all subjects use all trials.
+    subjects : array_like or None, optional
+        The subject identifiers, stored alongside the samples.
+    direct_conditions : np.ndarray or None, optional
+        An array of shape (num_subjects, num_direct) with the direct conditions of every
+        subject, required if the amortizer was trained with them (rlwm).
+    output : str or Path or None, optional
+        If given, the results are written into this directory as memory-mapped `.npy`
+        files (see `load_posterior`) instead of being kept in memory.
+    max_bytes : int, optional
+        The memory budget of a local sampling call (default is 1 GiB).
+    seed : int or None, optional
+        If given, seeds tensorflow's global random generator.
+
+    Returns
+    -------
+    dict
+        The keys 'global_samples' (num_subjects, n_samples, num_global_params),
+        'local_samples' (num_subjects, max_steps, n_samples, num_local_params), 'mask'
+        (num_subjects, max_steps), 'lengths' and 'subjects'.
+    """
+    if seed is not None:
+        import tensorflow as tf
+
+        tf.random.set_seed(seed)
+    if isinstance(summary_conditions, (list, tuple)):
+        summary_conditions, lengths = pad_subjects(summary_conditions)
+    num_subjects, max_steps = summary_conditions.shape[:2]
+    lengths = np.full(num_subjects, max_steps) if lengths is None else np.asarray(lengths)
+    subjects = np.arange(num_subjects) if subjects is None else np.asarray(subjects)
+    if direct_conditions is not None:
+        direct_conditions = np.asarray(direct_conditions, dtype=np.float32).reshape(num_subjects, -1)
+    buckets = length_buckets(lengths)
+
+    results = None
+    start = time.perf_counter()
+    for num_steps, idx in buckets:
+        global_samples, local_samples = sample_bucket(
+            amortizer, summary_conditions[idx, :num_steps], n_samples,
+            None if direct_conditions is None else direct_conditions[idx], max_bytes
+        )
+        if results is None:
+            shapes = dict(
+                global_samples=(num_subjects, *global_samples.shape[1:]),
+                local_samples=(num_subjects, max_steps, *local_samples.shape[2:]),
+            )
+            results = _allocate(output, shapes)
+        results["global_samples"][idx] = global_samples
+        results["local_samples"][idx, :num_steps] = local_samples
+    results["mask"] = np.arange(max_steps)[None, :] < lengths[:, None]
+    results["lengths"] = lengths
+    results["subjects"] = subjects
+    if output is not None:
+        _finalize(output, results, n_samples, time.perf_counter() - start)
+    return results
+
+
+def _allocate(output, shapes):
+    if output is None:
+        return {key: np.full(shape, np.nan, dtype=np.float32) for key, shape in shapes.items()}
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    arrays = {}
+    for key, shape in shapes.items():
+        arrays[key] = np.lib.format.open_memmap(output / f"{key}.npy", mode="w+", dtype=np.float32, shape=shape)
+        arrays[key][...] = np.nan
+    return arrays
+
+
+def _finalize(output, results, n_samples, seconds):
+    output = Path(output)
+    for key in ("global_samples", "local_samples"):
+        results[key].flush()
+    for key in ("mask", "lengths", "subjects"):
+        np.save(output / f"{key}.npy", results[key])
+    with open(output / "meta.json", "w") as f:
+        json.dump(dict(n_samples=n_samples, num_subjects=len(results["lengths"]), seconds=seconds), f, indent=2)
+
+
+def load_posterior(directory):
+    """
+    Loads posterior samples written by `sample_subjects`, memory-mapping the sample arrays.
+
+    Returns
+    -------
+    dict
+        The same keys as returned by `sample_subjects`.
+    """
+    directory = Path(directory)
+    results = {
+        key: np.load(directory / f"{key}.npy", mmap_mode="r")
+        for key in ("global_samples", "local_samples")
+    }
+    for key in ("mask", "lengths", "subjects"):
+        results[key] = np.load(directory / f"{key}.npy", allow_pickle=False)
+    return results
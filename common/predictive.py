@@ -0,0 +1,159 @@
+import numpy as np
+
+DEFAULT_LEVELS = (0.5, 0.8, 0.95)
+
+
+def subject_draws(local_samples, length, mean, std, lower_bounds=None, upper_bounds=None):
+    """
+    Returns the posterior draws of one subject in the layout of the predictive kernels.
+
+    Parameters
+    ----------
+    local_samples : np.ndarray
+        The standardized local samples of one subject, of shape (max_steps, num_draws,
+        num_params), e.g. `posterior["local_samples"][i]` of `sample_subjects`.
+    length : int
+        The number of trials of the subject; padded trials are dropped.
+    mean, std : array_like
+        The prior mean and standard deviation used by the configurator.
+    lower_bounds, upper_bounds : array_like or None, optional
+        If given, the draws are clipped to the support of the model.
+
+    Returns
+    -------
+    np.ndarray
+        A float64 array of shape (num_draws, length, num_params).
+    """
+    theta = np.swapaxes(np.asarray(local_samples[:length], dtype=np.float64), 0, 1) * std + mean
+    if lower_bounds is not None or upper_bounds is not None:
+        np.clip(theta, lower_bounds, upper_bounds, out=theta)
+    return np.ascontiguousarray(theta)
+
+
+def group_bins(keys):
+    """
+    Maps every trial to the bin of a learning curve given by one or more grouping keys.
+
+    Parameters
+    ----------
+    keys : list of np.ndarray
+        One 1D array of shape (num_steps,) per grouping, e.g. the set size and the
+        stimulus iteration of every trial.
+
+    Returns
+    -------
+    bins : np.ndarray
+        A 1D int64 array of shape (num_steps,) with the bin of every trial.
+    labels : np.ndarray
+        An array of shape (num_bins, num_keys) with the key values of every bin, sorted
+        lexicographically.
+    """
+    stacked = np.stack([np.asarray(key, dtype=np.float64) for key in keys], axis=1)
+    labels, bins = np.unique(stacked, axis=0, return_inverse=True)
+    return bins.reshape(-1).astype(np.int64), labels
+
+
+def running_count(keys, within=None):
+    """
+    Returns the number of earlier trials with the same key, e.g. the iteration of a
+    stimulus, restarting the count whenever `within` (e.g. the block) changes.
+    """
+    keys = np.asarray(keys)
+    num_steps = len(keys)
+    segment = np.zeros(num_steps)
+    if within is not None:
+        within = np.asarray(within)
+        segment[1:] = np.cumsum(within[1:] != within[:-1])
+    _, group = np.unique(np.stack([segment, keys], axis=1), axis=0, return_inverse=True)
+    group = group.reshape(-1)
+    # rank of every trial within its group, in trial order
+    order = np.argsort(group, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(group[order]) != 0])
+    count = np.empty(num_steps, dtype=np.int64)
+    count[order] = np.arange(num_steps) - np.repeat(starts, np.diff(np.r_[starts, num_steps]))
+    return count
+
+
+def learning_curves(sums, bins, labels, by, observed=None):
+    """
+    Packs the binned scores of simulated posterior draws of one subject.
+
+    Parameters
+    ----------
+    sums : np.ndarray
+        An array of shape (num_draws, num_bins) with the summed score of every draw per bin,
+        as returned by the `predictive_batch` kernels of the packages.
+    bins, labels : np.ndarray
+        The trial bins and bin labels of `group_bins`.
+    by : tuple of str
+        The names of the grouping keys.
+    observed : np.ndarray or None, optional
+        The observed score of every trial. Trials with a NaN score are left out.
+
+    Returns
+    -------
+    dict
+        The keys 'by', 'labels', 'sums', 'counts' (the number of trials per bin) and, if
+        `observed` is given, 'observed_sums' and 'observed_counts'. Curves of several
+        subjects are combined with `combine_curves` and summarized with `summarize_curves`.
+    """
+    num_bins = len(labels)
+    curves = dict(by=tuple(by), labels=labels, sums=sums,
+                  counts=np.bincount(bins, minlength=num_bins).astype(np.float64))
+    if observed is not None:
+        observed = np.asarray(observed, dtype=np.float64)
+        valid = ~np.isnan(observed)
+        curves["observed_sums"] = np.bincount(bins[valid], observed[valid], minlength=num_bins)
+        curves["observed_counts"] = np.bincount(bins[valid], minlength=num_bins).astype(np.float64)
+    return curves
+
+
+def combine_curves(curves):
+    """
+    Pools the learning curves of several subjects, e.g. of a whole study.
+
+    Draw `d` of the pooled curve averages draw `d` of every subject, so all subjects must
+    have the same number of posterior draws. Bins are matched by their labels; a bin
+    that some subjects lack pools the subjects that have it.
+    """
+    labels = np.unique(np.concatenate([c["labels"] for c in curves]), axis=0)
+    index = {tuple(label): i for i, label in enumerate(labels)}
+    num_draws = curves[0]["sums"].shape[0]
+    pooled = dict(by=curves[0]["by"], labels=labels, sums=np.zeros((num_draws, len(labels))),
+                  counts=np.zeros(len(labels)))
+    has_observed = all("observed_sums" in c for c in curves)
+    if has_observed:
+        pooled["observed_sums"] = np.zeros(len(labels))
+        pooled["observed_counts"] = np.zeros(len(labels))
+    for c in curves:
+        idx = np.array([index[tuple(label)] for label in c["labels"]])
+        for key in ("sums", "counts", "observed_sums", "observed_counts"):
+            if key in pooled:
+                np.add.at(pooled[key], (Ellipsis, idx), c[key])
+    return pooled
+
+
+def summarize_curves(curves, levels=DEFAULT_LEVELS):
+    """
+    Summarizes the predictive distribution of learning curves.
+
+    Returns
+    -------
+    dict
+        The 'by' and 'labels' of the bins, the per-draw curves 'draws' of shape
+        (num_draws, num_bins), their 'mean' and 'median', the central intervals 'lower'
+        and 'upper' of shape (num_levels, num_bins) for the credibility `levels`, the
+        'counts' and, if available, the 'observed' curve.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        draws = curves["sums"] / curves["counts"]
+        levels = np.asarray(levels)
+        summary = dict(
+            by=curves["by"], labels=curves["labels"], counts=curves["counts"], draws=draws,
+            mean=draws.mean(axis=0), median=np.median(draws, axis=0), levels=levels,
+            lower=np.quantile(draws, (1 - levels) / 2, axis=0),
+            upper=np.quantile(draws, (1 + levels) / 2, axis=0),
+        )
+        if "observed_sums" in curves:
+            summary["observed"] = curves["observed_sums"] / curves["observed_counts"]
+    return summary
@@ -0,0 +1,314 @@
+import multiprocessing as mp
+import queue
+import time
+import traceback
+import warnings
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from autotune import model_of, pin_threads, tuned
+from rng import seed_sequence, batch_sequence
+
+DEFAULT_SLOT_BYTES = 16 * 2 ** 20
+ALIGNMENT = 64
+# batch index of the stream of the batches simulated synchronously by a seeded prefetcher,
+# far beyond the indices of the prefetched batches
+SYNC_STREAM = 2 ** 32
+# seconds between the checks that the workers are still alive while waiting for a batch
+POLL_SECONDS = 1.0
+
+
+def passthrough(forward_dict):
+    """Configurator for trainers fed by a `Prefetcher`, whose batches are already configured."""
+    return forward_dict
+
+
+def _attach(name):
+    """Attaches to the shared memory block created by the `Prefetcher`."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13: workers share the resource tracker of the parent process, which
+        # unlinks the block only once, so attaching with tracking is harmless
+        return shared_memory.SharedMemory(name=name)
+
+
+def _write_slot(buffer, out_dict):
+    """
+    Copies the arrays of `out_dict` into `buffer` and returns the layout needed to read
+    them back, or None if they do not fit.
+    """
+    layout = []
+    offset = 0
+    for key, value in out_dict.items():
+        if not isinstance(value, np.ndarray):
+            layout.append((key, None, None, None, value))
+            continue
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        if offset + value.nbytes > len(buffer):
+            return None
+        target = np.ndarray(value.shape, dtype=value.dtype, buffer=buffer, offset=offset)
+        target[...] = value
+        layout.append((key, value.dtype.str, value.shape, offset, None))
+        offset += value.nbytes
+    return layout
+
+
+def _read_slot(buffer, layout):
+    """Copies the arrays described by `layout` out of `buffer` into a new dictionary."""
+    out_dict = {}
+    for key, dtype, shape, offset, value in layout:
+        if dtype is None:
+            out_dict[key] = value
+        else:
+            out_dict[key] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset).copy()
+    return out_dict
+
+
+def _simulate(simulator, configurator, batch_size, seed):
+    out_dict = simulator(batch_size) if seed is None else simulator(batch_size, seed=seed)
+    return out_dict if configurator is None else configurator(out_dict)
+
+
+def _worker(simulator, configurator, batch_size, num_threads, shm_name, slot_bytes, free_slots, filled_slots):
+    pin_threads(num_threads)
+    shm = _attach(shm_name)
+    try:
+        while True:
+            task = free_slots.get()
+            if task is None:
+                break
+            slot, index, seed = task
+            try:
+                out_dict = _simulate(simulator, configurator, batch_size, seed)
+            except Exception:
+                filled_slots.put((slot, index, "error", traceback.format_exc()))
+                break
+            buffer = shm.buf[slot * slot_bytes:(slot + 1) * slot_bytes]
+            layout = _write_slot(buffer, out_dict)
+            buffer.release()
+            if layout is None:
+                # batch larger than a slot: fall back to sending it through the queue
+                filled_slots.put((slot, index, "inline", out_dict))
+            else:
+                filled_slots.put((slot, index, "shm", layout))
+    finally:
+        shm.close()
+
+
+class Prefetcher:
+    """
+    Runs the simulator in a pool of worker processes that fill a bounded ring buffer
+    of configured batches ahead of the trainer.
+
+    Each worker repeatedly takes a free slot of the ring buffer, simulates a batch with
+    `simulator(batch_size)`, passes it through `configurator` and writes the resulting
+    arrays into the slot, which lives in a single shared memory block. The trainer calls
+    the prefetcher like a generative model and receives the oldest finished batch, so
+    simulation of the next batches overlaps with the network update.
+
+    Workers are started with the "spawn" method by default, so every worker imports the
+    model modules afresh and gets its own module-level random number generators. Forked
+    workers would inherit identical generator states and produce duplicate batches.
+
+    With a `seed`, batch `i` is simulated as `simulator(batch_size, seed=batch_sequence(seed, i))`
+    and the batches are returned in the order of their index, so the sequence of batches
+    is bit-reproducible regardless of the number of workers and matches the shards of
+    `simulation_store.simulate_to_disk` with the same seed.
+
+    Parameters
+    ----------
+    simulator : callable
+        The generative model, called as `simulator(batch_size)`. Must be picklable, e.g. a
+        module-level function such as `generative_model` or a bayesflow generative model.
+    configurator : callable or None, optional
+        The configurator applied to every simulated batch inside the workers.
+    batch_size : int, optional
+        The batch size of the prefetched batches (default is 32). Must match the batch
+        size of the trainer, since other sizes are simulated in the trainer process.
+    num_workers : int or None, optional
+        The number of worker processes. None means the tuned number, or 2.
+    queue_depth : int or None, optional
+        The number of slots of the ring buffer, i.e. the maximum number of batches that
+        are simulated ahead of the trainer. None means twice the number of workers, and
+        at least 4.
+    slot_bytes : int, optional
+        The size of one slot in bytes. Batches that do not fit are sent through the
+        result queue instead (default is 16 MiB).
+    start_method : str, optional
+        The multiprocessing start method of the workers (default is "spawn").
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the experiment. Requires a simulator with a `seed` keyword, such as the
+        `generative_model` functions of the model packages. If None, every batch draws
+        fresh entropy.
+    num_threads : int or None, optional
+        The number of numba threads of every worker. None means the tuned number, or all
+        cores, in which case several workers compete for the same cores.
+
+    Examples
+    --------
+    >>> prefetcher = Prefetcher(generative_model, configure_input, batch_size=16, num_workers=4)
+    >>> trainer = bf.trainers.Trainer(
+    ...     amortizer=amortizer, generative_model=prefetcher, configurator=passthrough
+    ... )
+    """
+
+    def __init__(self, simulator, configurator=None, batch_size=32, num_workers=None, queue_depth=None,
+                 slot_bytes=DEFAULT_SLOT_BYTES, start_method="spawn", seed=None, num_threads=None):
+        model = model_of(simulator)
+        num_workers = tuned(model, "num_workers", num_workers)
+        num_threads = tuned(model, "worker_threads", num_threads)
+        queue_depth = max(4, 2 * num_workers) if queue_depth is None else queue_depth
+        if queue_depth < num_workers:
+            raise ValueError("queue_depth must be at least num_workers to keep every worker busy.")
+        self.simulator = simulator
+        self.configurator = configurator
+        self.batch_size = batch_size
+        self.slot_bytes = -(-slot_bytes // ALIGNMENT) * ALIGNMENT
+        self.seed = None if seed is None else seed_sequence(seed)
+        # index of the next batch handed to a worker, of the next batch returned, and the
+        # batches that finished ahead of it
+        self._next_index = 0
+        self._expected = 0
+        self._pending = {}
+        self._sync_count = 0
+        self._sync_sizes = set()
+        self._shm = shared_memory.SharedMemory(create=True, size=queue_depth * self.slot_bytes)
+        ctx = mp.get_context(start_method)
+        self._free_slots = ctx.Queue()
+        self._filled_slots = ctx.Queue()
+        for slot in range(queue_depth):
+            self._release(slot)
+        self._workers = [
+            ctx.Process(
+                target=_worker,
+                args=(simulator, configurator, batch_size, num_threads, self._shm.name, self.slot_bytes,
+                      self._free_slots, self._filled_slots),
+                daemon=True,
+            )
+            for _ in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._closed = False
+
+    def _release(self, slot):
+        """Hands `slot` to the workers together with the index and seed of the next batch."""
+        index = self._next_index
+        seed = None if self.seed is None else batch_sequence(self.seed, index)
+        self._free_slots.put((slot, index, seed))
+        self._next_index += 1
+
+    def _get_filled(self, timeout):
+        """
+        Waits for the next filled slot, checking every POLL_SECONDS that all workers are
+        still alive, so a worker killed without a Python exception (e.g. by the OOM killer
+        or a segfault) raises instead of blocking forever.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = POLL_SECONDS if deadline is None else max(0, min(POLL_SECONDS, deadline - time.monotonic()))
+            try:
+                return self._filled_slots.get(timeout=wait)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+            dead = [worker for worker in self._workers if not worker.is_alive()]
+            if dead:
+                exitcodes = [worker.exitcode for worker in dead]
+                self.close()
+                raise RuntimeError(f"Simulation worker exited unexpectedly (exit codes {exitcodes}).")
+
+    def _next_filled(self, timeout):
+        if self.seed is None:
+            return self._get_filled(timeout)
+        # seeded batches are returned in the order of their index
+        while self._expected not in self._pending:
+            slot, index, kind, payload = self._get_filled(timeout)
+            if kind == "error":
+                return slot, index, kind, payload
+            self._pending[index] = (slot, index, kind, payload)
+        self._expected += 1
+        return self._pending.pop(self._expected - 1)
+
+    def __call__(self, batch_size=None, timeout=None):
+        """
+        Returns the next prefetched, configured batch.
+
+        Batch sizes other than the prefetched one (e.g. for validation or consistency
+        checks) are simulated synchronously in the calling process, with a warning on the
+        first request of every such size.
+
+        Parameters
+        ----------
+        batch_size : int or None, optional
+            The requested batch size. None means the prefetched batch size.
+        timeout : float or None, optional
+            Seconds to wait for a batch before raising `queue.Empty`. Without a timeout,
+            the prefetcher still checks every POLL_SECONDS that its workers are alive and
+            raises a RuntimeError once one of them has died.
+
+        Returns
+        -------
+        dict
+            The configured batch.
+        """
+        if self._closed:
+            raise RuntimeError("The prefetcher has been closed.")
+        if batch_size is not None and batch_size != self.batch_size:
+            if batch_size not in self._sync_sizes:
+                self._sync_sizes.add(batch_size)
+                warnings.warn(
+                    f"Batches of size {batch_size} are simulated in the calling process, only batches "
+                    f"of size {self.batch_size} are prefetched.", stacklevel=2,
+                )
+            seed = None
+            if self.seed is not None:
+                seed = batch_sequence(batch_sequence(self.seed, SYNC_STREAM), self._sync_count)
+                self._sync_count += 1
+            return _simulate(self.simulator, self.configurator, batch_size, seed)
+        slot, _, kind, payload = self._next_filled(timeout)
+        if kind == "error":
+            self.close()
+            raise RuntimeError(f"Simulation worker failed:\n{payload}")
+        if kind == "inline":
+            out_dict = payload
+        else:
+            buffer = self._shm.buf[slot * self.slot_bytes:(slot + 1) * self.slot_bytes]
+            out_dict = _read_slot(buffer, payload)
+            buffer.release()
+        self._release(slot)
+        return out_dict
+
+    def close(self):
+        """Stops the workers and releases the shared memory."""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._free_slots.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        # drain the result queue so its feeder thread can exit
+        try:
+            while True:
+                self._filled_slots.get_nowait()
+        except (queue.Empty, OSError):
+            pass
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,245 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# the profiler that records stages, None while profiling is disabled
+_ACTIVE = None
+
+
+def output_bytes(result):
+    """Returns the total size in bytes of the arrays in `result`, searching dicts, lists and tuples."""
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, dict):
+        return sum(output_bytes(value) for value in result.values())
+    if isinstance(result, (list, tuple)):
+        return sum(output_bytes(value) for value in result)
+    return 0
+
+
+class _NullStage:
+    """The stage returned while profiling is disabled, or for a stage nested in itself."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def record(self, result):
+        return result
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start", "nbytes")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.profiler._stack().append(self.name)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.profiler._stack().pop()
+        self.profiler._add(self.name, self.start, end, self.nbytes)
+        return False
+
+    def record(self, result):
+        """Adds the size of the arrays in `result` to the stage and returns `result`."""
+        self.nbytes += output_bytes(result)
+        return result
+
+
+class Profiler:
+    """
+    Records the wall time, call count and output size of the stages of a generative model.
+
+    Stages are opened with `stage` (or by calling a function wrapped with `instrument`)
+    while the profiler is active, see `profile`. A stage that is entered again inside
+    itself, e.g. `sample_eta` called from the "prior" stage of a `generative_model`, is
+    only recorded once, so the totals of a stage never count the same time twice. Stages
+    of different names may nest; the Chrome trace shows them as nested slices.
+
+    Events of all threads of the current process are recorded. Simulations that run in
+    other processes (e.g. the workers of a `Prefetcher`) are not.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._local = threading.local()
+        self.start = time.perf_counter_ns()
+        self.stop = None
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _add(self, name, start, end, nbytes):
+        # list.append is atomic, so threads can record without a lock
+        self.events.append((name, start, end, nbytes, threading.get_ident()))
+
+    def stage(self, name):
+        """Returns a context manager that records one call of the stage `name`."""
+        if name in self._stack():
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def summary(self):
+        """
+        Aggregates the recorded events per stage.
+
+        Returns
+        -------
+        list of dict
+            One entry per stage, in order of decreasing total time, with the keys 'stage',
+            'calls', 'total_s', 'mean_us', 'share' (of the profiled wall time) and
+            'bytes' (the total size of the arrays returned by the stage).
+        """
+        wall = ((self.stop or time.perf_counter_ns()) - self.start) / 1e9
+        stages = {}
+        for name, start, end, nbytes, _ in self.events:
+            entry = stages.setdefault(name, dict(stage=name, calls=0, total_s=0.0, bytes=0))
+            entry["calls"] += 1
+            entry["total_s"] += (end - start) / 1e9
+            entry["bytes"] += nbytes
+        rows = sorted(stages.values(), key=lambda entry: -entry["total_s"])
+        for entry in rows:
+            entry["mean_us"] = entry["total_s"] / entry["calls"] * 1e6
+            entry["share"] = entry["total_s"] / wall if wall > 0 else float("nan")
+        return rows
+
+    def table(self):
+        """Returns the summary as a plain-text table."""
+        lines = [f"{'stage':<16}{'calls':>8}{'total ms':>12}{'mean us':>12}{'share':>8}{'MB out':>10}"]
+        for entry in self.summary():
+            lines.append(
+                f"{entry['stage']:<16}{entry['calls']:>8}{entry['total_s'] * 1e3:>12.2f}"
+                f"{entry['mean_us']:>12.1f}{entry['share']:>8.1%}{entry['bytes'] / 2 ** 20:>10.2f}"
+            )
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """
+        Returns the recorded events in the Trace Event Format, which can be opened with
+        chrome://tracing or https://ui.perfetto.dev.
+        """
+        pid = os.getpid()
+        events = [
+            dict(name=name, ph="X", ts=(start - self.start) / 1e3, dur=(end - start) / 1e3,
+                 pid=pid, tid=tid, args=dict(bytes=nbytes))
+            for name, start, end, nbytes, tid in self.events
+        ]
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+    def export_chrome_trace(self, path):
+        """Writes `chrome_trace` as JSON to `path`."""
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def stage(name):
+    """
+    Returns a context manager that records the enclosed block as one call of the stage
+    `name` if profiling is active, and a shared no-op context manager otherwise.
+    """
+    profiler = _ACTIVE
+    if profiler is None:
+        return _NULL_STAGE
+    return profiler.stage(name)
+
+
+def instrument(name):
+    """
+    Returns a decorator that records every call of the decorated function as the stage
+    `name`, together with the size of the returned arrays, while profiling is active.
+
+    The decorated function is returned as a new wrapper, so a jitted function can be
+    instrumented for a Python caller, e.g. `instrument("simulator")(sample_softmax_rl)`
+    as the simulator of a `TwoLevelGenerativeModel`, while other jitted code keeps
+    calling the original.
+    """
+    def decorator(fn):
+        # `updated=()` keeps the internals of numba dispatchers out of the wrapper
+        @functools.wraps(fn, updated=())
+        def wrapper(*args, **kwargs):
+            profiler = _ACTIVE
+            if profiler is None:
+                return fn(*args, **kwargs)
+            with profiler.stage(name) as s:
+                return s.record(fn(*args, **kwargs))
+
+        wrapper.stage = name
+        return wrapper
+
+    return decorator
+
+
+# attributes of the bayesflow simulation classes that hold the functions of each stage
+_GENERATIVE_MODEL_STAGES = (
+    ("prior", ("prior",), ("hyper_prior_fun", "local_prior_fun", "shared_prior_fun", "prior_fun")),
+    ("context", ("simulator", "context_gen"), ("batchable_context_fun", "non_batchable_context_fun")),
+    ("simulator", ("simulator",), ("simulator",)),
+)
+
+
+def instrument_generative_model(model):
+    """
+    Wraps the prior, context and simulator functions of a bayesflow
+    `TwoLevelGenerativeModel` (or `GenerativeModel`) in place with `instrument`.
+    Attributes that do not exist on the given model are skipped.
+
+    The stages are named "prior", "context" and "simulator", as in the
+    `generative_model` functions of the packages. Functions that are already instrumented
+    are not wrapped again.
+
+    Returns
+    -------
+    The instrumented model.
+    """
+    for name, path, attributes in _GENERATIVE_MODEL_STAGES:
+        owner = model
+        for part in path:
+            owner = getattr(owner, part, None)
+        if owner is None:
+            continue
+        for attribute in attributes:
+            fn = getattr(owner, attribute, None)
+            if callable(fn) and not hasattr(fn, "stage"):
+                setattr(owner, attribute, instrument(name)(fn))
+    return model
+
+
+@contextmanager
+def profile(profiler=None):
+    """
+    Activates a profiler for the enclosed block and yields it.
+
+    >>> with profile() as prof:
+    ...     for _ in range(100):
+    ...         configure_input(generative_model(32))
+    >>> print(prof.table())
+    >>> prof.export_chrome_trace("trace.json")
+    """
+    global _ACTIVE
+    previous = _ACTIVE
+    _ACTIVE = Profiler() if profiler is None else profiler
+    try:
+        yield _ACTIVE
+    finally:
+        _ACTIVE.stop = time.perf_counter_ns()
+        _ACTIVE = previous
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+def seed_sequence(seed=None):
+    """
+    Returns `seed` as a np.random.SeedSequence.
+
+    Parameters
+    ----------
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of an experiment or a batch. A SeedSequence is returned unchanged, None
+        draws fresh entropy from the OS.
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def batch_sequence(seed, index):
+    """
+    Returns the seed sequence of batch `index` of an experiment.
+
+    This is the `index`-th child of `seed_sequence(seed).spawn`, computed directly from
+    the index. The stream of a batch therefore depends only on the experiment seed and
+    the position of the batch, not on which worker simulates it or in which order the
+    batches are started, and the streams of different batches are independent.
+
+    Parameters
+    ----------
+    seed : int or np.random.SeedSequence
+        The seed of the experiment.
+    index : int
+        The position of the batch within the experiment (e.g. the shard index).
+
+    Returns
+    -------
+    np.random.SeedSequence
+    """
+    root = seed_sequence(seed)
+    return np.random.SeedSequence(root.entropy, spawn_key=(*root.spawn_key, int(index)))
+
+
+def batch_streams(seed, batch_size, num_kernels=1):
+    """
+    Splits the seed of one batch into the random streams of a generative model.
+
+    Parameters
+    ----------
+    seed : int, np.random.SeedSequence or None
+        The seed of the batch, e.g. from `batch_sequence`.
+    batch_size : int
+        The number of simulations of the batch.
+    num_kernels : int, optional
+        The number of jitted kernels that draw random numbers, e.g. 2 for a prior and a
+        simulator kernel (default is 1). Every kernel gets its own, independent seeds.
+
+    Returns
+    -------
+    tuple
+        The generator of all draws made in Python (hyper priors, context selection),
+        followed by `num_kernels` 1D uint32 arrays with one seed per simulation. The
+        kernels reseed numba's random state with `seeds[i]` at the start of row `i`.
+    """
+    # children are derived from their index instead of `spawn`, which would advance the
+    # state of a SeedSequence passed in and make a second call return different streams
+    root = seed_sequence(seed)
+    rng_seq, *kernel_seqs = (batch_sequence(root, k) for k in range(1 + num_kernels))
+    return (np.random.default_rng(rng_seq), *(seq.generate_state(batch_size) for seq in kernel_seqs))
@@ -0,0 +1,489 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from autotune import model_of, pin_threads, tuned
+from rng import seed_sequence, batch_sequence
+
+PROTOCOL_VERSION = 1
+MAGIC = b"NSRL"
+# every frame starts with the magic, its kind and the length of its body
+FRAME = struct.Struct("!4sBI")
+# the body of a batch starts with the length of its JSON header
+HEADER_LENGTH = struct.Struct("!I")
+HELLO, REQUEST, BATCH, ERROR = 1, 2, 3, 4
+# batch index of the stream of the batches of other sizes, as in `prefetch.Prefetcher`
+SYNC_STREAM = 2 ** 32
+
+
+def parse_address(address):
+    """
+    Returns the socket family and address of "tcp://host:port", "host:port" or
+    "unix:///path/to/socket".
+    """
+    if address.startswith("unix://"):
+        return socket.AF_UNIX, address[len("unix://"):]
+    host, _, port = address.removeprefix("tcp://").rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def _recv_exactly(sock, num_bytes):
+    """Receives exactly `num_bytes` into a new bytearray, or returns None at the end of the stream."""
+    buffer = bytearray(num_bytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < num_bytes:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return None
+        received += n
+    return buffer
+
+
+def recv_frame(sock):
+    """Receives one frame and returns its kind and body, or (None, None) at the end of the stream."""
+    header = _recv_exactly(sock, FRAME.size)
+    if header is None:
+        return None, None
+    magic, kind, length = FRAME.unpack(header)
+    if magic != MAGIC:
+        raise ConnectionError(f"Unexpected frame {bytes(header)!r}, not a simulation server.")
+    body = _recv_exactly(sock, length)
+    if body is None:
+        return None, None
+    return kind, body
+
+
+def send_message(sock, kind, message):
+    """Sends a frame whose body is the JSON encoding of `message`."""
+    body = json.dumps(message).encode()
+    sock.sendall(FRAME.pack(MAGIC, kind, len(body)) + body)
+
+
+def send_batch(sock, index, out_dict):
+    """
+    Sends a batch as a frame holding a JSON header, with the key, dtype and shape of every
+    array and the values of the scalars, followed by the raw bytes of the arrays.
+    """
+    arrays, scalars = {}, {}
+    for key, value in out_dict.items():
+        if isinstance(value, np.ndarray):
+            arrays[key] = np.ascontiguousarray(value)
+        else:
+            scalars[key] = value.item() if isinstance(value, np.generic) else value
+    header = json.dumps(dict(
+        index=index,
+        keys=list(out_dict),
+        arrays=[[key, value.dtype.str, value.shape] for key, value in arrays.items()],
+        scalars=scalars,
+    )).encode()
+    length = HEADER_LENGTH.size + len(header) + sum(value.nbytes for value in arrays.values())
+    sock.sendall(FRAME.pack(MAGIC, BATCH, length) + HEADER_LENGTH.pack(len(header)) + header)
+    for value in arrays.values():
+        sock.sendall(memoryview(value).cast("B"))
+
+
+def decode_batch(body):
+    """
+    Returns the index and the dictionary of a batch frame. The arrays are views of `body`,
+    so no data is copied.
+    """
+    (header_length,) = HEADER_LENGTH.unpack_from(body)
+    offset = HEADER_LENGTH.size + header_length
+    header = json.loads(bytes(body[HEADER_LENGTH.size:offset]))
+    values = dict(header["scalars"])
+    for key, dtype, shape in header["arrays"]:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        values[key] = np.frombuffer(body, dtype=dtype, count=count, offset=offset).reshape(shape)
+        offset += count * dtype.itemsize
+    return header["index"], {key: values[key] for key in header["keys"]}
+
+
+def _encode_seed(seed):
+    return None if seed is None else dict(entropy=seed.entropy, spawn_key=list(seed.spawn_key))
+
+
+def _decode_seed(seed):
+    if seed is None:
+        return None
+    return np.random.SeedSequence(seed["entropy"], spawn_key=tuple(seed["spawn_key"]))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Serves the requests of one client connection, one batch at a time."""
+
+    def handle(self):
+        server = self.server
+        # the number of numba threads is a per-thread setting
+        pin_threads(server.num_threads)
+        send_message(self.request, HELLO, dict(
+            version=PROTOCOL_VERSION, model=server.model, configured=server.configurator is not None,
+        ))
+        try:
+            while True:
+                kind, body = recv_frame(self.request)
+                if kind is None:
+                    return
+                request = json.loads(bytes(body))
+                try:
+                    seed = _decode_seed(request["seed"])
+                    batch_size = request["batch_size"]
+                    # the parallel kernels already use all threads; numba's default threading
+                    # layer must not run them concurrently
+                    with server.lock:
+                        if seed is None:
+                            out_dict = server.simulator(batch_size)
+                        else:
+                            out_dict = server.simulator(batch_size, seed=seed)
+                        if server.configurator is not None:
+                            out_dict = server.configurator(out_dict)
+                except Exception:
+                    send_message(self.request, ERROR, dict(index=request["index"], error=traceback.format_exc()))
+                    continue
+                send_batch(self.request, request["index"], out_dict)
+        except ConnectionError:
+            # the client went away with requests in flight
+            return
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(simulator, address, configurator=None, num_threads=None):
+    """
+    Returns a threaded socket server that simulates and sends one batch per request,
+    without starting it. Every connection is served by its own thread, so one server
+    can feed several clients; their simulations take turns, while sending a batch
+    overlaps with simulating the next.
+    """
+    family, address = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = _UnixServer(address, _Handler)
+    else:
+        server = _TCPServer(address, _Handler)
+    server.simulator = simulator
+    server.configurator = configurator
+    server.model = model_of(simulator)
+    server.num_threads = num_threads
+    server.lock = threading.Lock()
+    return server
+
+
+def serve(simulator, address, configurator=None, num_threads=None):
+    """
+    Serves batches of `simulator` (passed through `configurator`, if given) on `address`
+    until the process is stopped.
+
+    A server never simulates ahead of its clients, so a slow client throttles the
+    server instead of filling its memory; clients keep a few requests in flight to
+    overlap simulation and training (see `SimulationClient`).
+
+    Parameters
+    ----------
+    simulator : callable
+        The generative model, called as `simulator(batch_size)` or, for seeded clients,
+        `simulator(batch_size, seed=seed)`.
+    address : str
+        "tcp://host:port" or "unix:///path/to/socket".
+    configurator : callable or None, optional
+        If given, applied to every batch before it is sent, e.g. `configure_input`.
+    num_threads : int or None, optional
+        The number of numba threads. None means the tuned number of the model package of
+        `simulator` on this host (see `autotune`), or all cores.
+    """
+    num_threads = tuned(model_of(simulator), "num_threads", num_threads)
+    server = make_server(simulator, address, configurator, num_threads)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        family, path = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(path):
+            os.unlink(path)
+
+
+def connect(address, timeout=None):
+    """Connects to a simulation server, retrying until it listens or `timeout` seconds have passed."""
+    family, target = parse_address(address)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(target)
+        except (ConnectionRefusedError, FileNotFoundError):
+            sock.close()
+            if deadline is not None and time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+            continue
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+
+class _Connection:
+    """A connection to one server, with a reader thread that queues its batches."""
+
+    def __init__(self, address, results, timeout):
+        self.address = address
+        self.sock = connect(address, timeout)
+        kind, body = recv_frame(self.sock)
+        hello = json.loads(bytes(body)) if kind == HELLO else {}
+        if hello.get("version") != PROTOCOL_VERSION:
+            self.sock.close()
+            raise ConnectionError(f"{address} does not speak version {PROTOCOL_VERSION} of the protocol.")
+        self.model = hello["model"]
+        self.configured = hello["configured"]
+        self.reader = threading.Thread(target=self._read, args=(results,), daemon=True)
+        self.reader.start()
+
+    def _read(self, results):
+        try:
+            while True:
+                kind, body = recv_frame(self.sock)
+                if kind is None:
+                    break
+                if kind == ERROR:
+                    message = json.loads(bytes(body))
+                    results.put((self, message["index"], "error", message["error"]))
+                else:
+                    index, out_dict = decode_batch(body)
+                    results.put((self, index, "batch", out_dict))
+        except OSError as e:
+            results.put((self, None, "error", repr(e)))
+            return
+        results.put((self, None, "error", "connection closed by the server"))
+
+    def request(self, index, batch_size, seed):
+        send_message(self.sock, REQUEST, dict(index=index, batch_size=batch_size, seed=_encode_seed(seed)))
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class SimulationClient:
+    """
+    Receives simulated batches from one or more simulation servers and is called like a
+    generative model, e.g. as the `generative_model` of a bayesflow trainer.
+
+    Every server has at most `in_flight` batches requested or received but not yet
+    returned. A server gets its next request as soon as one of its batches is returned,
+    so faster servers receive more work, while the number of batches simulated ahead of
+    the trainer (and held in memory) never exceeds `in_flight` per server. In seeded
+    mode, a slow server that holds the next index therefore stalls the others after
+    `in_flight` batches instead of letting them fill memory.
+
+    With a `seed`, batch `i` is simulated as `simulator(batch_size, seed=batch_sequence(seed, i))`
+    on whichever server receives it, and the batches are returned in the order of their
+    index, so the sequence of batches is bit-reproducible regardless of the number of
+    servers and matches `prefetch.Prefetcher` and `simulation_store.simulate_to_disk`
+    with the same seed.
+
+    Parameters
+    ----------
+    addresses : str or list of str
+        The addresses of the servers, "tcp://host:port" or "unix:///path/to/socket".
+    batch_size : int, optional
+        The batch size of the requested batches (default is 32), which should match the
+        batch size of the trainer.
+    in_flight : int, optional
+        The number of outstanding requests per server (default is 2).
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the experiment. If None, every batch draws fresh entropy.
+    timeout : float or None, optional
+        Seconds to wait for the servers to accept the connections.
+
+    Examples
+    --------
+    >>> client = SimulationClient(["tcp://gpu-box-2:5555", "tcp://gpu-box-3:5555"])
+    >>> trainer = bf.trainers.Trainer(
+    ...     amortizer=amortizer, generative_model=client, configurator=passthrough
+    ... )
+    """
+
+    def __init__(self, addresses, batch_size=32, in_flight=2, seed=None, timeout=30):
+        addresses = [addresses] if isinstance(addresses, str) else list(addresses)
+        self.seed = None if seed is None else seed_sequence(seed)
+        self._results = queue.Queue()
+        self._connections = []
+        self._closed = False
+        try:
+            for address in addresses:
+                self._connections.append(_Connection(address, self._results, timeout))
+        except BaseException:
+            self.close()
+            raise
+        self.model = self._connections[0].model
+        self.configured = self._connections[0].configured
+        self.batch_size = batch_size
+        self._next_index = 0
+        self._expected = 0
+        self._pending = {}
+        self._sync_count = 0
+        for connection in self._connections:
+            for _ in range(in_flight):
+                self._request(connection)
+
+    def _request(self, connection):
+        index = self._next_index
+        seed = None if self.seed is None else batch_sequence(self.seed, index)
+        connection.request(index, self.batch_size, seed)
+        self._next_index += 1
+
+    def _receive(self, timeout):
+        connection, index, kind, payload = self._results.get(timeout=timeout)
+        if kind == "error":
+            self.close()
+            raise RuntimeError(f"Simulation server {connection.address} failed:\n{payload}")
+        return connection, index, payload
+
+    def __call__(self, batch_size=None, timeout=None):
+        """
+        Returns the next batch.
+
+        Batches of other sizes than `batch_size` (e.g. for validation) are requested from
+        the first server and waited for.
+
+        Parameters
+        ----------
+        batch_size : int or None, optional
+            The requested batch size. None means the batch size of the client.
+        timeout : float or None, optional
+            Seconds to wait for a batch before raising `queue.Empty`.
+
+        Returns
+        -------
+        dict
+            The batch, configured if the servers apply a configurator.
+        """
+        if self._closed:
+            raise RuntimeError("The client has been closed.")
+        if batch_size is not None and batch_size != self.batch_size:
+            index = -1 - self._sync_count
+            seed = None
+            if self.seed is not None:
+                seed = batch_sequence(batch_sequence(self.seed, SYNC_STREAM), self._sync_count)
+            self._sync_count += 1
+            self._connections[0].request(index, batch_size, seed)
+            return self._wait_for(index, timeout)
+        if self.seed is None:
+            # any prefetched batch will do, e.g. one received while waiting for another
+            while True:
+                ready = [index for index in self._pending if index >= 0]
+                if ready:
+                    return self._take(ready[0])
+                self._park(timeout)
+        self._expected += 1
+        return self._wait_for(self._expected - 1, timeout)
+
+    def _park(self, timeout):
+        """Receives the next batch and keeps it until it is handed to the caller."""
+        connection, index, out_dict = self._receive(timeout)
+        self._pending[index] = (connection, out_dict)
+
+    def _take(self, index):
+        """
+        Returns the received batch `index` and only then sends its server the next
+        request, so a server never has more than `in_flight` batches requested or waiting.
+        """
+        connection, out_dict = self._pending.pop(index)
+        if index >= 0:
+            self._request(connection)
+        return out_dict
+
+    def _wait_for(self, index, timeout):
+        while index not in self._pending:
+            self._park(timeout)
+        return self._take(index)
+
+    def close(self):
+        """Closes the connections to all servers."""
+        if self._closed:
+            return
+        self._closed = True
+        for connection in self._connections:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __del__(self):
+        self.close()
+
+
+class ServerProcess:
+    """
+    Runs `serve` in a separate process, e.g. to stand in for a remote simulation host in
+    tests on localhost. Used as a context manager, the process is stopped on exit.
+
+    >>> with ServerProcess(generative_model, "tcp://127.0.0.1:5555", configure_input), \\
+    ...      ServerProcess(generative_model, "tcp://127.0.0.1:5556", configure_input):
+    ...     client = SimulationClient(["tcp://127.0.0.1:5555", "tcp://127.0.0.1:5556"])
+    """
+
+    def __init__(self, simulator, address, configurator=None, num_threads=None, start_method="spawn"):
+        self.address = address
+        self.process = mp.get_context(start_method).Process(
+            target=serve, args=(simulator, address, configurator, num_threads), daemon=True,
+        )
+        self.process.start()
+
+    def close(self):
+        """Stops the server process."""
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        family, path = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(path):
+            os.unlink(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+if __name__ == "__main__":
+    from simulation_store import MODELS, _load_entry_points
+
+    parser = argparse.ArgumentParser(description="Serve simulated batches of a model package over a socket.")
+    parser.add_argument("model", choices=list(MODELS), help="The model package to simulate from.")
+    parser.add_argument("address", help='"tcp://host:port" or "unix:///path/to/socket".')
+    parser.add_argument("--configure", action="store_true",
+                        help="Send configured network inputs instead of raw simulations.")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="The number of numba threads (default: tuned for this host, or all cores).")
+    args = parser.parse_args()
+
+    simulator, configurator = _load_entry_points(args.model, args.configure)
+    print(f"serving {args.model} on {args.address}")
+    serve(simulator, args.address, configurator, num_threads=args.threads)
@@ -0,0 +1,327 @@
+import argparse
+import importlib
+import json
+import multiprocessing as mp
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from autotune import model_of, pin_threads, tuned
+from rng import seed_sequence, batch_sequence
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+# simulator and configurator entry points of the model packages, relative to `<model>/src`
+MODELS = {
+    "rlwm": ("model", "generative_model"),
+    "reversal_learning": ("likelihood", "generative_model"),
+    "three_blocks": ("likelihood", "generative_model"),
+    "three_alt_full_feedback": ("model", "generative_model"),
+}
+
+
+def shard_dir(directory, index):
+    """Returns the directory of shard `index` of a simulation store."""
+    return Path(directory) / f"shard_{index:05d}"
+
+
+def write_shard(directory, index, out_dict):
+    """
+    Writes one simulated batch as a shard of `.npy` files, one per array.
+
+    The shard is written to a temporary directory first and moved into place, so an
+    interrupted run never leaves a partially written shard behind. Values that are not
+    arrays (e.g. the number of trials of the batch) are returned as part of the shard
+    description instead.
+
+    Parameters
+    ----------
+    directory : str or Path
+        The directory of the simulation store.
+    index : int
+        The index of the shard.
+    out_dict : dict
+        The simulated (and possibly configured) batch.
+
+    Returns
+    -------
+    dict
+        The description of the shard: its size and the shape and dtype of every array.
+    """
+    target = shard_dir(directory, index)
+    tmp = target.with_name(f"{target.name}.tmp{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+    arrays, scalars = {}, {}
+    try:
+        for key, value in out_dict.items():
+            if isinstance(value, np.ndarray):
+                np.save(tmp / f"{key}.npy", value)
+                arrays[key] = dict(shape=list(value.shape), dtype=value.dtype.str)
+            else:
+                scalars[key] = value.item() if isinstance(value, np.generic) else value
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+    size = next(iter(arrays.values()))["shape"][0] if arrays else 0
+    return dict(index=index, size=size, arrays=arrays, scalars=scalars)
+
+
+def _simulate_shard(args):
+    simulator, configurator, directory, index, shard_size, seed = args
+    if seed is None:
+        out_dict = simulator(shard_size)
+    else:
+        out_dict = simulator(shard_size, seed=batch_sequence(seed, index))
+    if configurator is not None:
+        out_dict = configurator(out_dict)
+    return write_shard(directory, index, out_dict)
+
+
+def _write_manifest(directory, manifest):
+    tmp = Path(directory) / f"{MANIFEST}.tmp{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, Path(directory) / MANIFEST)
+
+
+def simulate_to_disk(simulator, directory, num_shards, shard_size=None, configurator=None,
+                     num_workers=None, start_method="spawn", meta=None, seed=None, num_threads=None):
+    """
+    Streams simulations into a sharded on-disk store.
+
+    Every shard holds one batch of `shard_size` simulations, written by one of
+    `num_workers` worker processes, so at most `num_workers` shards are held in memory
+    at a time, independent of the size of the store. The manifest is rewritten after
+    every finished shard, so an interrupted run can be resumed: shards listed in an
+    existing manifest are not simulated again.
+
+    Workers are started with the "spawn" method by default, so every worker gets its
+    own module-level random number generators (see `prefetch.Prefetcher`).
+
+    With a `seed`, shard `i` is simulated as `simulator(shard_size, seed=batch_sequence(seed, i))`,
+    so the content of every shard depends only on the seed and its index: the store is
+    bit-reproducible regardless of the number of workers and of interruptions. The seed
+    is recorded in the manifest, and a resumed run continues with it.
+
+    Parameters
+    ----------
+    simulator : callable
+        The generative model, called as `simulator(shard_size)`. Must be picklable.
+    directory : str or Path
+        The directory of the store. Created if it does not exist.
+    num_shards : int
+        The total number of shards of the store.
+    shard_size : int or None, optional
+        The number of simulations per shard. None means the shard size of an existing
+        store, or else the tuned shard size of the model package of `simulator` on this
+        host (see `autotune`), or 1024.
+    configurator : callable or None, optional
+        If given, applied to every batch before it is written.
+    num_workers : int or None, optional
+        The number of worker processes. None means the tuned number, or 1.
+    start_method : str, optional
+        The multiprocessing start method of the workers (default is "spawn").
+    meta : dict or None, optional
+        Additional entries for the manifest, e.g. the name of the model.
+    seed : int or None, optional
+        The seed of the store. Requires a simulator with a `seed` keyword, such as the
+        `generative_model` functions of the model packages.
+    num_threads : int or None, optional
+        The number of numba threads of every worker. None means the tuned number, or all cores.
+
+    Returns
+    -------
+    dict
+        The manifest of the store.
+    """
+    model = model_of(simulator)
+    num_workers = tuned(model, "num_workers", num_workers, default=1)
+    num_threads = tuned(model, "worker_threads", num_threads)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest_path = directory / MANIFEST
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        shard_size = manifest["shard_size"] if shard_size is None else shard_size
+        if manifest["shard_size"] != shard_size:
+            raise ValueError(
+                f"The store at {directory} has shards of {manifest['shard_size']} simulations, "
+                f"cannot resume with shard_size={shard_size}."
+            )
+        if seed is not None and manifest.get("seed") != seed:
+            raise ValueError(
+                f"The store at {directory} was simulated with seed {manifest.get('seed')}, "
+                f"cannot resume with seed={seed}."
+            )
+        seed = manifest.get("seed")
+    else:
+        shard_size = tuned(model, "shard_size", shard_size)
+        manifest = dict(
+            format_version=FORMAT_VERSION, shard_size=shard_size, seed=seed, shards=[], **(meta or {})
+        )
+    root = None if seed is None else seed_sequence(seed)
+    done = {shard["index"] for shard in manifest["shards"]}
+    todo = [
+        (simulator, configurator, directory, index, shard_size, root)
+        for index in range(num_shards) if index not in done
+    ]
+
+    def finish(shard):
+        manifest["shards"].append(shard)
+        manifest["shards"].sort(key=lambda s: s["index"])
+        _write_manifest(directory, manifest)
+
+    if num_workers <= 1:
+        for args in todo:
+            finish(_simulate_shard(args))
+    else:
+        with mp.get_context(start_method).Pool(num_workers, pin_threads, (num_threads,)) as pool:
+            for shard in pool.imap_unordered(_simulate_shard, todo):
+                finish(shard)
+    return manifest
+
+
+class SimulationStore:
+    """
+    Read access to a sharded simulation store written by `simulate_to_disk`.
+
+    Shards are memory-mapped, so only the simulations of the batches that are actually
+    requested are read from disk, and stores larger than the available memory can be
+    streamed.
+
+    Parameters
+    ----------
+    directory : str or Path
+        The directory of the store.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / MANIFEST) as f:
+            self.manifest = json.load(f)
+        self.shards = self.manifest["shards"]
+
+    @property
+    def num_shards(self):
+        return len(self.shards)
+
+    def __len__(self):
+        return sum(shard["size"] for shard in self.shards)
+
+    def shard(self, idx):
+        """
+        Returns shard `idx` (position in the manifest) as a dictionary of read-only
+        memory-mapped arrays, together with its non-array values.
+        """
+        shard = self.shards[idx]
+        path = shard_dir(self.directory, shard["index"])
+        out_dict = {key: np.load(path / f"{key}.npy", mmap_mode="r") for key in shard["arrays"]}
+        out_dict.update(shard["scalars"])
+        return out_dict
+
+    def iter_shards(self, shuffle=True, rng=None):
+        """
+        Yields all shards as dictionaries of memory-mapped arrays.
+
+        Parameters
+        ----------
+        shuffle : bool, optional
+            Whether to visit the shards in random order (default is True).
+        rng : np.random.Generator or None, optional
+            The random number generator of the shuffling.
+        """
+        order = np.arange(self.num_shards)
+        if shuffle:
+            (np.random.default_rng() if rng is None else rng).shuffle(order)
+        for idx in order:
+            yield self.shard(idx)
+
+    def iter_batches(self, batch_size, shuffle=True, drop_last=False, rng=None):
+        """
+        Yields batches of simulations, reading one batch at a time from the memory maps.
+
+        Batches never span shards, since shards may differ in their number of trials (e.g.
+        rlwm). With `shuffle`, shards are visited in random order and the simulations of
+        every shard are permuted.
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of simulations per batch.
+        shuffle : bool, optional
+            Whether to shuffle shards and simulations (default is True).
+        drop_last : bool, optional
+            Whether to skip the last, smaller batch of every shard (default is False).
+        rng : np.random.Generator or None, optional
+            The random number generator of the shuffling.
+
+        Yields
+        ------
+        dict
+            A batch with the same keys as the stored simulations, as in-memory arrays.
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        for shard in self.iter_shards(shuffle, rng):
+            arrays = {key: value for key, value in shard.items() if isinstance(value, np.ndarray)}
+            size = len(next(iter(arrays.values())))
+            order = rng.permutation(size) if shuffle else np.arange(size)
+            for start in range(0, size, batch_size):
+                idx = order[start:start + batch_size]
+                if drop_last and len(idx) < batch_size:
+                    break
+                # sorted indices keep the reads from the memory map sequential
+                idx = np.sort(idx)
+                batch = {key: np.asarray(value[idx]) for key, value in arrays.items()}
+                if shuffle:
+                    perm = rng.permutation(len(idx))
+                    batch = {key: value[perm] for key, value in batch.items()}
+                batch.update({key: value for key, value in shard.items() if key not in arrays})
+                yield batch
+
+
+def _load_entry_points(model, configure):
+    src = Path(__file__).resolve().parents[1] / model / "src"
+    # the model packages resolve their data relative to `src`; the worker processes inherit
+    # the working directory and sys.path from this process
+    os.chdir(src)
+    sys.path.insert(0, str(src))
+    module_name, function_name = MODELS[model]
+    simulator = getattr(importlib.import_module(module_name), function_name)
+    configurator = importlib.import_module("configurator").configure_input if configure else None
+    return simulator, configurator
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a training data set into a sharded on-disk store.")
+    parser.add_argument("model", choices=list(MODELS), help="The model package to simulate from.")
+    parser.add_argument("directory", help="The output directory of the store.")
+    parser.add_argument("--num-shards", type=int, required=True, help="The number of shards.")
+    parser.add_argument("--shard-size", type=int, default=None,
+                        help="Simulations per shard (default: tuned for this host, or 1024).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="The number of worker processes (default: tuned for this host, or 1).")
+    parser.add_argument("--configure", action="store_true",
+                        help="Store configured network inputs instead of raw simulations.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="The seed of the store, for shards that are reproducible.")
+    args = parser.parse_args()
+
+    directory = Path(args.directory).resolve()
+    simulator, configurator = _load_entry_points(args.model, args.configure)
+    start = time.perf_counter()
+    manifest = simulate_to_disk(
+        simulator, directory, args.num_shards, args.shard_size, configurator=configurator,
+        num_workers=args.workers, meta=dict(model=args.model, configured=args.configure),
+        seed=args.seed,
+    )
+    print(f"{directory}: {len(manifest['shards'])} shards of {manifest['shard_size']} simulations "
+          f"in {time.perf_counter() - start:.1f} s")
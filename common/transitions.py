@@ -0,0 +1,297 @@
+import numpy as np
+from numba import njit, prange
+
+from kernels import truncnorm_sample
+
+# components of a transition, combined as bit flags. A new component needs a new flag, a
+# branch in `transition_step` and its hyper parameters in `num_eta`; `register` only names
+# combinations of the existing ones
+RANDOM_WALK = 1      # clipped Gaussian step with scale eta[k]
+SWITCH_UNIFORM = 2   # with probability eta[P + k], a fresh draw uniform within the bounds
+SWITCH_PRIOR = 4     # with probability eta[P + k], a fresh draw from the initial prior
+BLOCK_RESET = 8      # at the first trial of a block, a fresh draw of all parameters from the initial prior
+
+# transitions by name; names are combined with "+", e.g. "random_walk+block_reset"
+TRANSITIONS = {
+    "static": 0,
+    "random_walk": RANDOM_WALK,
+    "mixture_random_walk": RANDOM_WALK | SWITCH_UNIFORM,
+    "regime_switching": RANDOM_WALK | SWITCH_PRIOR,
+    "block_reset": BLOCK_RESET,
+}
+
+# initial prior distributions of a single parameter, see `initial_prior`
+UNIFORM, BETA, TRUNCNORM, SOFTPLUS_NORMAL = range(4)
+DISTRIBUTIONS = {"uniform": UNIFORM, "beta": BETA, "truncnorm": TRUNCNORM, "softplus_normal": SOFTPLUS_NORMAL}
+
+
+def register(name, flags):
+    """
+    Registers the transition `name` as a combination of the existing component flags, e.g.
+    `register("drifting_regimes", RANDOM_WALK | SWITCH_PRIOR | BLOCK_RESET)`.
+    """
+    TRANSITIONS[name] = flags
+
+
+def transition_flags(name):
+    """Returns the component flags of a registered transition or a "+" combination of them."""
+    flags = 0
+    for part in name.split("+"):
+        if part not in TRANSITIONS:
+            raise KeyError(f"Unknown transition {part!r}, expected one of {sorted(TRANSITIONS)}.")
+        flags |= TRANSITIONS[part]
+    return flags
+
+
+def num_eta(flags, num_params):
+    """Returns the number of entries of eta that a transition reads per batch row."""
+    if flags & (SWITCH_UNIFORM | SWITCH_PRIOR):
+        return 2 * num_params
+    if flags & RANDOM_WALK:
+        return num_params
+    return 0
+
+
+def initial_prior(*distributions):
+    """
+    Encodes the initial prior of every parameter for the jitted kernels.
+
+    Parameters
+    ----------
+    *distributions : tuple
+        One tuple per parameter: ("uniform", low, high), ("beta", a, b),
+        ("truncnorm", loc, scale, low, high) or ("softplus_normal", loc, scale), the
+        latter being log(1 + exp(x)) of a normal draw x.
+
+    Returns
+    -------
+    np.ndarray
+        An array of shape (num_params, 5) with the code of the distribution and its
+        parameters.
+
+    Examples
+    --------
+    >>> initial_prior(("beta", 1.5, 2), ("truncnorm", 1, 5, 0, 15))
+    """
+    init = np.zeros((len(distributions), 5))
+    for k, (name, *params) in enumerate(distributions):
+        init[k, 0] = DISTRIBUTIONS[name]
+        init[k, 1:1 + len(params)] = params
+    return init
+
+
+@njit(cache=True, inline="always")
+def draw_initial(init, k):
+    """Draws parameter `k` from its initial prior, encoded by `initial_prior`."""
+    code = init[k, 0]
+    if code == UNIFORM:
+        return np.random.uniform(init[k, 1], init[k, 2])
+    elif code == BETA:
+        return np.random.beta(init[k, 1], init[k, 2])
+    elif code == TRUNCNORM:
+        return truncnorm_sample(init[k, 1], init[k, 2], init[k, 3], init[k, 4])
+    return np.log(1 + np.exp(np.random.normal(init[k, 1], init[k, 2])))
+
+
+@njit(cache=True, inline="always")
+def transition_step(theta_prev, theta, eta, reset, flags, init, lower_bounds, upper_bounds):
+    """
+    Draws theta_t given theta_{t-1} into `theta` under the transition given by `flags`.
+
+    This is the common signature of all transitions. At a block start (`reset`) with
+    BLOCK_RESET, all parameters are drawn from the initial prior. Otherwise every
+    parameter either switches to a fresh draw (SWITCH_UNIFORM or SWITCH_PRIOR, with
+    probability eta[P + k]), takes a clipped Gaussian step (RANDOM_WALK, with scale
+    eta[k]) or keeps its value.
+
+    Parameters
+    ----------
+    theta_prev : np.ndarray
+        A 1D array of shape (P,) with theta at the previous time step.
+    theta : np.ndarray
+        A 1D array of shape (P,) that receives the new theta.
+    eta : np.ndarray
+        The scales, followed by the switching probabilities if the transition switches.
+    reset : bool
+        Whether a new block starts at this time step.
+    flags : int
+        The components of the transition, see `transition_flags`.
+    init : np.ndarray
+        The initial prior, see `initial_prior`.
+    lower_bounds, upper_bounds : np.ndarray
+        1D arrays of shape (P,) with the bounds of the parameters.
+
+    Notes
+    -----
+    The step is inlined into its callers, so the branches on constant flags fold away and
+    the model wrappers are as fast as hand-written kernels.
+    """
+    num_params = theta.shape[0]
+    if reset and flags & BLOCK_RESET:
+        for k in range(num_params):
+            theta[k] = draw_initial(init, k)
+        return
+    switches = flags & (SWITCH_UNIFORM | SWITCH_PRIOR)
+    for k in range(num_params):
+        if switches and np.random.random() < eta[num_params + k]:
+            if flags & SWITCH_UNIFORM:
+                theta[k] = np.random.uniform(lower_bounds[k], upper_bounds[k])
+            else:
+                theta[k] = draw_initial(init, k)
+        elif flags & RANDOM_WALK:
+            theta[k] = max(
+                min(theta_prev[k] + eta[k] * np.random.randn(), upper_bounds[k]), lower_bounds[k]
+            )
+        else:
+            theta[k] = theta_prev[k]
+
+
+@njit(parallel=True, cache=True)
+def sample_transitions_batch(flags, init, eta, resets, lower_bounds, upper_bounds, seeds):
+    """
+    Draws a batch of theta trajectories under the transition given by `flags`.
+
+    Every batch row starts from a draw of the initial prior and reseeds numba's random
+    state with `seeds[i]`, so a batch is reproducible regardless of the number of
+    threads. The walk runs in float64 on two swapped buffers and is stored as float32.
+
+    Parameters
+    ----------
+    flags : int
+        The components of the transition, see `transition_flags`.
+    init : np.ndarray
+        The initial prior of the P parameters, see `initial_prior`.
+    eta : np.ndarray
+        A 2D array of shape (batch_size, num_eta) with the hyper parameters of every row.
+    resets : np.ndarray
+        A boolean array of shape (batch_size, num_steps) that is True at the first trial
+        of a block.
+    lower_bounds, upper_bounds : np.ndarray
+        1D arrays of shape (P,) with the bounds of the parameters.
+    seeds : np.ndarray
+        A 1D array of shape (batch_size,) with one integer seed per batch row.
+
+    Returns
+    -------
+    np.ndarray
+        A float32 array of shape (batch_size, num_steps, P) with the theta trajectories.
+    """
+    batch_size = eta.shape[0]
+    num_steps = resets.shape[1]
+    num_params = init.shape[0]
+    theta_t = np.empty((batch_size, num_steps, num_params), dtype=np.float32)
+    for i in prange(batch_size):
+        np.random.seed(seeds[i])
+        prev = np.empty(num_params)
+        cur = np.empty(num_params)
+        for k in range(num_params):
+            prev[k] = draw_initial(init, k)
+            theta_t[i, 0, k] = prev[k]
+        for t in range(1, num_steps):
+            transition_step(prev, cur, eta[i], resets[i, t], flags, init, lower_bounds, upper_bounds)
+            for k in range(num_params):
+                theta_t[i, t, k] = cur[k]
+            prev, cur = cur, prev
+    return theta_t
+
+
+def block_resets(num_steps, block_starts=(), blocks=None):
+    """
+    Returns a boolean array of shape (num_steps,) that is True at the first trial of every
+    block, given either the trials at which blocks start or the block of every trial.
+    """
+    resets = np.zeros(num_steps, dtype=np.bool_)
+    if blocks is not None:
+        blocks = np.asarray(blocks)
+        resets[1:] = blocks[1:] != blocks[:-1]
+    resets[[t for t in block_starts if 0 < t < num_steps]] = True
+    return resets
+
+
+class TransitionSampler:
+    """
+    A batched, jitted sampler of theta trajectories under a named transition.
+
+    Parameters
+    ----------
+    name : str
+        A registered transition or a "+" combination, e.g. "random_walk+block_reset".
+    init : np.ndarray
+        The initial prior of the parameters, see `initial_prior`.
+    lower_bounds, upper_bounds : array_like
+        The bounds of the parameters.
+    block_starts : tuple of int, optional
+        The trials at which blocks start, for transitions with "block_reset".
+
+    Examples
+    --------
+    >>> sampler = TransitionSampler(
+    ...     "random_walk+block_reset", initial_prior(("uniform", 0, 1), ("softplus_normal", 1, 30)),
+    ...     lower_bounds=(0, 0), upper_bounds=(1, 80), block_starts=(80, 160),
+    ... )
+    >>> theta = sampler(eta, num_steps=240, seeds=seeds)    # (batch_size, 240, 2)
+    """
+
+    def __init__(self, name, init, lower_bounds, upper_bounds, block_starts=()):
+        self.name = name
+        self.flags = transition_flags(name)
+        self.init = np.asarray(init, dtype=np.float64)
+        num_params = self.init.shape[0]
+        self.lower_bounds = np.broadcast_to(np.asarray(lower_bounds, dtype=np.float64), (num_params,)).copy()
+        self.upper_bounds = np.broadcast_to(np.asarray(upper_bounds, dtype=np.float64), (num_params,)).copy()
+        self.block_starts = tuple(block_starts)
+        self.num_eta = num_eta(self.flags, num_params)
+
+    def __call__(self, eta, num_steps=None, seeds=None, resets=None):
+        """
+        Draws one trajectory per row of `eta`.
+
+        Parameters
+        ----------
+        eta : np.ndarray
+            A 2D array of shape (batch_size, num_eta) with the hyper parameters, which
+            may have no columns for the "static" and "block_reset" transitions.
+        num_steps : int or None, optional
+            The number of trials. Required unless `resets` is given.
+        seeds : np.ndarray or None, optional
+            One integer seed per batch row. If None, fresh entropy is drawn from the OS.
+        resets : np.ndarray or None, optional
+            The block starts of all rows (num_steps,) or of every row (batch_size,
+            num_steps), e.g. from `block_resets(num_steps, blocks=context[:, 2])`.
+            Defaults to the `block_starts` of the sampler.
+
+        Returns
+        -------
+        np.ndarray
+            A float32 array of shape (batch_size, num_steps, P).
+        """
+        eta = np.atleast_2d(np.asarray(eta, dtype=np.float64))
+        batch_size = eta.shape[0]
+        if resets is None:
+            resets = block_resets(num_steps, self.block_starts)
+        resets = np.broadcast_to(np.asarray(resets, dtype=np.bool_), (batch_size, np.shape(resets)[-1]))
+        if seeds is None:
+            seeds = np.random.SeedSequence().generate_state(batch_size)
+        return sample_transitions_batch(
+            self.flags, self.init, eta, resets, self.lower_bounds, self.upper_bounds, seeds
+        )
+
+    def filter_transition(self):
+        """
+        Returns the transition as a jitted `transition(theta_prev, theta, eta, context, t)`
+        for `particle_filter.run_filter`. It draws with `transition_step` under the flags,
+        initial prior, bounds and block starts of the sampler, so the filter and the
+        simulations share one transition.
+
+        The function is compiled on its first call in every process and not cached on disk.
+        """
+        flags, init = self.flags, self.init
+        lower_bounds, upper_bounds = self.lower_bounds, self.upper_bounds
+        resets = block_resets(max(self.block_starts, default=0) + 1, self.block_starts)
+
+        @njit
+        def transition(theta_prev, theta, eta, context, t):
+            reset = t < resets.shape[0] and resets[t]
+            transition_step(theta_prev, theta, eta, reset, flags, init, lower_bounds, upper_bounds)
+
+        return transition
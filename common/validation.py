@@ -0,0 +1,207 @@
+import numpy as np
+
+DEFAULT_LEVELS = (0.5, 0.8, 0.95)
+
+
+def sbc_ranks(post_draws, true_values, sample_axis=1):
+    """
+    Computes simulation-based calibration ranks: the number of posterior draws below the
+    true value, for every simulation, time step and parameter.
+
+    Parameters
+    ----------
+    post_draws : np.ndarray
+        Posterior draws of shape (num_sims, num_samples, num_steps, num_params), or with
+        the samples on another axis given by `sample_axis`.
+    true_values : np.ndarray
+        The data-generating values of shape (num_sims, num_steps, num_params).
+    sample_axis : int, optional
+        The axis of `post_draws` that indexes the posterior samples (default is 1).
+
+    Returns
+    -------
+    np.ndarray
+        An integer array of shape (num_sims, num_steps, num_params) with ranks in
+        [0, num_samples].
+    """
+    post_draws = np.moveaxis(post_draws, sample_axis, 1)
+    return (post_draws < np.asarray(true_values)[:, None]).sum(axis=1)
+
+
+def rank_histogram(ranks, num_samples, num_bins=20):
+    """
+    Bins SBC ranks per time step and parameter.
+
+    Parameters
+    ----------
+    ranks : np.ndarray
+        Ranks of shape (num_sims, num_steps, num_params) as returned by `sbc_ranks`.
+    num_samples : int
+        The number of posterior draws the ranks were computed from.
+    num_bins : int, optional
+        The number of equally wide bins over [0, num_samples] (default is 20).
+
+    Returns
+    -------
+    np.ndarray
+        An integer array of shape (num_bins, num_steps, num_params) with the counts of
+        every bin. Under calibration, all bins have the same expected count.
+    """
+    bins = np.minimum(ranks * num_bins // (num_samples + 1), num_bins - 1)
+    counts = np.zeros((num_bins, *ranks.shape[1:]), dtype=np.int64)
+    for b in range(num_bins):
+        counts[b] = (bins == b).sum(axis=0)
+    return counts
+
+
+class RecoveryAccumulator:
+    """
+    Streaming per-time-step recovery metrics and interval coverage.
+
+    Simulations are added in chunks with `update`, which only keeps running sums of
+    shape (num_steps, num_params), so the metrics of arbitrarily many simulations can be
+    computed from memory-mapped posterior draws. The R² matches
+    `sklearn.metrics.r2_score(true, estimate)` per time step and parameter.
+
+    Parameters
+    ----------
+    num_steps : int
+        The number of time steps.
+    num_params : int
+        The number of local parameters.
+    levels : tuple of float, optional
+        The credibility levels of the central posterior intervals whose coverage is
+        tracked (default is (0.5, 0.8, 0.95)).
+    """
+
+    def __init__(self, num_steps, num_params, levels=DEFAULT_LEVELS):
+        self.levels = np.asarray(levels)
+        shape = (num_steps, num_params)
+        self.n = np.zeros(shape)
+        self.sum_true = np.zeros(shape)
+        self.sum_true_sq = np.zeros(shape)
+        self.sum_est = np.zeros(shape)
+        self.sum_est_sq = np.zeros(shape)
+        self.sum_cross = np.zeros(shape)
+        self.covered = np.zeros((len(self.levels), *shape))
+
+    def update(self, true_values, estimates, ranks=None, num_samples=None, mask=None):
+        """
+        Adds a chunk of simulations.
+
+        Parameters
+        ----------
+        true_values : np.ndarray
+            The data-generating values of shape (num_sims, num_steps, num_params).
+        estimates : np.ndarray
+            The point estimates (e.g. posterior medians) of the same shape.
+        ranks : np.ndarray or None, optional
+            The SBC ranks of the same shape. Required for the coverage.
+        num_samples : int or None, optional
+            The number of posterior draws behind `ranks`.
+        mask : np.ndarray or None, optional
+            A boolean array of shape (num_sims, num_steps) that excludes padded trials.
+        """
+        true_values = np.asarray(true_values, dtype=np.float64)
+        estimates = np.asarray(estimates, dtype=np.float64)
+        w = np.ones(true_values.shape) if mask is None else np.broadcast_to(
+            np.asarray(mask, dtype=np.float64)[:, :, None], true_values.shape
+        )
+        true_values = np.where(w > 0, true_values, 0)
+        estimates = np.where(w > 0, estimates, 0)
+        self.n += w.sum(axis=0)
+        self.sum_true += (w * true_values).sum(axis=0)
+        self.sum_true_sq += (w * true_values ** 2).sum(axis=0)
+        self.sum_est += (w * estimates).sum(axis=0)
+        self.sum_est_sq += (w * estimates ** 2).sum(axis=0)
+        self.sum_cross += (w * true_values * estimates).sum(axis=0)
+        if ranks is not None:
+            # the true value lies in the central interval of level q iff its quantile
+            # within the posterior draws lies in [(1 - q) / 2, (1 + q) / 2]
+            quantile = ranks / num_samples
+            for i, q in enumerate(self.levels):
+                inside = (quantile >= (1 - q) / 2) & (quantile <= (1 + q) / 2)
+                self.covered[i] += (w * inside).sum(axis=0)
+
+    def result(self):
+        """
+        Returns the metrics of all simulations added so far.
+
+        Returns
+        -------
+        dict
+            The keys 'r2', 'rmse' and 'correlation' with arrays of shape
+            (num_steps, num_params), and 'coverage' with shape (num_levels, num_steps,
+            num_params), together with 'levels'.
+        """
+        n = self.n
+        # time steps without any (unmasked) simulation yield NaN
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_true = self.sum_true / n
+            mean_est = self.sum_est / n
+            ss_true = self.sum_true_sq - n * mean_true ** 2
+            ss_est = self.sum_est_sq - n * mean_est ** 2
+            cross = self.sum_cross - n * mean_true * mean_est
+            ss_res = self.sum_true_sq - 2 * self.sum_cross + self.sum_est_sq
+            return dict(
+                r2=1 - ss_res / ss_true,
+                rmse=np.sqrt(ss_res / n),
+                correlation=cross / np.sqrt(ss_true * ss_est),
+                coverage=self.covered / n,
+                levels=self.levels,
+            )
+
+
+def validate(post_draws, true_values, sample_axis=1, estimator="median", levels=DEFAULT_LEVELS,
+             mask=None, chunk_size=100):
+    """
+    Computes SBC ranks, per-time-step recovery metrics and coverage for a validation set.
+
+    The simulations are processed in chunks of `chunk_size`, so `post_draws` can be a
+    memory-mapped array (e.g. from `posterior_sampling.load_posterior`) larger than the
+    available memory.
+
+    Parameters
+    ----------
+    post_draws : np.ndarray
+        Posterior draws of shape (num_sims, num_samples, num_steps, num_params), or with
+        the samples on another axis given by `sample_axis`; `sample_axis=2` matches the
+        local samples of `amortizer.sample` and `posterior_sampling.sample_subjects`.
+    true_values : np.ndarray
+        The data-generating values of shape (num_sims, num_steps, num_params).
+    sample_axis : int, optional
+        The axis of `post_draws` that indexes the posterior samples (default is 1).
+    estimator : str, optional
+        The point estimate used for the recovery metrics, "median" (default) or "mean".
+    levels : tuple of float, optional
+        The credibility levels of the coverage (default is (0.5, 0.8, 0.95)).
+    mask : np.ndarray or None, optional
+        A boolean array of shape (num_sims, num_steps) that excludes padded trials.
+    chunk_size : int, optional
+        The number of simulations per chunk (default is 100).
+
+    Returns
+    -------
+    dict
+        The metrics of `RecoveryAccumulator.result`, the 'ranks' of shape
+        (num_sims, num_steps, num_params) and 'num_samples'.
+    """
+    num_sims = post_draws.shape[0]
+    num_samples = post_draws.shape[sample_axis]
+    num_steps, num_params = true_values.shape[1:]
+    reduce = np.median if estimator == "median" else np.mean
+    accumulator = RecoveryAccumulator(num_steps, num_params, levels)
+    ranks = np.zeros((num_sims, num_steps, num_params), dtype=np.int32)
+    for start in range(0, num_sims, chunk_size):
+        stop = min(start + chunk_size, num_sims)
+        draws = np.moveaxis(np.asarray(post_draws[start:stop]), sample_axis, 1)
+        true_chunk = np.asarray(true_values[start:stop])
+        ranks[start:stop] = sbc_ranks(draws, true_chunk)
+        accumulator.update(
+            true_chunk, reduce(draws, axis=1), ranks[start:stop], num_samples,
+            None if mask is None else mask[start:stop],
+        )
+    results = accumulator.result()
+    results["ranks"] = ranks
+    results["num_samples"] = num_samples
+    return results
@@ -1,22 +1,45 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from scipy.stats import halfnorm, uniform
-from keras.utils import to_categorical
 
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from encoding import output_buffer
+from empirical import empirical_conditions
+from profiling import instrument
+from context import STORE
+
+# bump whenever the encoding of the conditions changes, to invalidate the cached
+# empirical conditions (see `load_empirical_conditions`)
+CONFIGURATOR_VERSION = 1
+DATA_PATH = "../data/data_prepared.csv"
+
+# moments of the half-normal and uniform hyper priors in closed form, so that importing
+# the configurator does not pull in scipy.stats
 GLOBAL_PRIOR_MEAN = np.concatenate(
-    [halfnorm(0, [0.02, 0.5]).mean().round(decimals=2),
-    uniform(0, [0.04, 0.04]).mean().round(decimals=2)]
+    [(np.array([0.02, 0.5]) * np.sqrt(2 / np.pi)).round(decimals=2),
+    (np.array([0.04, 0.04]) / 2).round(decimals=2)]
 )
 GLOBAL_PRIOR_STD = np.concatenate(
-    [halfnorm(0, [0.02, 0.5]).std().round(decimals=2),
-    uniform(0, [0.04, 0.04]).std().round(decimals=2)]
+    [(np.array([0.02, 0.5]) * np.sqrt(1 - 2 / np.pi)).round(decimals=2),
+    (np.array([0.04, 0.04]) / np.sqrt(12)).round(decimals=2)]
 )
 LOCAL_PRIOR_MEAN = np.array([0.43, 4.87])
 LOCAL_PRIOR_STD = np.array([0.25, 3.63])
 
-def configure_input(forward_dict):
+def configure_conditions(forward_dict, out=None):
     data = forward_dict.get("sim_data")
-    context = np.array(forward_dict.get("sim_batchable_context"))[:, :, 1:]
-    summary_conditions = np.c_[data, context]
+    context = forward_dict.get("sim_batchable_context")
+    # choices and rewards followed by the reward probabilities of both options, written
+    # into one float32 buffer that can be passed in again as `out`
+    summary_conditions = output_buffer(out, (*data.shape[:2], 4))
+    summary_conditions[:, :, :2] = data
+    summary_conditions[:, :, 2:] = np.asarray(context)[:, :, 1:]
+    return dict(summary_conditions=summary_conditions)
+
+@instrument("configurator")
+def configure_input(forward_dict, out=None):
+    summary_conditions = configure_conditions(forward_dict, out)["summary_conditions"]
 
     theta = forward_dict.get("local_prior_draws")
     eta = forward_dict.get("hyper_prior_draws")
@@ -24,6 +47,21 @@ def configure_input(forward_dict):
     out_dict = dict(
         local_parameters=((theta - LOCAL_PRIOR_MEAN) / LOCAL_PRIOR_STD).astype(np.float32),
         hyper_parameters=((eta - GLOBAL_PRIOR_MEAN) / GLOBAL_PRIOR_STD).astype(np.float32),
-        summary_conditions=summary_conditions.astype(np.float32),
+        summary_conditions=summary_conditions,
     )
-    return out_dict
\ No newline at end of file
+    return out_dict
+
+def empirical_forward_dict(rows):
+    # choices and rewards, and the context columns in the order of the simulator
+    return {
+        "sim_data": np.stack([rows["choice"], rows["reward"]], axis=-1)[None],
+        "sim_batchable_context": np.stack([rows[column] for column in STORE.columns], axis=-1)[None],
+    }
+
+def load_empirical_conditions(csv_path=DATA_PATH):
+    """
+    Returns the 'summary_conditions' of all subjects in `csv_path`, as `configure_input`
+    would produce them, together with their 'lengths' and 'subjects'. Trials without a
+    response keep their NaN choice and reward, as in the data.
+    """
+    return empirical_conditions(csv_path, empirical_forward_dict, configure_conditions, CONFIGURATOR_VERSION)
@@ -1,15 +1,28 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from context_store import ContextStore
 
 RNG = np.random.default_rng()
 
-DATA = pd.read_csv("../data/data_prepared.csv")
-SUBJECTS = np.unique(DATA.id)
+STORE = ContextStore(
+    "../data/data_prepared.csv",
+    columns=['stim_set', 'p_a', 'p_b'],
+    dtype=np.float32,
+    rng=RNG,
+)
+
+def __getattr__(name):
+    # the data is only read on first access, not when the module is imported
+    if name == "SUBJECTS":
+        return STORE.subjects
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def generate_context(rng=None):
+    return STORE.generate_context(rng)
 
-def generate_context():
-    random_sub = RNG.choice(
-        SUBJECTS, 1, replace=False
-    )[0]
-    person_data = DATA.loc[DATA.id == random_sub]
-    context = person_data[['stim_set', 'p_a', 'p_b']].to_numpy().astype(np.float32)
-    return context
\ No newline at end of file
+def generate_contexts(batch_size, rng=None):
+    return STORE.generate_contexts(batch_size, rng)
@@ -0,0 +1,46 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+from numba import njit
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from particle_filter import run_filter
+from priors import draw_theta_0, transition_step
+from likelihood import loglik_step, NUM_VALUES
+
+@njit(cache=True)
+def transition(theta_prev, theta, eta, context, t):
+    transition_step(theta_prev, theta, eta)
+
+def filter_subject(context, data, eta, num_particles=2000, ess_threshold=0.5, seed=None):
+    """
+    Estimates the filtered and smoothed trajectories of theta_t = (alpha, tau) of one subject
+    with a bootstrap particle filter, as a training-free reference for the amortizer.
+
+    Parameters
+    ----------
+    context : np.ndarray
+        A 2D array of shape (num_steps, 3) with the stimulus set and the reward probabilities.
+    data : np.ndarray
+        A 2D array of shape (num_steps, 2) with the observed choices and rewards.
+    eta : array_like
+        The scales and switching probabilities of the mixture random walk.
+    num_particles : int, optional
+        The number of particles (default is 2000).
+    ess_threshold : float, optional
+        Relative effective sample size that triggers resampling (default is 0.5).
+    seed : int or None, optional
+        The seed of the filter.
+
+    Returns
+    -------
+    dict
+        The filtered and smoothed means and standard deviations of shape (num_steps, 2), the
+        effective sample sizes and the log evidence, see `particle_filter.run_filter`.
+    """
+    return run_filter(
+        draw_theta_0, transition, loglik_step, eta, np.asarray(context, dtype=np.float64),
+        np.asarray(data, dtype=np.float64), num_params=2, num_values=NUM_VALUES,
+        num_particles=num_particles, ess_threshold=ess_threshold, seed=seed
+    )
@@ -1,28 +1,283 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from numba import njit
-from helpers import softmax, select_action
+from numba import njit, prange
+from helpers import sample_softmax, log_softmax_at, delta_update
+from priors import sample_eta, sample_theta_t_batch, NUM_STEPS
+from context import generate_contexts
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from rng import batch_streams
+from profiling import stage
+from autotune import apply as apply_tuning
+from predictive import group_bins, learning_curves
 
 BLOCK_IDX = np.arange(0, 512, 128)
+# indices of the values of the two stimulus sets
+PAIRS = np.array([[0, 1], [2, 3]], dtype=np.int64)
 
-@njit
+@njit(cache=True)
 def sample_softmax_rl(theta, context):
     num_steps = theta.shape[0]
-    sim_data = np.zeros((num_steps, 2))
+    # choices and rewards are binary
+    sim_data = np.zeros((num_steps, 2), dtype=np.int8)
     for t in range(num_steps):
         if t in BLOCK_IDX:
             values = np.full(4, 0.5)
             # mean_value = np.mean(values)
             # values = np.full(4, mean_value)
-        if context[t, 0] == 0:
-            action_probs = softmax(values[:2], theta[t, 1])
-            resp = select_action(np.array([0, 1]), action_probs)
-            sim_data[t, 0] = resp
-            sim_data[t, 1] = np.random.binomial(1, context[t, int(resp)+1])
-            values[int(resp)] += theta[t, 0] * (sim_data[t, 1] - values[int(resp)])
-        else:
-            action_probs = softmax(values[2:], theta[t, 1])
-            resp = select_action(np.array([0, 1]), action_probs)
-            sim_data[t, 0] = resp
-            sim_data[t, 1] = np.random.binomial(1, context[t, int(resp)+1])
-            values[2:][int(resp)] += theta[t, 0] * (sim_data[t, 1] - values[2:][int(resp)])
+        offset = 0 if context[t, 0] == 0 else 2
+        resp = sample_softmax(values[offset:offset + 2], theta[t, 1])
+        sim_data[t, 0] = resp
+        sim_data[t, 1] = np.random.binomial(1, context[t, resp + 1])
+        delta_update(values, offset + resp, sim_data[t, 1], theta[t, 0])
+    return sim_data
+
+@njit(parallel=True, cache=True)
+def sample_softmax_rl_batch(theta, context, seeds):
+    """
+    Simulates `sample_softmax_rl` for a batch of data sets in parallel.
+
+    Every batch row reseeds numba's random state with `seeds[i]`, so a batch is
+    reproducible regardless of the number of threads.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (batch_size, num_steps, 2) with theta trajectories.
+    context : np.ndarray
+        A 3D array of shape (batch_size, num_steps, 3) with the contexts.
+    seeds : np.ndarray
+        A 1D array of shape (batch_size,) with one integer seed per batch row.
+
+    Returns
+    -------
+    np.ndarray
+        An int8 array of shape (batch_size, num_steps, 2) with the choices and rewards.
+    """
+    sim_data = np.zeros((theta.shape[0], theta.shape[1], 2), dtype=np.int8)
+    for i in prange(theta.shape[0]):
+        np.random.seed(seeds[i])
+        sim_data[i] = sample_softmax_rl(theta[i], context[i])
     return sim_data
+
+@njit(parallel=True, cache=True)
+def predictive_batch(theta, context, bins, num_bins, seeds):
+    """
+    Simulates `sample_softmax_rl` for a batch of posterior draws on the same context and
+    sums the choices of the option with the higher reward probability per bin of a
+    learning curve, without keeping the simulated data sets.
+
+    Every draw `i` reseeds numba's random state with `seeds[i]`, so the result is
+    reproducible regardless of the number of threads.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (num_draws, num_steps, 2) with theta trajectories.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 3), shared by all draws.
+    bins : np.ndarray
+        A 1D integer array of shape (num_steps,) with the bin of every trial.
+    num_bins : int
+        The number of bins.
+    seeds : np.ndarray
+        A 1D array of shape (num_draws,) with one integer seed per draw.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D array of shape (num_draws, num_bins) with the number of correct choices.
+    """
+    num_draws = theta.shape[0]
+    num_steps = context.shape[0]
+    sums = np.zeros((num_draws, num_bins))
+    for i in prange(num_draws):
+        np.random.seed(seeds[i])
+        sim_data = sample_softmax_rl(theta[i], context)
+        for t in range(num_steps):
+            better = 1 if context[t, 2] > context[t, 1] else 0
+            sums[i, bins[t]] += sim_data[t, 0] == better
+    return sums
+
+# keys of the learning curves of `posterior_predictive`, computed from a (num_steps, 3) context
+GROUPINGS = {
+    "block": lambda context: np.searchsorted(BLOCK_IDX, np.arange(context.shape[0]), side="right") - 1,
+    "trial_in_block": lambda context: np.arange(context.shape[0]) % BLOCK_IDX[1],
+    "stim_set": lambda context: context[:, 0],
+    "trial": lambda context: np.arange(context.shape[0]),
+}
+
+def posterior_predictive(theta, context, data=None, by=("block", "trial_in_block"), seed=None):
+    """
+    Simulates the posterior draws of one subject and reduces them to learning curves of
+    the accuracy, i.e. the share of choices of the option with the higher reward probability.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (num_draws, num_steps, 2) with posterior draws of alpha and tau,
+        e.g. from `predictive.subject_draws`.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 3) with the empirical context of the subject.
+    data : np.ndarray or None, optional
+        A 2D array of shape (num_steps, 2) with the observed choices and rewards. If given,
+        the observed learning curve is added; trials with a NaN choice are left out of it.
+    by : tuple of str, optional
+        The keys of GROUPINGS that define the bins (default is block and trial in block).
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the simulations.
+
+    Returns
+    -------
+    dict
+        The learning curves, see `predictive.learning_curves`.
+    """
+    context = np.asarray(context, dtype=np.float64)
+    bins, labels = group_bins([GROUPINGS[name](context) for name in by])
+    _, seeds = batch_streams(seed, theta.shape[0])
+    sums = predictive_batch(theta, context, bins, len(labels), seeds)
+    observed = None
+    if data is not None:
+        choice = np.asarray(data, dtype=np.float64)[:, 0]
+        better = (context[:, 2] > context[:, 1]).astype(np.float64)
+        observed = np.where(np.isnan(choice), np.nan, choice == better)
+    return learning_curves(sums, bins, labels, by, observed)
+
+NUM_VALUES = 4
+
+@njit(cache=True)
+def loglik_step(theta, params, values, context, data, t):
+    """
+    Computes the log-probability of the observed choice at trial t under the softmax RL model
+    and updates the values of both stimulus sets in place.
+
+    This is the update rule of `sample_softmax_rl` applied to the observed choices and rewards.
+    Trials with a missing choice (NaN) contribute a log-probability of zero and leave the
+    values untouched.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 1D array of shape (2,) with alpha and tau at trial t.
+    params : np.ndarray
+        Unused, the model has no time-constant parameters.
+    values : np.ndarray
+        A 1D array of shape (NUM_VALUES,) with the values of both stimulus sets.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 3) with the stimulus set and the reward probabilities.
+    data : np.ndarray
+        A 2D array of shape (num_steps, 2) with the observed choices and rewards.
+    t : int
+        The current trial.
+
+    Returns
+    -------
+    float
+        The log-probability of the observed choice.
+    """
+    if t in BLOCK_IDX:
+        values[:] = 0.5
+    if np.isnan(data[t, 0]):
+        return 0.0
+    resp = int(data[t, 0])
+    offset = 0 if context[t, 0] == 0 else 2
+    log_p = log_softmax_at(values, PAIRS[offset // 2], theta[1], resp)
+    delta_update(values, offset + resp, data[t, 1], theta[0])
+    return log_p
+
+@njit(cache=True)
+def loglik_softmax_rl(theta, context, data):
+    """
+    Computes the per-trial log-probabilities of observed choices under the softmax RL model.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 2D array of shape (num_steps, 2) with the trajectories of alpha and tau.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 3) with the stimulus set and the reward probabilities.
+    data : np.ndarray
+        A 2D array of shape (num_steps, 2) with the observed choices and rewards.
+
+    Returns
+    -------
+    np.ndarray
+        A 1D array of shape (num_steps,) with the log-probability of every observed choice.
+        Missing choices contribute zero (see `loglik_step`).
+    """
+    num_steps = theta.shape[0]
+    log_p = np.zeros(num_steps)
+    values = np.zeros(NUM_VALUES)
+    params = np.zeros(0)
+    for t in range(num_steps):
+        log_p[t] = loglik_step(theta[t], params, values, context, data, t)
+    return log_p
+
+@njit(parallel=True, cache=True)
+def loglik_softmax_rl_batch(theta, context, data):
+    """
+    Computes `loglik_softmax_rl` for a batch of theta trajectories on the same observed data.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (num_draws, num_steps, 2) with theta trajectories.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 3), shared by all draws.
+    data : np.ndarray
+        A 2D array of shape (num_steps, 2) with the observed choices and rewards.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D array of shape (num_draws, num_steps) with per-trial log-probabilities.
+    """
+    num_draws = theta.shape[0]
+    log_p = np.zeros((num_draws, theta.shape[1]))
+    for i in prange(num_draws):
+        log_p[i] = loglik_softmax_rl(theta[i], context, data)
+    return log_p
+
+def generative_model(batch_size=32, seed=None):
+    """
+    Simulates a batch of data sets from the non-stationary softmax RL model.
+
+    Mirrors the bayesflow `TwoLevelGenerativeModel` of the notebooks (hyper prior
+    `sample_eta`, local prior `sample_theta_t`, simulator `sample_softmax_rl` with
+    empirical contexts) and returns its keys, but draws the theta trajectories and the
+    choices with the batched kernels. All random draws derive from `seed`.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        The number of data sets to simulate (default is 32). The numba threads of the
+        calling thread are set to the tuned value of this model on the first call (see
+        `autotune.apply`).
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the batch, e.g. `rng.batch_sequence(experiment_seed, index)`. If None,
+        fresh entropy is drawn from the OS.
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys 'hyper_prior_draws', 'local_prior_draws',
+        'sim_batchable_context' and 'sim_data'.
+    """
+    apply_tuning("reversal_learning")
+    rng, prior_seeds, sim_seeds = batch_streams(seed, batch_size, num_kernels=2)
+    with stage("prior") as s:
+        eta = np.stack([sample_eta(rng=rng) for _ in range(batch_size)])
+        theta = s.record(sample_theta_t_batch(eta, NUM_STEPS, prior_seeds))
+    with stage("context") as s:
+        context = s.record(generate_contexts(batch_size, rng=rng))
+    with stage("simulator") as s:
+        sim_data = s.record(sample_softmax_rl_batch(theta, context, sim_seeds))
+    with stage("outputs") as s:
+        return s.record({
+            'hyper_prior_draws': eta.astype(np.float32),
+            'local_prior_draws': theta,
+            'sim_batchable_context': np.asarray(context),
+            'sim_data': sim_data,
+        })
@@ -1,29 +1,47 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from scipy.stats import halfnorm
-from numba import njit
+from numba import njit, prange
 
 from helpers import truncnorm_better
 
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+import transitions
+from transitions import TransitionSampler, draw_initial, initial_prior, transition_flags
+
 RNG = np.random.default_rng()
 NUM_STEPS = 512
+LOWER_BOUNDS = np.array([0., 0.])
+UPPER_BOUNDS = np.array([1., 15.])
+# the mixture random walk of `sample_theta_t` in the registry of `common/transitions.py`:
+# a switch draws from the initial prior of `draw_theta_0`
+TRANSITION = "regime_switching"
+FLAGS = transition_flags(TRANSITION)
+INITIAL_PRIOR = initial_prior(("beta", 1.5, 2), ("truncnorm", 1, 5, 0, 15))
 
-def sample_theta_0():
-    alpha = RNG.beta(a=1.5, b=2)
-    tau = truncnorm_better(loc=1, scale=5, low=0, high=15)
+def sample_theta_0(rng=None):
+    rng = RNG if rng is None else rng
+    alpha = rng.beta(a=1.5, b=2)
+    tau = truncnorm_better(loc=1, scale=5, low=0, high=15, rng=rng)
     return np.array([alpha, tau[0]])
 
-def sample_eta():
-    scales = halfnorm.rvs(loc=0, scale=(0.02, 0.5))
-    switch_probabilities = RNG.uniform(low=0, high=0.04, size=2)
+def sample_eta(rng=None):
+    from scipy.stats import halfnorm
+
+    rng = RNG if rng is None else rng
+    scales = halfnorm.rvs(loc=0, scale=(0.02, 0.5), random_state=rng)
+    switch_probabilities = rng.uniform(low=0, high=0.04, size=2)
     return np.concatenate([scales, switch_probabilities])
 
-def sample_theta_t(eta, num_steps=NUM_STEPS):
+def sample_theta_t(eta, num_steps=NUM_STEPS, rng=None):
+    rng = RNG if rng is None else rng
     lower_bounds = np.array([0, 0])
     upper_bounds = np.array([1, 15])
     theta_t = np.zeros((num_steps, 2))
-    theta_t[0] = sample_theta_0()
-    z = np.random.randn(num_steps - 1, 2)
-    stay = 1 - RNG.binomial(1, eta[2:], size=(num_steps-1, 2))
+    theta_t[0] = sample_theta_0(rng=rng)
+    z = rng.standard_normal((num_steps - 1, 2))
+    stay = 1 - rng.binomial(1, eta[2:], size=(num_steps-1, 2))
     for t in range(1, num_steps):
         # update alpha
         if stay[t-1, 0] == 1:
@@ -32,7 +50,7 @@ def sample_theta_t(eta, num_steps=NUM_STEPS):
                 lower_bounds[0]
             )
         else:
-            theta_t[t, 0] = RNG.beta(a=1.5, b=2)
+            theta_t[t, 0] = rng.beta(a=1.5, b=2)
         # update tau
         if stay[t-1, 1] == 1:
             theta_t[t, 1] = np.maximum(
@@ -40,5 +58,71 @@ def sample_theta_t(eta, num_steps=NUM_STEPS):
                 lower_bounds[1]
             )
         else:
-            theta_t[t, 1] = truncnorm_better(loc=1, scale=5, low=0, high=15)
+            theta_t[t, 1] = truncnorm_better(loc=1, scale=5, low=0, high=15, rng=rng)[0]
     return theta_t.astype(np.float32)
+
+@njit(cache=True)
+def draw_theta_0(theta):
+    for k in range(theta.shape[0]):
+        theta[k] = draw_initial(INITIAL_PRIOR, k)
+
+@njit(cache=True)
+def transition_step(theta_prev, theta, eta):
+    """
+    Draws theta_t given theta_{t-1} into `theta` under the mixture random walk of
+    `sample_theta_t` with `transitions.transition_step`: each parameter switches to a fresh
+    draw from its initial prior with probability eta[2:] and otherwise takes a clipped
+    Gaussian step with scale eta[:2].
+    """
+    transitions.transition_step(theta_prev, theta, eta, False, FLAGS, INITIAL_PRIOR, LOWER_BOUNDS, UPPER_BOUNDS)
+
+@njit(parallel=True, cache=True)
+def sample_theta_t_batch(eta, num_steps, seeds):
+    """
+    Draws a batch of theta trajectories from the mixture random walk of `sample_theta_t`.
+
+    The switches draw from the initial priors inside the kernel (beta for alpha, a
+    truncated normal for tau), so no scipy call is made per switch. Every batch row
+    reseeds numba's random state with `seeds[i]`, so a batch is reproducible regardless
+    of the number of threads.
+
+    Parameters
+    ----------
+    eta : np.ndarray
+        A 2D array of shape (batch_size, 4) with the scales followed by the switching
+        probabilities, as drawn by `sample_eta`.
+    num_steps : int
+        The number of trials.
+    seeds : np.ndarray
+        A 1D array of shape (batch_size,) with one integer seed per batch row.
+
+    Returns
+    -------
+    np.ndarray
+        A float32 array of shape (batch_size, num_steps, 2) with the trajectories of alpha and tau.
+    """
+    batch_size = eta.shape[0]
+    theta_t = np.empty((batch_size, num_steps, 2), dtype=np.float32)
+    for i in prange(batch_size):
+        np.random.seed(seeds[i])
+        # the walk runs in float64 on two swapped buffers and is stored as float32
+        prev = np.empty(2)
+        cur = np.empty(2)
+        draw_theta_0(prev)
+        for k in range(2):
+            theta_t[i, 0, k] = prev[k]
+        for t in range(1, num_steps):
+            transition_step(prev, cur, eta[i])
+            for k in range(2):
+                theta_t[i, t, k] = cur[k]
+            prev, cur = cur, prev
+    return theta_t
+
+def transition_sampler(name=TRANSITION):
+    """
+    Returns the batched sampler of theta trajectories under the transition `name` of the
+    registry in `common/transitions.py`, with the initial prior and bounds of this model.
+    The default TRANSITION draws the same trajectories as `sample_theta_t_batch`, given
+    the same seeds.
+    """
+    return TransitionSampler(name, INITIAL_PRIOR, LOWER_BOUNDS, UPPER_BOUNDS)
@@ -0,0 +1,21 @@
+import numpy as np
+
+from likelihood import sample_softmax_rl_batch, loglik_softmax_rl_batch
+from priors import NUM_STEPS, sample_theta_t_batch
+
+
+def warmup():
+    """
+    Compiles the jitted prior, simulation and likelihood kernels, or loads them from numba's
+    on-disk cache, by running them once on a small synthetic input.
+
+    The inputs have the same types as the contexts of the store (float32) and the
+    simulated data, so the first real batch does not trigger another compilation. No
+    empirical data is read.
+    """
+    seeds = np.random.SeedSequence(0).generate_state(1)
+    theta = sample_theta_t_batch(np.full((1, 4), 0.02), NUM_STEPS, seeds)
+    context = np.full((1, NUM_STEPS, 3), 0.5, dtype=np.float32)
+    data = sample_softmax_rl_batch(theta, context, seeds)
+    # observed data are float64, with NaN for missed responses
+    loglik_softmax_rl_batch(theta, context[0], data[0].astype(np.float64))
@@ -1,33 +1,71 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from scipy.stats import halfnorm
-from keras.utils import to_categorical
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from encoding import output_buffer, one_hot_into
+from empirical import empirical_conditions
+from profiling import instrument
+from context import STORE
+
+# bump whenever the encoding of the conditions changes, to invalidate the cached
+# empirical conditions (see `load_empirical_conditions`)
+CONFIGURATOR_VERSION = 1
+DATA_PATH = "../data/data_prepared.csv"
 
 THETA_PRIOR_MEAN = np.array([0.5, 0.5])
 THETA_PRIOR_STD = np.array([0.3, 0.3])
-ETA_PRIOR_MEAN = np.round(halfnorm(0, 0.05).mean(), decimals=2)
-ETA_PRIOR_STD = np.round(halfnorm(0, 0.05).std(), decimals=2)
+# moments of the half-normal hyper prior in closed form, so that importing the
+# configurator does not pull in scipy.stats
+ETA_PRIOR_MEAN = np.round(0.05 * np.sqrt(2 / np.pi), decimals=2)
+ETA_PRIOR_STD = np.round(0.05 * np.sqrt(1 - 2 / np.pi), decimals=2)
 KAPPA_PRIOR_MEAN = np.array([0.5, 4.7])
 KAPPA_PRIOR_STD = np.array([0.3, 1])
 
-def configure_input(forward_dict):
+NUM_ACTIONS = 3
+NUM_STIMULI = 6
+# column layout of the summary conditions:
+# response (one-hot), reward, stimulus (one-hot), correct response (one-hot), block, set size
+RESP_COLS = slice(0, NUM_ACTIONS)
+REWARD_COL = NUM_ACTIONS
+STIM_COLS = slice(REWARD_COL + 1, REWARD_COL + 1 + NUM_STIMULI)
+CORRECT_RESP_COLS = slice(STIM_COLS.stop, STIM_COLS.stop + NUM_ACTIONS)
+BLOCK_COL = CORRECT_RESP_COLS.stop
+SET_SIZE_COL = BLOCK_COL + 1
+NUM_FEATURES = SET_SIZE_COL + 1
+
+def configure_conditions(forward_dict, out=None):
     out_dict = {}
 
     data = forward_dict["sim_data"]
-    resp_one_hot = to_categorical(data[:, :, 0])
+    context = forward_dict["batchable_context"]
 
-    context = np.array(forward_dict["batchable_context"])
-    stim_one_hot = to_categorical(context[:, :, 0])
-    correct_resp_one_hot = to_categorical(context[:, :, 1])
-    block = (context[:, :, 2] / 13)[:, :, None]
-    set_size = ((context[:, :, 3] / 3) - 1)[:, :, None]
+    # the summary conditions are written column block by column block into one float32
+    # buffer, which can be passed in again as `out` to be reused across calls
+    summary_conditions = output_buffer(out, (*data.shape[:2], NUM_FEATURES))
+    one_hot_into(summary_conditions[:, :, RESP_COLS], data[:, :, 0])
+    summary_conditions[:, :, REWARD_COL] = data[:, :, 1]
+    one_hot_into(summary_conditions[:, :, STIM_COLS], context[:, :, 0])
+    one_hot_into(summary_conditions[:, :, CORRECT_RESP_COLS], context[:, :, 1])
+    summary_conditions[:, :, BLOCK_COL] = context[:, :, 2] / 13
+    summary_conditions[:, :, SET_SIZE_COL] = (context[:, :, 3] / 3) - 1
+    # padded trials of variable-length batches (see `model.BucketedGenerativeModel`) are zeroed
+    mask = forward_dict.get("mask")
+    if mask is not None:
+        summary_conditions[~mask] = 0
+    out_dict["summary_conditions"] = summary_conditions
 
-    out_dict["summary_conditions"] = np.c_[
-        resp_one_hot, data[:, :, 1:], stim_one_hot,
-        correct_resp_one_hot, block, set_size
-    ].astype(np.float32)
-
-    vec_num_obs = forward_dict["non_batchable_context"] * np.ones((data.shape[0], 1))
+    # the number of trials, either shared by the batch or one per row
+    num_obs = np.reshape(forward_dict["non_batchable_context"], (-1, 1))
+    vec_num_obs = num_obs * np.ones((data.shape[0], 1))
     out_dict["direct_conditions"] = np.sqrt(vec_num_obs).astype(np.float32)
+    return out_dict
+
+@instrument("configurator")
+def configure_input(forward_dict, out=None):
+    out_dict = configure_conditions(forward_dict, out)
+    mask = forward_dict.get("mask")
 
     theta = forward_dict['local_parameters']
     eta = forward_dict['global_parameters']
@@ -36,5 +74,24 @@ def configure_input(forward_dict):
     out_dict["local_parameters"] = ((theta - THETA_PRIOR_MEAN) / THETA_PRIOR_STD).astype(np.float32)
     out_dict["hyper_parameters"] = ((eta - ETA_PRIOR_MEAN) / ETA_PRIOR_STD).astype(np.float32)
     out_dict["shared_parameters"] = ((kappa - KAPPA_PRIOR_MEAN) / KAPPA_PRIOR_STD).astype(np.float32)
+    if mask is not None:
+        out_dict["local_parameters"][~mask] = 0
+        out_dict["mask"] = mask
+
+    return out_dict
+
+def empirical_forward_dict(rows):
+    # responses and rewards, and the context columns in the order of the simulator
+    return {
+        "sim_data": np.stack([rows["resp"], rows["reward"]], axis=-1)[None],
+        "batchable_context": np.stack([rows[column] for column in STORE.columns], axis=-1)[None],
+        "non_batchable_context": len(rows),
+    }
 
-    return out_dict
\ No newline at end of file
+def load_empirical_conditions(csv_path=DATA_PATH):
+    """
+    Returns the 'summary_conditions' and 'direct_conditions' of all subjects in `csv_path`,
+    as `configure_input` would produce them, together with their 'lengths' and 'subjects'.
+    Missed responses (-2) are encoded as an all-zero response.
+    """
+    return empirical_conditions(csv_path, empirical_forward_dict, configure_conditions, CONFIGURATOR_VERSION)
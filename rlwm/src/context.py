@@ -1,23 +1,51 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from context_store import ContextStore
 
 RNG = np.random.default_rng()
 
-DATA = pd.read_csv("../data/data_prepared.csv")
-NUM_SUB = len(np.unique(DATA.id))
+STORE = ContextStore(
+    "../data/data_prepared.csv",
+    columns=["stim", "correct_resp", "block", "set_size"],
+    # stimuli, responses, blocks (1-14) and set sizes (3-6) fit into int8
+    dtype=np.int8,
+    rng=RNG,
+)
 
 MIN_STEPS = 600
 MAX_STEPS = 780
 
-def generate_context(num_steps):
-    idx = RNG.choice(
-        np.arange(MAX_STEPS), MAX_STEPS - num_steps, replace=False
-    )
-    mask = np.full(MAX_STEPS, 1).astype(bool)
-    mask[idx] = False
-    sub = RNG.choice(np.unique(DATA.id))
-    sub_data = DATA.loc[DATA.id == sub]
-    return sub_data[["stim", "correct_resp", "block", "set_size"]].to_numpy()[mask, :]
-
-def random_num_steps(min_obs=MIN_STEPS, max_obs=MAX_STEPS):
-    return RNG.integers(low=min_obs, high=max_obs + 1)
\ No newline at end of file
+def __getattr__(name):
+    # the data is only read on first access, not when the module is imported
+    if name == "NUM_SUB":
+        return STORE.num_subjects
+    if name == "CONTEXTS":
+        # all subjects completed the full session, so the context of every subject can be
+        # stored as one contiguous (num_subjects, MAX_STEPS, 4) block for jitted lookups
+        return STORE.as_blocks()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def generate_context(num_steps, rng=None):
+    rng = RNG if rng is None else rng
+    # keep a random, ordered subset of the trials of the drawn subject, whatever its length
+    context = STORE.generate_context(rng)
+    idx = np.sort(rng.choice(len(context), num_steps, replace=False))
+    return context[idx]
+
+def generate_contexts(batch_size, num_steps, rng=None):
+    rng = RNG if rng is None else rng
+    sub = rng.integers(STORE.num_subjects, size=batch_size)
+    lengths = STORE.lengths[sub]
+    # the first `num_steps` of a random permutation of every subject's own trials; trials
+    # beyond the length of a subject are sorted to the end by an infinite key
+    keys = rng.random((batch_size, lengths.max()))
+    keys[np.arange(lengths.max())[None, :] >= lengths[:, None]] = np.inf
+    idx = np.sort(np.argsort(keys, axis=1)[:, :num_steps], axis=1)
+    return STORE.values[STORE.offsets[sub][:, None] + idx]
+
+def random_num_steps(min_obs=MIN_STEPS, max_obs=MAX_STEPS, rng=None):
+    return (RNG if rng is None else rng).integers(low=min_obs, high=max_obs + 1)
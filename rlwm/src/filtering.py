@@ -0,0 +1,48 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+from numba import njit
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from particle_filter import run_filter
+from priors import draw_theta_0, transition_step
+from model import loglik_step, NUM_VALUES
+
+@njit(cache=True)
+def transition(theta_prev, theta, eta, context, t):
+    transition_step(theta_prev, theta, eta, context[t, 2] != context[t - 1, 2])
+
+def filter_subject(context, data, eta, kappa, num_particles=2000, ess_threshold=0.5, seed=None):
+    """
+    Estimates the filtered and smoothed trajectories of theta_t = (alpha, p) of one subject
+    with a bootstrap particle filter, as a training-free reference for the amortizer.
+
+    Parameters
+    ----------
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4) with stimulus, correct response, block and set size.
+    data : np.ndarray
+        A 2D array of shape (num_steps, 2) with the observed responses and rewards.
+    eta : array_like
+        The scales of the random walk, e.g. the posterior mean of the global samples.
+    kappa : array_like
+        The memory decay phi and capacity c.
+    num_particles : int, optional
+        The number of particles (default is 2000).
+    ess_threshold : float, optional
+        Relative effective sample size that triggers resampling (default is 0.5).
+    seed : int or None, optional
+        The seed of the filter.
+
+    Returns
+    -------
+    dict
+        The filtered and smoothed means and standard deviations of shape (num_steps, 2), the
+        effective sample sizes and the log evidence, see `particle_filter.run_filter`.
+    """
+    return run_filter(
+        draw_theta_0, transition, loglik_step, eta, np.asarray(context, dtype=np.float64),
+        np.asarray(data, dtype=np.float64), num_params=2, num_values=NUM_VALUES,
+        params=kappa, num_particles=num_particles, ess_threshold=ess_threshold, seed=seed
+    )
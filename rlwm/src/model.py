@@ -1,16 +1,28 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from numba import njit
+from numba import njit, prange
 
-from helpers import softmax, select_action
-from priors import sample_eta, sample_kappa, sample_random_walk
-from context import generate_context, random_num_steps
+from helpers import softmax, sample_categorical, delta_update, decay_toward, truncnorm_sample
+from priors import random_walk_into
+from context import STORE, MIN_STEPS, MAX_STEPS
 
-@njit
-def sample_rlwm(theta, kappa, context):
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from rng import seed_sequence, batch_streams
+from profiling import stage
+from autotune import apply as apply_tuning
+from predictive import group_bins, running_count, learning_curves
+
+@njit(cache=True)
+def simulate_rlwm(theta, kappa, context, sim_data):
+    """
+    Simulates the RLWM model into `sim_data`, an integer array of shape (num_steps, 2)
+    that receives the responses and rewards, without allocating it.
+    """
     phi, c = kappa
     tau = 10
     num_steps = context.shape[0]
-    sim_data = np.zeros((num_steps, 2))
     current_block = -1
     for t in range(num_steps):
         # reset subjective values
@@ -27,7 +39,7 @@ def sample_rlwm(theta, kappa, context):
         pi_rl = softmax(q_values[current_stim], tau)
         pi_wm = softmax(w_values[current_stim], tau)
         pi = w*pi_wm + (1 - w)*pi_rl
-        sim_data[t, 0] = select_action(np.arange(3), pi)
+        sim_data[t, 0] = sample_categorical(pi)
         current_resp = int(sim_data[t, 0])
 
         # feedback
@@ -37,34 +49,476 @@ def sample_rlwm(theta, kappa, context):
             sim_data[t, 1] = 0
 
         # update values
-        pe = sim_data[t, 1] - q_values[current_stim, current_resp]
-        q_values[current_stim, current_resp] += theta[t, 0] * pe
+        delta_update(q_values[current_stim], current_resp, sim_data[t, 1], theta[t, 0])
         # memory decay
-        w_values += phi * (1/3 - w_values)
+        decay_toward(w_values, 1/3, phi)
         # update values
         w_values[current_stim, current_resp] = sim_data[t, 1]
 
+@njit(cache=True)
+def sample_rlwm(theta, kappa, context):
+    # responses (0-2) and rewards (0/1) fit into int8
+    sim_data = np.zeros((context.shape[0], 2), dtype=np.int8)
+    simulate_rlwm(theta, kappa, context, sim_data)
     return sim_data
 
-def generative_model(batch_size=32):
-    sim_dict = {}
-    num_steps = random_num_steps()
-    sim_dict['non_batchable_context'] = num_steps
-    context = np.zeros((batch_size, num_steps, 4))
-    sim_data = np.zeros((batch_size, num_steps, 2))
-    eta = np.zeros((batch_size, 2))
-    kappa = np.zeros((batch_size, 2))
-    theta = np.zeros((batch_size, num_steps, 2))
-    for i in range(batch_size):
-        eta[i] = sample_eta()
-        kappa[i] = sample_kappa()
-        context[i] = generate_context(num_steps)
-        theta[i] = sample_random_walk(eta[i], context[i, :, 2])
-        sim_data[i] = sample_rlwm(theta[i], kappa[i], context[i])
-    sim_dict['global_parameters'] = eta.astype(np.float32)
-    sim_dict['shared_parameters'] = kappa.astype(np.float32)
-    sim_dict['local_parameters'] = theta.astype(np.float32)
-    sim_dict['batchable_context'] = context.astype(np.int32)
-    sim_dict['sim_data'] = sim_data.astype(np.int32)
-
-    return sim_dict
\ No newline at end of file
+# learning state of one agent: Q-values followed by working memory weights, each of
+# shape (max_set_size, num_actions) and stored flat
+NUM_VALUES = 2 * 6 * 3
+
+@njit(cache=True)
+def loglik_step(theta, kappa, values, context, data, t):
+    """
+    Computes the log-probability of the observed response at trial t under the RLWM model
+    and updates the learning state in place.
+
+    This is the update rule of `sample_rlwm` applied to observed responses and rewards.
+    The values are reset at the first trial of every block. Trials with a missing response
+    (negative response code) contribute a log-probability of zero and only let the working
+    memory decay.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 1D array of shape (2,) with alpha and p at trial t.
+    kappa : np.ndarray
+        A 1D array of shape (2,) with the memory decay phi and capacity c.
+    values : np.ndarray
+        A 1D array of shape (NUM_VALUES,) with the flat Q-values and working memory weights.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4) with stimulus, correct response, block and set size.
+    data : np.ndarray
+        A 2D array of shape (num_steps, 2) with the observed responses and rewards.
+    t : int
+        The current trial.
+
+    Returns
+    -------
+    float
+        The log-probability of the observed response.
+    """
+    phi, c = kappa[0], kappa[1]
+    tau = 10
+    num_wm = values.shape[0] // 2
+    # reset subjective values
+    if t == 0 or context[t, 2] != context[t - 1, 2]:
+        values[:] = 1/3
+    set_size = int(context[t, 3])
+    current_resp = int(data[t, 0])
+    current_stim = int(context[t, 0]) * 3
+    log_p = 0.0
+    if current_resp >= 0:
+        w = theta[1] * min(1, c/set_size)
+        # choice probability
+        pi_rl = softmax(values[current_stim:current_stim + 3], tau)
+        pi_wm = softmax(values[num_wm + current_stim:num_wm + current_stim + 3], tau)
+        log_p = np.log(w*pi_wm[current_resp] + (1 - w)*pi_rl[current_resp])
+        # update values
+        delta_update(values, current_stim + current_resp, data[t, 1], theta[0])
+    # memory decay
+    decay_toward(values[num_wm:], 1/3, phi)
+    # update values
+    if current_resp >= 0:
+        values[num_wm + current_stim + current_resp] = data[t, 1]
+    return log_p
+
+@njit(cache=True)
+def loglik_rlwm(theta, kappa, context, data):
+    """
+    Computes the per-trial log-probabilities of observed responses under the RLWM model.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 2D array of shape (num_steps, 2) with the trajectories of alpha and p.
+    kappa : np.ndarray
+        A 1D array of shape (2,) with the memory decay phi and capacity c.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4) with stimulus, correct response, block and set size.
+    data : np.ndarray
+        A 2D array of shape (num_steps, 2) with the observed responses and rewards.
+
+    Returns
+    -------
+    np.ndarray
+        A 1D array of shape (num_steps,) with the log-probability of every observed response.
+        Missing responses contribute zero (see `loglik_step`).
+    """
+    num_steps = context.shape[0]
+    log_p = np.zeros(num_steps)
+    values = np.zeros(NUM_VALUES)
+    for t in range(num_steps):
+        log_p[t] = loglik_step(theta[t], kappa, values, context, data, t)
+    return log_p
+
+@njit(parallel=True, cache=True)
+def loglik_rlwm_batch(theta, kappa, context, data):
+    """
+    Computes `loglik_rlwm` for a batch of parameter draws on the same observed data.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (num_draws, num_steps, 2) with theta trajectories.
+    kappa : np.ndarray
+        A 2D array of shape (num_draws, 2) with the matching shared parameters.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4), shared by all draws.
+    data : np.ndarray
+        A 2D array of shape (num_steps, 2) with the observed responses and rewards.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D array of shape (num_draws, num_steps) with per-trial log-probabilities.
+    """
+    num_draws = theta.shape[0]
+    log_p = np.zeros((num_draws, context.shape[0]))
+    for i in prange(num_draws):
+        log_p[i] = loglik_rlwm(theta[i], kappa[i], context, data)
+    return log_p
+
+@njit(parallel=True, cache=True)
+def predictive_batch(theta, kappa, context, bins, num_bins, seeds):
+    """
+    Simulates the RLWM model for a batch of posterior draws on the same context and sums
+    the rewarded (correct) responses of every draw per bin of a learning curve.
+
+    Each draw keeps only its own trajectory while it is reduced, so the memory does not
+    grow with the number of trials. Every draw `i` reseeds numba's random state with
+    `seeds[i]`, so the result is reproducible regardless of the number of threads.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (num_draws, num_steps, 2) with theta trajectories.
+    kappa : np.ndarray
+        A 2D array of shape (num_draws, 2) with the matching shared parameters.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4), shared by all draws.
+    bins : np.ndarray
+        A 1D integer array of shape (num_steps,) with the bin of every trial.
+    num_bins : int
+        The number of bins.
+    seeds : np.ndarray
+        A 1D array of shape (num_draws,) with one integer seed per draw.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D array of shape (num_draws, num_bins) with the number of correct responses.
+    """
+    num_draws = theta.shape[0]
+    num_steps = context.shape[0]
+    sums = np.zeros((num_draws, num_bins))
+    for i in prange(num_draws):
+        np.random.seed(seeds[i])
+        sim_data = np.zeros((num_steps, 2), dtype=np.int8)
+        simulate_rlwm(theta[i], kappa[i], context, sim_data)
+        for t in range(num_steps):
+            sums[i, bins[t]] += sim_data[t, 1]
+    return sums
+
+# keys of the learning curves of `posterior_predictive`, computed from a (num_steps, 4) context
+GROUPINGS = {
+    "set_size": lambda context: context[:, 3],
+    "block": lambda context: context[:, 2],
+    # presentations of the stimulus so far in its block, counting from 1 as in the data
+    "iteration": lambda context: running_count(context[:, 0], context[:, 2]) + 1,
+    "trial": lambda context: np.arange(context.shape[0]),
+}
+
+def posterior_predictive(theta, kappa, context, data=None, by=("set_size", "iteration"), seed=None):
+    """
+    Simulates the posterior draws of one subject and reduces them to learning curves of
+    the accuracy, e.g. by set size and stimulus iteration.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (num_draws, num_steps, 2) with posterior draws of alpha and p,
+        e.g. from `predictive.subject_draws`.
+    kappa : np.ndarray
+        A 2D array of shape (num_draws, 2) with the matching draws of phi and c.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4) with the empirical context of the subject.
+    data : np.ndarray or None, optional
+        A 2D array of shape (num_steps, 2) with the observed responses and rewards. If
+        given, the observed learning curve is added; trials with a missing (negative)
+        response are left out of it.
+    by : tuple of str, optional
+        The keys of GROUPINGS that define the bins (default is set size and iteration).
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the simulations.
+
+    Returns
+    -------
+    dict
+        The learning curves, see `predictive.learning_curves`.
+    """
+    context = np.asarray(context)
+    bins, labels = group_bins([GROUPINGS[name](context) for name in by])
+    _, seeds = batch_streams(seed, theta.shape[0])
+    sums = predictive_batch(theta, np.asarray(kappa, dtype=np.float64), context, bins, len(labels), seeds)
+    observed = None
+    if data is not None:
+        observed = np.where(data[:, 0] >= 0, data[:, 1], np.nan)
+    return learning_curves(sums, bins, labels, by, observed)
+
+@njit(cache=True)
+def sample_trial_idx(num_steps, max_steps=MAX_STEPS):
+    """
+    Draws the (ordered) indices of the trials that are kept when a full session of
+    `max_steps` trials is shortened to `num_steps` trials.
+    """
+    idx = np.arange(max_steps)
+    # partial Fisher-Yates shuffle: the first `num_steps` entries are a random subset
+    for t in range(num_steps):
+        j = np.random.randint(t, max_steps)
+        idx[t], idx[j] = idx[j], idx[t]
+    return np.sort(idx[:num_steps])
+
+@njit(parallel=True, cache=True)
+def simulate_batch(seeds, values, offsets, lengths, num_steps):
+    """
+    Simulates a whole batch of the non-stationary RLWM model in a single parallel kernel.
+
+    Every batch row draws its hyper parameters (eta), shared parameters (kappa), a
+    random subject context, the random walk over theta and the choices of the RLWM model.
+    Rows may differ in their number of trials; each row only simulates its own trials
+    and the outputs are zero-padded to the longest row. The contexts are read from the
+    flat, subject-sorted context array of the store, so subjects may differ in their
+    number of trials as well. A row never asks for more trials than its subject has.
+
+    Seeding scheme: numba keeps one random state per thread, so the state is reseeded
+    with `seeds[i]` at the start of every batch row `i`. Each row therefore consumes its
+    own stream, independent of which thread runs it, and a batch is reproducible for a
+    given array of seeds regardless of the number of threads.
+
+    Parameters
+    ----------
+    seeds : np.ndarray
+        A 1D array of shape (batch_size,) with one integer seed per batch row.
+    values : np.ndarray
+        A 2D array of shape (num_rows, 4) with the contexts of all subjects, sorted by
+        subject (`ContextStore.values`).
+    offsets, lengths : np.ndarray
+        1D arrays with the first row and the number of trials of every subject.
+    num_steps : np.ndarray
+        A 1D integer array of shape (batch_size,) with the number of trials of every row.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        The float32 arrays eta (batch_size, 2), kappa (batch_size, 2) and theta
+        (batch_size, T, 2), the context (batch_size, T, 4) in the dtype of `values` and
+        the int8 sim_data (batch_size, T, 2), with T the largest number of trials, and the
+        number of simulated trials of every row. All outputs are written in their final
+        dtype; the priors are drawn in float64 and only rounded when stored.
+    """
+    batch_size = seeds.shape[0]
+    num_sub = offsets.shape[0]
+    num_features = values.shape[1]
+    max_steps = num_steps.max()
+    eta = np.zeros((batch_size, 2), dtype=np.float32)
+    kappa = np.zeros((batch_size, 2), dtype=np.float32)
+    theta = np.zeros((batch_size, max_steps, 2), dtype=np.float32)
+    context = np.zeros((batch_size, max_steps, num_features), dtype=values.dtype)
+    sim_data = np.zeros((batch_size, max_steps, 2), dtype=np.int8)
+    row_steps = np.zeros(batch_size, dtype=np.int64)
+    for i in prange(batch_size):
+        np.random.seed(seeds[i])
+        # hyper and shared priors
+        eta_i = np.empty(2)
+        kappa_i = np.empty(2)
+        eta_i[0] = np.abs(np.random.normal(0, 0.02))
+        eta_i[1] = np.abs(np.random.normal(0, 0.02))
+        kappa_i[0] = np.random.uniform(0, 1)
+        kappa_i[1] = truncnorm_sample(7, 1, 0, 6)
+        eta[i] = eta_i
+        kappa[i] = kappa_i
+        # context of a random subject with a random subset of its trials
+        sub = np.random.randint(0, num_sub)
+        n = min(num_steps[i], lengths[sub])
+        idx = sample_trial_idx(n, lengths[sub])
+        for t in range(n):
+            context[i, t] = values[offsets[sub] + idx[t]]
+        # local parameters and choices
+        random_walk_into(theta[i, :n], eta_i, context[i, :n, 2])
+        simulate_rlwm(theta[i, :n], kappa_i, context[i, :n], sim_data[i, :n])
+        row_steps[i] = n
+    return eta, kappa, theta, context, sim_data, row_steps
+
+def generative_model(batch_size=32, seed=None):
+    """
+    Simulates a batch of data sets from the non-stationary RLWM model.
+
+    All batch rows share the same random number of trials between MIN_STEPS and MAX_STEPS.
+    The simulation itself runs in `simulate_batch`, with one seed per batch row derived
+    from `seed` by `rng.batch_streams`. Since that kernel draws the priors, the contexts
+    and the choices together, it is profiled as a single "simulator" stage.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        The number of data sets to simulate (default is 32). The numba threads of the
+        calling thread are set to the tuned value of this model on the first call (see
+        `autotune.apply`).
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the batch, e.g. `rng.batch_sequence(experiment_seed, index)`. If None,
+        fresh entropy is drawn from the OS.
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys 'non_batchable_context', 'global_parameters',
+        'shared_parameters', 'local_parameters', 'batchable_context' and 'sim_data'.
+    """
+    apply_tuning("rlwm")
+    rng, seeds = batch_streams(seed, batch_size)
+    num_steps = rng.integers(low=MIN_STEPS, high=MAX_STEPS + 1)
+    with stage("simulator") as s:
+        eta, kappa, theta, context, sim_data, _ = s.record(simulate_batch(
+            seeds, STORE.values, STORE.offsets, STORE.lengths, np.full(batch_size, num_steps)
+        ))
+    with stage("outputs") as s:
+        sim_dict = {}
+        sim_dict['non_batchable_context'] = num_steps
+        sim_dict['global_parameters'] = eta
+        sim_dict['shared_parameters'] = kappa
+        sim_dict['local_parameters'] = theta
+        sim_dict['batchable_context'] = context
+        sim_dict['sim_data'] = sim_data
+        s.record(sim_dict)
+
+    return sim_dict
+
+class BucketedGenerativeModel:
+    """
+    Generative model that simulates data sets of different lengths concurrently and emits
+    batches of data sets with similar lengths.
+
+    `generative_model` gives all rows of a batch the same number of trials. Here, every
+    refill simulates a pool of `pool_size` rows in one `simulate_batch` call, each row with
+    its own random number of trials between MIN_STEPS and MAX_STEPS, so all cores stay busy
+    and each row only simulates its own trials. The rows are sorted into buckets of
+    `bucket_width` consecutive lengths, and every call returns `batch_size` rows of one
+    bucket, zero-padded to the longest of them. The padding per row is thus below
+    `bucket_width` trials, and with `bucket_width=1` batches are not padded at all.
+
+    Unseeded calls are stateful: they draw from the generator and the buckets of the
+    object. A copy that is unpickled in another process (e.g. a `Prefetcher` worker)
+    starts with empty buckets and fresh entropy, so workers do not return the same
+    batches. Calls with a `seed` are stateless, so the model can be used with seeded
+    `Prefetcher`, `simulate_to_disk` and `SimulationClient` pipelines.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        The default number of data sets per batch (default is 32).
+    bucket_width : int, optional
+        The number of distinct lengths per bucket (default is 20).
+    pool_size : int or None, optional
+        The number of rows simulated per refill. Defaults to `batch_size` times the
+        number of buckets, so that on average every bucket receives one batch.
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the unseeded calls in this process. If None, fresh entropy is drawn
+        from the OS.
+    """
+
+    def __init__(self, batch_size=32, bucket_width=20, pool_size=None, seed=None):
+        self.batch_size = batch_size
+        self.bucket_width = bucket_width
+        self.num_buckets = (MAX_STEPS - MIN_STEPS) // bucket_width + 1
+        self.pool_size = batch_size * self.num_buckets if pool_size is None else pool_size
+        self._reset(seed_sequence(seed))
+
+    def _reset(self, seed_seq):
+        self.seed_seq = seed_seq
+        self.rng = np.random.default_rng(self.seed_seq.spawn(1)[0])
+        self.buckets = [[] for _ in range(self.num_buckets)]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["seed_seq"], state["rng"], state["buckets"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # every copy draws its own unseeded batches
+        self._reset(np.random.SeedSequence())
+
+    def _simulate(self, num_steps, seeds):
+        """Simulates one row per entry of `num_steps` and returns the rows as tuples."""
+        apply_tuning("rlwm")
+        with stage("simulator") as s:
+            eta, kappa, theta, context, sim_data, row_steps = s.record(simulate_batch(
+                seeds, STORE.values, STORE.offsets, STORE.lengths, num_steps
+            ))
+        return [
+            (n, eta[i], kappa[i], theta[i, :n], context[i, :n], sim_data[i, :n])
+            for i, n in enumerate(row_steps)
+        ]
+
+    def refill(self):
+        """Simulates a new pool of rows and sorts them into the buckets."""
+        num_steps = self.rng.integers(MIN_STEPS, MAX_STEPS + 1, size=self.pool_size)
+        seeds = self.seed_seq.spawn(1)[0].generate_state(self.pool_size)
+        for row in self._simulate(num_steps, seeds):
+            self.buckets[(row[0] - MIN_STEPS) // self.bucket_width].append(row)
+
+    def __call__(self, batch_size=None, seed=None):
+        """
+        Returns a padded batch of data sets from the fullest bucket.
+
+        Parameters
+        ----------
+        batch_size : int or None, optional
+            The number of data sets. None means the `batch_size` of the model.
+        seed : int, np.random.SeedSequence or None, optional
+            The seed of the batch, e.g. `rng.batch_sequence(experiment_seed, index)`. A
+            seeded batch does not touch the buckets: it draws a bucket with probability
+            proportional to its number of lengths and simulates `batch_size` rows with
+            lengths drawn uniformly within it, which matches the distribution of the
+            unseeded batches.
+
+        Returns
+        -------
+        dict
+            The keys of `generative_model`, with 'non_batchable_context' holding the number
+            of trials of every row as an array of shape (batch_size,), and 'mask', a boolean
+            array of shape (batch_size, num_steps) that is False on the padded trials.
+        """
+        batch_size = self.batch_size if batch_size is None else batch_size
+        if seed is not None:
+            rng, seeds = batch_streams(seed, batch_size)
+            bucket = rng.integers(MIN_STEPS, MAX_STEPS + 1) - MIN_STEPS
+            low = MIN_STEPS + bucket // self.bucket_width * self.bucket_width
+            high = min(low + self.bucket_width - 1, MAX_STEPS)
+            rows = self._simulate(rng.integers(low, high + 1, size=batch_size), seeds)
+        else:
+            while max(len(bucket) for bucket in self.buckets) < batch_size:
+                self.refill()
+            bucket = max(self.buckets, key=len)
+            rows = [bucket.pop() for _ in range(batch_size)]
+        row_steps = np.array([row[0] for row in rows])
+        max_steps = row_steps.max()
+        mask = np.arange(max_steps)[None, :] < row_steps[:, None]
+
+        def pad(j):
+            out = np.zeros((batch_size, max_steps, rows[0][j].shape[-1]), dtype=rows[0][j].dtype)
+            out[mask] = np.concatenate([row[j] for row in rows])
+            return out
+
+        with stage("outputs") as s:
+            sim_dict = {}
+            sim_dict['non_batchable_context'] = row_steps
+            sim_dict['global_parameters'] = np.stack([row[1] for row in rows])
+            sim_dict['shared_parameters'] = np.stack([row[2] for row in rows])
+            sim_dict['local_parameters'] = pad(3)
+            sim_dict['batchable_context'] = pad(4)
+            sim_dict['sim_data'] = pad(5)
+            sim_dict['mask'] = mask
+            s.record(sim_dict)
+
+        return sim_dict
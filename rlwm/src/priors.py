@@ -1,37 +1,90 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from scipy.stats import halfnorm
 from helpers import truncnorm_better
 from numba import njit
 
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+import transitions
+from transitions import TransitionSampler, draw_initial, initial_prior, transition_flags
+
 RNG = np.random.default_rng()
+LOWER_BOUNDS = np.array([0., 0.])
+UPPER_BOUNDS = np.array([1., 1.])
+# the transition of the model in the registry of `common/transitions.py`: a random walk
+# within a block and a fresh draw from the initial prior at the start of a new block
+TRANSITION = "random_walk+block_reset"
+FLAGS = transition_flags(TRANSITION)
+INITIAL_PRIOR = initial_prior(("beta", 1.5, 2), ("beta", 1.5, 1.5))
 
-@njit
+@njit(cache=True)
+def draw_theta_0(theta):
+    for k in range(theta.shape[0]):
+        theta[k] = draw_initial(INITIAL_PRIOR, k)
+
+@njit(cache=True)
 def sample_theta_0():
-    alpha = np.random.beta(a=1.5, b=2)
-    p = np.random.beta(a=1.5, b=1.5)
-    return np.array([alpha, p]).astype(np.float32)
+    theta = np.zeros(2)
+    draw_theta_0(theta)
+    return theta.astype(np.float32)
+
+def sample_eta(rng=None):
+    from scipy.stats import halfnorm
 
-def sample_eta():
-    return halfnorm.rvs(loc=0, scale=0.02, size=2)
+    return halfnorm.rvs(loc=0, scale=0.02, size=2, random_state=RNG if rng is None else rng)
 
-def sample_kappa():
-    phi = RNG.uniform(low=0, high=1)
-    c = truncnorm_better(loc=7, scale=1, low=0, high=6)
+def sample_kappa(rng=None):
+    rng = RNG if rng is None else rng
+    phi = rng.uniform(low=0, high=1)
+    c = truncnorm_better(loc=7, scale=1, low=0, high=6, rng=rng)
     return np.concatenate([[phi], c])
 
-@njit
-def sample_random_walk(eta, context, lower_bounds=0, upper_bounds=1):
-    num_steps = context.shape[0]
-    theta_t = np.zeros((num_steps, 2))
-    theta_t[0] = sample_theta_0()
-    z = np.random.randn(num_steps - 1, 2)
-    for t in range(1, num_steps):
-        if context[t] == context[t -1]:
-            theta_t[t] = np.maximum(
-                np.minimum(theta_t[t - 1] + eta * z[t - 1], upper_bounds),
-                lower_bounds
-            )
-        else:
-            theta_t[t, 0] = np.random.beta(a=1.5, b=2)
-            theta_t[t, 1] = np.random.beta(a=1.5, b=1.5)
-    return theta_t.astype(np.float32)
\ No newline at end of file
+@njit(cache=True)
+def transition_step(theta_prev, theta, eta, reset, lower_bounds=None, upper_bounds=None):
+    """
+    Draws theta_t given theta_{t-1} into `theta` under TRANSITION with
+    `transitions.transition_step`: a clipped Gaussian random walk within a block and a
+    fresh draw from the initial prior at the start of a new block (`reset`). The bounds
+    default to LOWER_BOUNDS and UPPER_BOUNDS; they are resolved here rather than as array
+    defaults, which numba would materialize on every call.
+    """
+    if lower_bounds is None:
+        lower_bounds = LOWER_BOUNDS
+    if upper_bounds is None:
+        upper_bounds = UPPER_BOUNDS
+    transitions.transition_step(theta_prev, theta, eta, reset, FLAGS, INITIAL_PRIOR, lower_bounds, upper_bounds)
+
+@njit(cache=True)
+def random_walk_into(theta_t, eta, context, lower_bounds=None, upper_bounds=None):
+    """
+    Writes the random walk of `sample_random_walk` into the rows of `theta_t`, e.g. a
+    float32 slice of a batch array. The walk itself runs in float64 on two swapped
+    buffers, so storing it as float32 does not change its trajectory.
+    """
+    prev = np.empty(2)
+    cur = np.empty(2)
+    draw_theta_0(prev)
+    for k in range(2):
+        theta_t[0, k] = prev[k]
+    for t in range(1, context.shape[0]):
+        transition_step(prev, cur, eta, context[t] != context[t - 1], lower_bounds, upper_bounds)
+        for k in range(2):
+            theta_t[t, k] = cur[k]
+        prev, cur = cur, prev
+
+@njit(cache=True)
+def sample_random_walk(eta, context, lower_bounds=None, upper_bounds=None):
+    theta_t = np.empty((context.shape[0], 2), dtype=np.float32)
+    random_walk_into(theta_t, eta, context, lower_bounds, upper_bounds)
+    return theta_t
+
+def transition_sampler(name=TRANSITION):
+    """
+    Returns the batched sampler of theta trajectories under the transition `name` of the
+    registry in `common/transitions.py`, with the initial prior and bounds of this model.
+
+    The default TRANSITION draws the same trajectories as `random_walk_into`, given the
+    same seed and `resets=transitions.block_resets(num_steps, blocks=context[:, 2])`.
+    """
+    return TransitionSampler(name, INITIAL_PRIOR, LOWER_BOUNDS, UPPER_BOUNDS)
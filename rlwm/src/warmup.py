@@ -0,0 +1,24 @@
+import numpy as np
+
+from context import MIN_STEPS, MAX_STEPS
+from model import simulate_batch, loglik_rlwm_batch
+
+
+def warmup():
+    """
+    Compiles the jitted simulation and likelihood kernels, or loads them from numba's
+    on-disk cache, by running them once on a small synthetic input.
+
+    The inputs have the same types as in `generative_model` and `loglik_rlwm_batch` on
+    empirical data, so the first real batch does not trigger another compilation. No
+    empirical data is read.
+    """
+    values = np.zeros((MAX_STEPS, 4), dtype=np.int8)
+    values[:, 3] = 1
+    offsets = np.zeros(1, dtype=np.int64)
+    lengths = np.full(1, MAX_STEPS, dtype=np.int64)
+    seeds = np.random.SeedSequence(0).generate_state(2)
+    num_steps = np.full(2, MIN_STEPS, dtype=np.int64)
+    eta, kappa, theta, context, sim_data, _ = simulate_batch(seeds, values, offsets, lengths, num_steps)
+    # observed data are float64
+    loglik_rlwm_batch(theta, kappa, context[0], sim_data[0].astype(np.float64))
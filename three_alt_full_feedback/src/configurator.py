@@ -1,24 +1,67 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from scipy.stats import halfnorm, uniform
-from keras.utils import to_categorical
+
+from context import FEEDBACK_SCALE
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from encoding import output_buffer, one_hot_into
+from empirical import empirical_conditions
+from profiling import instrument
 
 GLOBAL_PRIOR_MEAN = np.array([0.02, 0.02, 0.8])
 GLOBAL_PRIOR_STD = np.array([0.01, 0.01, 0.6])
 LOCAL_PRIOR_MEAN = np.array([0.4, 0.4, 5.7])
 LOCAL_PRIOR_STD = np.array([0.25, 0.25, 7.6])
 
-def configure_input(raw_dict):
-    data = raw_dict.get("sim_data")[:, :, None]
-    feedback = np.array(raw_dict.get("sim_batchable_context"))[:, :, :3]
+NUM_ACTIONS = 3
+# bump whenever the encoding of the conditions changes, to invalidate the cached
+# empirical conditions (see `load_empirical_conditions`)
+CONFIGURATOR_VERSION = 1
+DATA_PATH = "../data/empiric_data.csv"
+# condition codes of the context, matching the rows of `model.ALTERNATIVES`
+CONDITIONS = {"ABC": 0, "ACE": 1, "DEF": 2, "BDF": 3}
+
+def configure_conditions(raw_dict, out=None):
+    data = raw_dict.get("sim_data")
+    feedback = np.asarray(raw_dict.get("sim_batchable_context"))[:, :, :3]
     # condition = np.array(raw_dict.get("sim_batchable_context"))[:, :, 2][:, :, None]
-    summary_conditions = np.c_[
-        to_categorical(data), feedback,
-    ]
+    # one-hot responses followed by the feedback of all three options, written into one
+    # float32 buffer that can be passed in again as `out`
+    summary_conditions = output_buffer(out, (*data.shape[:2], NUM_ACTIONS + 3))
+    one_hot_into(summary_conditions[:, :, :NUM_ACTIONS], data)
+    summary_conditions[:, :, NUM_ACTIONS:] = feedback
+    return dict(summary_conditions=summary_conditions)
+
+@instrument("configurator")
+def configure_input(raw_dict, out=None):
+    summary_conditions = configure_conditions(raw_dict, out)["summary_conditions"]
     theta_t = raw_dict.get("local_prior_draws")
     eta = raw_dict.get("hyper_prior_draws")
     out_dict = dict(
         local_parameters=((theta_t - LOCAL_PRIOR_MEAN) / LOCAL_PRIOR_STD).astype(np.float32),
         hyper_parameters=((eta - GLOBAL_PRIOR_MEAN) / GLOBAL_PRIOR_STD).astype(np.float32),
-        summary_conditions=summary_conditions.astype(np.float32),
+        summary_conditions=summary_conditions,
+    )
+    return out_dict
+
+def empirical_forward_dict(rows):
+    # the csv codes choices from 1 and stores the raw feedback of the three options
+    feedback = np.stack(
+        [rows["low_opt_feed"], rows["mid_opt_feed"], rows["high_opt_feed"]], axis=-1
+    ) / FEEDBACK_SCALE
+    condition = np.array([CONDITIONS[c] for c in rows["condition"]])
+    return {
+        "sim_data": (rows["choice"] - 1)[None],
+        "sim_batchable_context": np.c_[feedback, condition][None],
+    }
+
+def load_empirical_conditions(csv_path=DATA_PATH):
+    """
+    Returns the 'summary_conditions' of all participants in `csv_path`, as `configure_input`
+    would produce them, together with their 'lengths' and 'subjects'.
+    """
+    return empirical_conditions(
+        csv_path, empirical_forward_dict, configure_conditions, CONFIGURATOR_VERSION, id_column="participant"
     )
-    return out_dict
\ No newline at end of file
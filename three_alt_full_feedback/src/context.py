@@ -3,28 +3,61 @@ import numpy as np
 RNG = np.random.default_rng()
 NUM_STEPS = 200
 STEPS_PER_CONDITION = 50
+# mean feedback of the three alternatives of every condition, indexed by condition code
+CONDITION_MEANS = np.array([[30, 34, 38], [30, 38, 46], [42, 46, 50], [34, 42, 50]])
+FEEDBACK_STD = 5
+# the truncated feedback is divided by this value
+FEEDBACK_SCALE = 30
 
-def generate_context():
-    condition_a = RNG.normal(
-        loc=(30, 34, 38), scale=5, size=(STEPS_PER_CONDITION, 3)
-    )
-    condition_a = np.c_[condition_a, np.repeat(0, STEPS_PER_CONDITION)[:, None]]
-    condition_b = RNG.normal(
-        loc=(30, 38, 46), scale=5, size=(STEPS_PER_CONDITION, 3)
-    )
-    condition_b = np.c_[condition_b, np.repeat(1, STEPS_PER_CONDITION)[:, None]]
-    condition_c = RNG.normal(
-        loc=(42, 46, 50), scale=5, size=(STEPS_PER_CONDITION, 3)
-    )
-    condition_c = np.c_[condition_c, np.repeat(2, STEPS_PER_CONDITION)[:, None]]
-    condition_d = RNG.normal(
-        loc=(34, 42, 50), scale=5, size=(STEPS_PER_CONDITION, 3)
-    )
-    condition_d = np.c_[condition_d, np.repeat(3, STEPS_PER_CONDITION)[:, None]]
-    context = np.concatenate(
-        [condition_a, condition_b, condition_c, condition_d]
-    )
-    idx = RNG.choice(
-        np.arange(NUM_STEPS), NUM_STEPS, replace=False
-    )
-    return context[idx].astype(np.int32) / 30
\ No newline at end of file
+def generate_contexts(batch_size, means=CONDITION_MEANS, steps_per_condition=STEPS_PER_CONDITION,
+                      std=FEEDBACK_STD, rng=None):
+    """
+    Generates the contexts of a batch of simulated experiments in one vectorized pass.
+
+    Every row holds `steps_per_condition` trials of each condition in its own random
+    order. The feedback of the three alternatives is drawn around the means of the trial's
+    condition, truncated to whole points and scaled by FEEDBACK_SCALE into float32.
+
+    Parameters
+    ----------
+    batch_size : int
+        The number of contexts.
+    means : array_like, optional
+        An array of shape (num_conditions, 3) with the mean feedback of the three
+        alternatives of every condition (default is the design of the experiment). Row `c`
+        belongs to condition code `c`, which is stored in column 3. By default the simulator
+        reads its condition from column 2, as in the original implementation, so the design
+        only changes the feedback distributions. With `condition_column=CONDITION_COLUMN`,
+        the code also selects the compared alternatives (see `model.simulate_softmax_rl`).
+    steps_per_condition : int or array_like, optional
+        The number of trials per condition, either one value or one per condition
+        (default is 50).
+    std : float, optional
+        The standard deviation of the feedback (default is 5).
+    rng : np.random.Generator, optional
+        The random number generator of the draws. If None, the module-level RNG is used.
+
+    Returns
+    -------
+    np.ndarray
+        A float32 array of shape (batch_size, num_steps, 4) with the feedback of the three
+        alternatives and the condition code of every trial.
+    """
+    rng = RNG if rng is None else rng
+    means = np.asarray(means, dtype=np.float64)
+    steps = np.broadcast_to(steps_per_condition, (means.shape[0],))
+    design = np.repeat(np.arange(means.shape[0]), steps)
+    # shuffling the condition labels is enough, the feedback noise is exchangeable
+    condition = rng.permuted(np.broadcast_to(design, (batch_size, design.size)), axis=1)
+    feedback = rng.normal(scale=std, size=(batch_size, design.size, 3))
+    feedback += means[condition]
+    np.trunc(feedback, out=feedback)
+    context = np.empty((batch_size, design.size, 4), dtype=np.float32)
+    # divided in float64 and rounded once when stored
+    np.divide(feedback, FEEDBACK_SCALE, out=context[:, :, :3], casting="unsafe")
+    context[:, :, 3] = condition
+    return context
+
+def generate_context(rng=None):
+    """Generates the context of a single experiment, see `generate_contexts`."""
+    return generate_contexts(1, rng=rng)[0]
@@ -0,0 +1,56 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+from numba import njit
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from particle_filter import run_filter
+from priors import draw_theta_0, transition_step
+from model import (
+    loglik_step, make_loglik_step, condition_table, NUM_VALUES, ALTERNATIVES, LEGACY_CONDITION_COLUMN
+)
+
+@njit(cache=True)
+def transition(theta_prev, theta, eta, context, t):
+    transition_step(theta_prev, theta, eta)
+
+def filter_subject(context, data, eta, num_particles=2000, ess_threshold=0.5, seed=None,
+                   alternatives=ALTERNATIVES, condition_column=LEGACY_CONDITION_COLUMN):
+    """
+    Estimates the filtered and smoothed trajectories of theta_t = (alpha_1, alpha_2, tau) of
+    one subject with a bootstrap particle filter, as a training-free reference for the amortizer.
+
+    Parameters
+    ----------
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4) in the layout of `generate_context`.
+    data : np.ndarray
+        A 1D array of shape (num_steps,) with the observed responses (0, 1 or 2).
+    eta : array_like
+        The scales of the random walk.
+    num_particles : int, optional
+        The number of particles (default is 2000).
+    ess_threshold : float, optional
+        Relative effective sample size that triggers resampling (default is 0.5).
+    seed : int or None, optional
+        The seed of the filter.
+    alternatives, condition_column : optional
+        The condition lookup of the simulator, see `model.simulate_softmax_rl`.
+
+    Returns
+    -------
+    dict
+        The filtered and smoothed means and standard deviations of shape (num_steps, 3), the
+        effective sample sizes and the log evidence, see `particle_filter.run_filter`.
+    """
+    context = np.asarray(context, dtype=np.float64)
+    alternatives = condition_table(alternatives, condition_column, context=context)
+    step = loglik_step
+    if alternatives is not None or condition_column != LEGACY_CONDITION_COLUMN:
+        step = make_loglik_step(alternatives, condition_column)
+    return run_filter(
+        draw_theta_0, transition, step, eta, context,
+        np.asarray(data, dtype=np.float64), num_params=3, num_values=NUM_VALUES,
+        num_particles=num_particles, ess_threshold=ess_threshold, seed=seed
+    )
@@ -1,28 +1,455 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from numba import njit
-from helpers import softmax, select_action
+from numba import njit, prange
+from helpers import sample_softmax_at, log_softmax_at, delta_update
+from priors import sample_eta, sample_random_walk_batch
+from context import generate_contexts, CONDITION_MEANS, STEPS_PER_CONDITION
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from rng import batch_streams
+from profiling import stage
+from autotune import apply as apply_tuning
+from predictive import group_bins, running_count, learning_curves
+
+# number of alternatives whose values the model tracks
+NUM_VALUES = 6
+# alternatives shown in each of the four conditions, indexed by condition
+ALTERNATIVES = np.array([[0, 1, 2], [0, 2, 4], [3, 4, 5], [1, 3, 5]], dtype=np.int64)
+
+@njit(cache=True)
+def condition_index(c):
+    """
+    Maps a condition code to its row of ALTERNATIVES; codes other than 0, 1 and 2 map to 3.
+    """
+    if c == 0:
+        return 0
+    elif c == 1:
+        return 1
+    elif c == 2:
+        return 2
+    return 3
+
+# columns of the context the condition can be read from. The original implementation reads
+# column 2, the feedback of the third alternative, which maps almost every trial to the last
+# row of the table; column 3 holds the condition code of `generate_contexts`
+LEGACY_CONDITION_COLUMN = 2
+CONDITION_COLUMN = 3
+
+@njit(cache=True)
+def available_alternatives(alternatives, context, t, condition_column):
+    """
+    Returns the row of `alternatives` shown at trial t. With CONDITION_COLUMN, the condition
+    code is the row; otherwise the value of `condition_column` is mapped by `condition_index`.
+    If `alternatives` is None, ALTERNATIVES is used. The kernels default to None rather
+    than to the array, which numba would materialize on every call.
+    """
+    if alternatives is None:
+        alternatives = ALTERNATIVES
+    if condition_column == CONDITION_COLUMN:
+        return alternatives[int(context[t, CONDITION_COLUMN])]
+    return alternatives[condition_index(context[t, condition_column])]
+
+def condition_table(alternatives=ALTERNATIVES, condition_column=LEGACY_CONDITION_COLUMN, means=None, context=None):
+    """
+    Validates a table of alternatives for the simulation and likelihood kernels.
+
+    Parameters
+    ----------
+    alternatives : array_like, optional
+        An integer array of shape (num_conditions, 3) with the alternatives shown in
+        every condition (default is ALTERNATIVES).
+    condition_column : int, optional
+        LEGACY_CONDITION_COLUMN (default) or CONDITION_COLUMN, see `simulate_softmax_rl`.
+    means : array_like or None, optional
+        The feedback means of `generate_contexts`, one row per condition code.
+    context : np.ndarray or None, optional
+        A context whose condition codes are checked against the table.
+
+    Returns
+    -------
+    np.ndarray or None
+        The table as a contiguous int64 array, or None if it equals ALTERNATIVES, so the
+        kernels use their compiled-in table, which is faster than a table argument.
+    """
+    alternatives = np.ascontiguousarray(alternatives, dtype=np.int64)
+    if alternatives.ndim != 2 or alternatives.shape[1] != 3:
+        raise ValueError(f"alternatives must have shape (num_conditions, 3), got {alternatives.shape}.")
+    if alternatives.min() < 0 or alternatives.max() >= NUM_VALUES:
+        raise ValueError(f"alternatives must index the {NUM_VALUES} values of the model.")
+    num_conditions = alternatives.shape[0]
+    if condition_column == LEGACY_CONDITION_COLUMN:
+        if num_conditions != len(ALTERNATIVES):
+            raise ValueError(
+                f"Reading the condition from column {LEGACY_CONDITION_COLUMN} selects one of "
+                f"{len(ALTERNATIVES)} rows, got {num_conditions}; use condition_column=CONDITION_COLUMN."
+            )
+    elif condition_column != CONDITION_COLUMN:
+        raise ValueError(
+            f"condition_column must be {LEGACY_CONDITION_COLUMN} or {CONDITION_COLUMN}, got {condition_column}."
+        )
+    elif means is not None and np.shape(means)[0] != num_conditions:
+        raise ValueError(
+            f"means has {np.shape(means)[0]} conditions, but alternatives has {num_conditions} rows."
+        )
+    elif context is not None and np.max(np.asarray(context)[..., CONDITION_COLUMN]) >= num_conditions:
+        raise ValueError(f"The context has condition codes beyond the {num_conditions} rows of alternatives.")
+    return None if np.array_equal(alternatives, ALTERNATIVES) else alternatives
+
+@njit(cache=True)
+def simulate_softmax_rl(theta, context, resp, alternatives=None, condition_column=LEGACY_CONDITION_COLUMN):
+    """
+    Simulates the full-feedback softmax RL model into `resp` without allocating.
+
+    The values of the three available alternatives are read from the `alternatives` lookup
+    table and updated one by one, and the response is drawn with `sample_softmax_at`,
+    which inverts the cumulative softmax probabilities with a single uniform draw. By
+    default the condition is read from column 2 of the context, as in the original
+    implementation. With `condition_column=CONDITION_COLUMN`, the condition code of column
+    3 selects the row of `alternatives`, so designs with other conditions compare the
+    alternatives of their own condition.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 2D array of shape (num_steps, 3) with the trajectories of alpha_1, alpha_2 and tau.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4) as produced by `generate_context`.
+    resp : np.ndarray
+        A 1D array of shape (num_steps,) that receives the responses.
+    alternatives : np.ndarray or None, optional
+        An int64 array of shape (num_conditions, 3) with the alternatives of every
+        condition, see `condition_table`. None (default) uses ALTERNATIVES.
+    condition_column : int, optional
+        LEGACY_CONDITION_COLUMN (default) or CONDITION_COLUMN.
+    """
+    values = np.full(NUM_VALUES, 15 / 30)
+    for t in range(theta.shape[0]):
+        alt = available_alternatives(alternatives, context, t, condition_column)
+        r = sample_softmax_at(values, alt, theta[t, 2])
+        resp[t] = r
+        for k in range(3):
+            rate = theta[t, 0] if k == r else theta[t, 1]
+            delta_update(values, alt[k], context[t, k], rate)
+
+@njit(cache=True)
+def sample_softmax_rl(theta, context, alternatives=None, condition_column=LEGACY_CONDITION_COLUMN):
+    """
+    Simulates responses of the full-feedback softmax RL model.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 2D array of shape (num_steps, 3) with the trajectories of alpha_1, alpha_2 and tau.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4) as produced by `generate_context`.
+    alternatives, condition_column : optional
+        The condition lookup, see `simulate_softmax_rl`.
+
+    Returns
+    -------
+    np.ndarray
+        A 1D int8 array of shape (num_steps,) with the responses (0, 1 or 2).
+    """
+    resp = np.zeros(theta.shape[0], dtype=np.int8)
+    simulate_softmax_rl(theta, context, resp, alternatives, condition_column)
+    return resp
+
+@njit(parallel=True, cache=True)
+def sample_softmax_rl_batch(theta, context, seeds, alternatives=None,
+                            condition_column=LEGACY_CONDITION_COLUMN):
+    """
+    Simulates responses of the full-feedback softmax RL model for a batch of data sets.
+
+    Every batch row reseeds numba's random state with `seeds[i]`, so a batch is
+    reproducible regardless of the number of threads, and row `i` matches
+    `sample_softmax_rl(theta[i], context[i])` after `np.random.seed(seeds[i])`.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (batch_size, num_steps, 3) with theta trajectories.
+    context : np.ndarray
+        A 3D array of shape (batch_size, num_steps, 4) with the contexts.
+    seeds : np.ndarray
+        A 1D array of shape (batch_size,) with one integer seed per batch row.
+    alternatives, condition_column : optional
+        The condition lookup, see `simulate_softmax_rl`.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D int8 array of shape (batch_size, num_steps) with the responses.
+    """
+    resp = np.zeros((theta.shape[0], theta.shape[1]), dtype=np.int8)
+    for i in prange(theta.shape[0]):
+        np.random.seed(seeds[i])
+        simulate_softmax_rl(theta[i], context[i], resp[i], alternatives, condition_column)
+    return resp
+
+# index of the alternative with the highest mean feedback, the third of every condition;
+# the rows of a custom `alternatives` table follow the same order
+BEST_RESP = 2
+
+@njit(parallel=True, cache=True)
+def predictive_batch(theta, context, bins, num_bins, seeds, alternatives=None,
+                     condition_column=LEGACY_CONDITION_COLUMN):
+    """
+    Simulates the full-feedback softmax RL model for a batch of posterior draws on the
+    same context and sums the choices of the best alternative per bin of a learning
+    curve, without keeping the simulated responses.
+
+    Every draw `i` reseeds numba's random state with `seeds[i]`, so the result is
+    reproducible regardless of the number of threads.
 
-@njit
-def sample_softmax_rl(theta, context):
-    context = context[:, :3]
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (num_draws, num_steps, 3) with theta trajectories.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4), shared by all draws.
+    bins : np.ndarray
+        A 1D integer array of shape (num_steps,) with the bin of every trial.
+    num_bins : int
+        The number of bins.
+    seeds : np.ndarray
+        A 1D array of shape (num_draws,) with one integer seed per draw.
+    alternatives, condition_column : optional
+        The condition lookup, see `simulate_softmax_rl`.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D array of shape (num_draws, num_bins) with the number of best choices.
+    """
+    num_draws = theta.shape[0]
+    num_steps = context.shape[0]
+    sums = np.zeros((num_draws, num_bins))
+    for i in prange(num_draws):
+        np.random.seed(seeds[i])
+        resp = np.zeros(num_steps, dtype=np.int8)
+        simulate_softmax_rl(theta[i], context, resp, alternatives, condition_column)
+        for t in range(num_steps):
+            sums[i, bins[t]] += resp[t] == BEST_RESP
+    return sums
+
+# keys of the learning curves of `posterior_predictive`, computed from a (num_steps, 4) context
+GROUPINGS = {
+    "condition": lambda context: context[:, 3],
+    "trial_in_condition": lambda context: running_count(context[:, 3]),
+    "trial": lambda context: np.arange(context.shape[0]),
+}
+
+def posterior_predictive(theta, context, data=None, by=("condition", "trial_in_condition"), seed=None,
+                         alternatives=ALTERNATIVES, condition_column=LEGACY_CONDITION_COLUMN):
+    """
+    Simulates the posterior draws of one subject and reduces them to learning curves of
+    the accuracy, i.e. the share of choices of the alternative with the highest mean feedback.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (num_draws, num_steps, 3) with posterior draws of alpha_1,
+        alpha_2 and tau, e.g. from `predictive.subject_draws`.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4) with the empirical context of the subject.
+    data : np.ndarray or None, optional
+        A 1D array of length `num_steps` with the observed responses (0, 1 or 2). If
+        given, the observed learning curve is added.
+    by : tuple of str, optional
+        The keys of GROUPINGS that define the bins (default is condition and trial in condition).
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the simulations.
+    alternatives, condition_column : optional
+        The condition lookup, see `simulate_softmax_rl`.
+
+    Returns
+    -------
+    dict
+        The learning curves, see `predictive.learning_curves`.
+    """
+    context = np.asarray(context)
+    alternatives = condition_table(alternatives, condition_column, context=context)
+    bins, labels = group_bins([GROUPINGS[name](context) for name in by])
+    _, seeds = batch_streams(seed, theta.shape[0])
+    sums = predictive_batch(theta, context, bins, len(labels), seeds, alternatives, condition_column)
+    observed = None
+    if data is not None:
+        observed = np.asarray(data, dtype=np.float64) == BEST_RESP
+    return learning_curves(sums, bins, labels, by, observed)
+
+@njit(cache=True)
+def condition_loglik_step(theta, values, context, data, t, alternatives, condition_column):
+    """
+    Computes `loglik_step` with the condition lookup of `simulate_softmax_rl`, see
+    `loglik_step` for the other parameters.
+    """
+    if t == 0:
+        values[:] = 15 / 30
+    # the condition is read as in `simulate_softmax_rl`
+    curr_alt = available_alternatives(alternatives, context, t, condition_column)
+
+    if np.isnan(data[t]):
+        return 0.0
+    resp = int(data[t])
+    log_p = log_softmax_at(values, curr_alt, theta[2], resp)
+    for k in range(3):
+        rate = theta[0] if k == resp else theta[1]
+        delta_update(values, curr_alt[k], context[t, k], rate)
+    return log_p
+
+@njit(cache=True)
+def loglik_step(theta, params, values, context, data, t):
+    """
+    Computes the log-probability of the observed response at trial t under the full-feedback
+    softmax RL model and updates the values in place.
+
+    The available alternatives and the value updates follow `sample_softmax_rl` with the
+    default condition lookup; see `condition_loglik_step` for the others. Missing
+    responses (NaN) contribute a log-probability of zero and leave the values untouched.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 1D array of shape (3,) with alpha_1, alpha_2 and tau at trial t.
+    params : np.ndarray
+        Unused, the model has no time-constant parameters.
+    values : np.ndarray
+        A 1D array of shape (NUM_VALUES,) with the values of all six alternatives.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4) as produced by `generate_context`.
+    data : np.ndarray
+        A 1D array of shape (num_steps,) with the observed responses (0, 1 or 2).
+    t : int
+        The current trial.
+
+    Returns
+    -------
+    float
+        The log-probability of the observed response.
+    """
+    return condition_loglik_step(theta, values, context, data, t, ALTERNATIVES, LEGACY_CONDITION_COLUMN)
+
+def make_loglik_step(alternatives, condition_column):
+    """
+    Returns a jitted step with the signature of `loglik_step` for another condition lookup,
+    e.g. for the particle filter. It is compiled once per lookup and not cached on disk.
+    """
+    @njit
+    def step(theta, params, values, context, data, t):
+        return condition_loglik_step(theta, values, context, data, t, alternatives, condition_column)
+    return step
+
+@njit(cache=True)
+def loglik_softmax_rl(theta, context, data, alternatives=None, condition_column=LEGACY_CONDITION_COLUMN):
+    """
+    Computes the per-trial log-probabilities of observed responses under the full-feedback
+    softmax RL model.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 2D array of shape (num_steps, 3) with the trajectories of alpha_1, alpha_2 and tau.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4) as produced by `generate_context`.
+    data : np.ndarray
+        A 1D array of shape (num_steps,) with the observed responses (0, 1 or 2).
+    alternatives, condition_column : optional
+        The condition lookup, see `simulate_softmax_rl`.
+
+    Returns
+    -------
+    np.ndarray
+        A 1D array of shape (num_steps,) with the log-probability of every observed response.
+        Missing responses contribute zero (see `loglik_step`).
+    """
     num_steps = theta.shape[0]
-    values = np.full(6, 15) / 30
-    resp = np.zeros(num_steps)
+    log_p = np.zeros(num_steps)
+    values = np.zeros(NUM_VALUES)
     for t in range(num_steps):
-        if context[t, -1] == 0:
-            curr_alt = np.array([0, 1, 2], dtype=np.int32)
-        elif context[t, -1] == 1:
-            curr_alt = np.array([0, 2, 4], dtype=np.int32)
-        elif context[t, -1] == 2:
-            curr_alt = np.array([3, 4, 5], dtype=np.int32)
-        else:
-            curr_alt = np.array([1, 3, 5], dtype=np.int32)
-
-        action_probs = softmax(values[curr_alt], theta[t, 2])
-        resp[t] = select_action(np.arange(3), action_probs)
-        selected_alt = curr_alt[int(resp[t])]
-        not_selected_alt = np.delete(curr_alt, int(resp[t]))
-        values[selected_alt] = values[selected_alt] + theta[t, 0] * (context[t, int(resp[t])] - values[selected_alt])
-        values[not_selected_alt] = values[not_selected_alt] + theta[t, 1] * (context[t, np.delete(np.arange(3), int(resp[t]))] - values[not_selected_alt])
-        
-    return resp
\ No newline at end of file
+        log_p[t] = condition_loglik_step(theta[t], values, context, data, t, alternatives, condition_column)
+    return log_p
+
+@njit(parallel=True, cache=True)
+def loglik_softmax_rl_batch(theta, context, data, alternatives=None,
+                            condition_column=LEGACY_CONDITION_COLUMN):
+    """
+    Computes `loglik_softmax_rl` for a batch of theta trajectories on the same observed data.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D array of shape (num_draws, num_steps, 3) with theta trajectories.
+    context : np.ndarray
+        A 2D array of shape (num_steps, 4), shared by all draws.
+    data : np.ndarray
+        A 1D array of shape (num_steps,) with the observed responses.
+    alternatives, condition_column : optional
+        The condition lookup, see `simulate_softmax_rl`.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D array of shape (num_draws, num_steps) with per-trial log-probabilities.
+    """
+    num_draws = theta.shape[0]
+    log_p = np.zeros((num_draws, theta.shape[1]))
+    for i in prange(num_draws):
+        log_p[i] = loglik_softmax_rl(theta[i], context, data, alternatives, condition_column)
+    return log_p
+
+def generative_model(batch_size=32, seed=None, means=CONDITION_MEANS, steps_per_condition=STEPS_PER_CONDITION,
+                     alternatives=ALTERNATIVES, condition_column=LEGACY_CONDITION_COLUMN):
+    """
+    Simulates a batch of data sets from the non-stationary full-feedback softmax RL model.
+
+    Mirrors the bayesflow `TwoLevelGenerativeModel` of the notebooks (hyper prior
+    `sample_eta`, local prior `sample_random_walk`, simulator `sample_softmax_rl` with
+    generated contexts) and returns its keys, but draws the theta trajectories, the
+    contexts and the responses with the batched generators. All random draws derive
+    from `seed`.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        The number of data sets to simulate (default is 32). The numba threads of the
+        calling thread are set to the tuned value of this model on the first call (see
+        `autotune.apply`).
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the batch, e.g. `rng.batch_sequence(experiment_seed, index)`. If None,
+        fresh entropy is drawn from the OS.
+    means, steps_per_condition : optional
+        The feedback means and trial counts of the conditions, see
+        `context.generate_contexts` (default is the design of the experiment).
+    alternatives : array_like, optional
+        The alternatives shown in every condition (default is ALTERNATIVES).
+    condition_column : int, optional
+        Where the simulator reads the condition, see `simulate_softmax_rl`. The default
+        LEGACY_CONDITION_COLUMN keeps the original behavior, in which `means` only changes
+        the feedback. With CONDITION_COLUMN, row `c` of `alternatives` belongs to row `c`
+        of `means`, and both must have the same number of conditions.
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys 'hyper_prior_draws', 'local_prior_draws',
+        'sim_batchable_context' and 'sim_data'.
+    """
+    alternatives = condition_table(alternatives, condition_column, means=means)
+    apply_tuning("three_alt_full_feedback")
+    rng, prior_seeds, sim_seeds = batch_streams(seed, batch_size, num_kernels=2)
+    with stage("context") as s:
+        context = s.record(generate_contexts(batch_size, means, steps_per_condition, rng=rng))
+    with stage("prior") as s:
+        eta = np.stack([sample_eta(rng=rng) for _ in range(batch_size)])
+        theta = s.record(sample_random_walk_batch(eta, context.shape[1], prior_seeds))
+    with stage("simulator") as s:
+        sim_data = s.record(sample_softmax_rl_batch(theta, context, sim_seeds, alternatives, condition_column))
+    with stage("outputs") as s:
+        return s.record({
+            'hyper_prior_draws': eta.astype(np.float32),
+            'local_prior_draws': theta,
+            'sim_batchable_context': context,
+            'sim_data': sim_data,
+        })
@@ -1,30 +1,98 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from scipy.stats import halfnorm
-from numba import njit
+from numba import njit, prange
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+import transitions
+from transitions import TransitionSampler, draw_initial, initial_prior, transition_flags
 
 RNG = np.random.default_rng()
+LOWER_BOUNDS = np.array([0., 0., 0.])
+UPPER_BOUNDS = np.array([1., 1., 80.])
+# the transition of the model in the registry of `common/transitions.py`
+TRANSITION = "random_walk"
+FLAGS = transition_flags(TRANSITION)
+INITIAL_PRIOR = initial_prior(("beta", 1.5, 2), ("beta", 1.5, 2), ("softplus_normal", 1, 30))
+
+@njit(cache=True)
+def draw_theta_0(theta):
+    for k in range(theta.shape[0]):
+        theta[k] = draw_initial(INITIAL_PRIOR, k)
 
-@njit
+@njit(cache=True)
 def sample_theta_0():
-    alpha_1 = np.random.beta(a=1.5, b=2)
-    alpha_2 = np.random.beta(a=1.5, b=2)
-    tau = np.random.normal(loc=1, scale=30)
-    tau = np.log(1 + np.exp(tau))
-    return np.array([alpha_1, alpha_2, tau])
+    theta = np.zeros(3)
+    draw_theta_0(theta)
+    return theta
+
+def sample_eta(rng=None):
+    from scipy.stats import halfnorm
+
+    return halfnorm.rvs(loc=0, scale=(0.02, 0.02, 1), random_state=RNG if rng is None else rng)
 
-def sample_eta():
-    return halfnorm.rvs(loc=0, scale=(0.02, 0.02, 1))
+@njit(cache=True)
+def transition_step(theta_prev, theta, eta):
+    """
+    Draws theta_t given theta_{t-1} into `theta` with a clipped Gaussian random walk,
+    using `transitions.transition_step` under TRANSITION.
+    """
+    transitions.transition_step(theta_prev, theta, eta, False, FLAGS, INITIAL_PRIOR, LOWER_BOUNDS, UPPER_BOUNDS)
 
-@njit
+@njit(cache=True)
 def sample_random_walk(eta, num_steps=200):
-    lower_bounds = np.array([0, 0, 0])
-    upper_bounds = np.array([1, 1, 80])
     theta_t = np.zeros((num_steps, 3))
-    theta_t[0] = sample_theta_0()
-    z = np.random.randn(num_steps - 1, 3)
+    draw_theta_0(theta_t[0])
     for t in range(1, num_steps):
-            theta_t[t] = np.maximum(
-                np.minimum(theta_t[t - 1] + eta * z[t - 1], upper_bounds),
-                lower_bounds
-            )
-    return theta_t.astype(np.float32)
\ No newline at end of file
+        transition_step(theta_t[t - 1], theta_t[t], eta)
+    return theta_t.astype(np.float32)
+
+@njit(parallel=True, cache=True)
+def sample_random_walk_batch(eta, num_steps, seeds):
+    """
+    Draws a batch of theta trajectories from the random walk of `sample_random_walk`.
+
+    Every batch row reseeds numba's random state with `seeds[i]`, so a batch is
+    reproducible regardless of the number of threads.
+
+    Parameters
+    ----------
+    eta : np.ndarray
+        A 2D array of shape (batch_size, 3) with the random walk scales.
+    num_steps : int
+        The number of trials.
+    seeds : np.ndarray
+        A 1D array of shape (batch_size,) with one integer seed per batch row.
+
+    Returns
+    -------
+    np.ndarray
+        A float32 array of shape (batch_size, num_steps, 3) with the trajectories of alpha_1,
+        alpha_2 and tau.
+    """
+    batch_size = eta.shape[0]
+    theta_t = np.empty((batch_size, num_steps, 3), dtype=np.float32)
+    for i in prange(batch_size):
+        np.random.seed(seeds[i])
+        # the walk runs in float64 on two swapped buffers and is stored as float32
+        prev = np.empty(3)
+        cur = np.empty(3)
+        draw_theta_0(prev)
+        for k in range(3):
+            theta_t[i, 0, k] = prev[k]
+        for t in range(1, num_steps):
+            transition_step(prev, cur, eta[i])
+            for k in range(3):
+                theta_t[i, t, k] = cur[k]
+            prev, cur = cur, prev
+    return theta_t
+
+def transition_sampler(name=TRANSITION):
+    """
+    Returns the batched sampler of theta trajectories under the transition `name` of the
+    registry in `common/transitions.py`, with the initial prior and bounds of this model.
+    The default TRANSITION draws the same trajectories as `sample_random_walk_batch`, given
+    the same seeds.
+    """
+    return TransitionSampler(name, INITIAL_PRIOR, LOWER_BOUNDS, UPPER_BOUNDS)
@@ -0,0 +1,22 @@
+import numpy as np
+
+from context import NUM_STEPS
+from model import sample_softmax_rl_batch, loglik_softmax_rl_batch, LEGACY_CONDITION_COLUMN
+from priors import sample_random_walk_batch
+
+
+def warmup():
+    """
+    Compiles the jitted prior, simulation and likelihood kernels, or loads them from
+    numba's on-disk cache, by running them once on a small synthetic input.
+
+    The inputs have the same types as in a simulated batch, so the first real batch does
+    not trigger another compilation.
+    """
+    seeds = np.random.SeedSequence(0).generate_state(1)
+    theta = sample_random_walk_batch(np.full((1, 3), 0.02), NUM_STEPS, seeds)
+    context = np.zeros((1, NUM_STEPS, 4), dtype=np.float32)
+    # `generative_model` passes the condition lookup of `model.condition_table` explicitly
+    data = sample_softmax_rl_batch(theta, context, seeds, None, LEGACY_CONDITION_COLUMN)
+    # observed data are float64, with NaN for missed responses
+    loglik_softmax_rl_batch(theta, context[0], data[0].astype(np.float64))
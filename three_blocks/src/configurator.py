@@ -1,6 +1,13 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from scipy.stats import halfnorm, uniform
-from keras.utils import to_categorical
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from encoding import output_buffer, one_hot_into
+from empirical import empirical_conditions
+from profiling import instrument
+from context import STORE
 
 # GLOBAL_PRIOR_MEAN = np.concatenate(
 #     [
@@ -15,12 +22,53 @@ from keras.utils import to_categorical
 #     ]
 # )
 
-GLOBAL_PRIOR_MEAN = halfnorm(0, [0.05, 3]).mean().round(decimals=2)
-GLOBAL_PRIOR_STD = halfnorm(0, [0.05, 3]).std().round(decimals=2)
+# moments of the half-normal hyper prior in closed form, so that importing the
+# configurator does not pull in scipy.stats
+GLOBAL_PRIOR_MEAN = (np.array([0.05, 3]) * np.sqrt(2 / np.pi)).round(decimals=2)
+GLOBAL_PRIOR_STD = (np.array([0.05, 3]) * np.sqrt(1 - 2 / np.pi)).round(decimals=2)
 LOCAL_PRIOR_MEAN = np.array([0.5, 18])
 LOCAL_PRIOR_STD = np.array([0.3, 19])
 
-def configure_input(raw_dict):
+# number of classes of the one-hot encoded options, as inferred by keras' to_categorical
+# on the relevant subjects (correct options are 1-3, incorrect options 0-2)
+NUM_COR_OPTIONS = 4
+NUM_INC_OPTIONS = 3
+NUM_FEATURES = 3 + NUM_COR_OPTIONS + NUM_INC_OPTIONS
+# bump whenever the encoding of the conditions changes, to invalidate the cached
+# empirical conditions (see `load_empirical_conditions`)
+CONFIGURATOR_VERSION = 1
+
+def configure_conditions(raw_dict, out=None):
+    """
+    Encode the simulated or observed data of a batch into summary conditions.
+
+    This is the data part of `configure_input`, which does not require any prior draws
+    and is therefore shared with the encoding of the empirical data.
+
+    Parameters
+    ----------
+    raw_dict : dict
+        A dictionary containing the keys "sim_data" and "sim_batchable_context".
+    out : np.ndarray or None, optional
+        The summary conditions buffer of a previous call. It is reused (and overwritten)
+        if its shape matches the current batch.
+
+    Returns
+    -------
+    dict
+        A dictionary with the "summary_conditions" of shape (batch_size, num_steps, NUM_FEATURES).
+    """
+    data = raw_dict.get("sim_data")
+    context = np.asarray(raw_dict.get("sim_batchable_context"))
+    summary_conditions = output_buffer(out, (*data.shape[:2], NUM_FEATURES))
+    summary_conditions[:, :, 0] = data
+    summary_conditions[:, :, 1:3] = context[:, :, :2]
+    one_hot_into(summary_conditions[:, :, 3:3 + NUM_COR_OPTIONS], context[:, :, 2])
+    one_hot_into(summary_conditions[:, :, 3 + NUM_COR_OPTIONS:], context[:, :, 3])
+    return dict(summary_conditions=summary_conditions)
+
+@instrument("configurator")
+def configure_input(raw_dict, out=None):
     """
     Process raw dictionary data into formatted input for a model.
 
@@ -29,6 +77,9 @@ def configure_input(raw_dict):
     data, feedback, and options from the dictionary and encodes them appropriately. It also scales
     the local and hyper prior draws.
 
+    All summary conditions are written directly into a single float32 buffer, without
+    intermediate one-hot arrays and without importing tensorflow.
+
     Parameters
     ----------
     raw_dict : dict
@@ -37,6 +88,9 @@ def configure_input(raw_dict):
         - "sim_batchable_context": Simulation batchable context, including feedback and options.
         - "local_prior_draws": Local prior draws.
         - "hyper_prior_draws": Hyper prior draws.
+    out : np.ndarray or None, optional
+        The summary conditions buffer of a previous call. It is reused (and overwritten)
+        if its shape matches the current batch.
 
     Returns
     -------
@@ -52,18 +106,62 @@ def configure_input(raw_dict):
     "hyper_prior_draws" are present in the raw dictionary.
 
     """
-    data = raw_dict.get("sim_data")[:, :, None]
-    feedback = np.array(raw_dict.get("sim_batchable_context"))[:, :, :2]
-    cor_option = np.array(raw_dict.get("sim_batchable_context"))[:, :, 2][:, :, None]
-    inc_option = np.array(raw_dict.get("sim_batchable_context"))[:, :, 3][:, :, None]
-    summary_conditions = np.c_[
-        data, feedback, to_categorical(cor_option), to_categorical(inc_option)
-    ]
+    summary_conditions = configure_conditions(raw_dict, out)["summary_conditions"]
     theta_t = raw_dict.get("local_prior_draws")
     eta = raw_dict.get("hyper_prior_draws")
     out_dict = dict(
         local_parameters=((theta_t - LOCAL_PRIOR_MEAN) / LOCAL_PRIOR_STD).astype(np.float32),
         hyper_parameters=((eta - GLOBAL_PRIOR_MEAN) / GLOBAL_PRIOR_STD).astype(np.float32),
-        summary_conditions=summary_conditions.astype(np.float32),
+        summary_conditions=summary_conditions,
+    )
+    return out_dict
+
+def empirical_forward_dict(rows):
+    """
+    Convert the trials of one subject into the data keys of a simulated batch of size one.
+
+    The context columns are taken in the order and with the scale of the context STORE,
+    so the empirical feedback is divided by the same values as the simulated one.
+
+    Parameters
+    ----------
+    rows : np.ndarray
+        The rows of the subject, a structured array with the columns of the data set.
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys "sim_data" of shape (1, num_steps) and
+        "sim_batchable_context" of shape (1, num_steps, 4).
+    """
+    context = np.stack([rows[column] for column in STORE.columns], axis=-1).astype(STORE.dtype)
+    context /= np.asarray(STORE.scale, dtype=STORE.dtype)
+    return {
+        "sim_data": rows["resp"][None],
+        "sim_batchable_context": context[None],
+    }
+
+def load_empirical_conditions(csv_path=STORE.path):
+    """
+    Load the summary conditions of the relevant subjects of the empirical data.
+
+    The conditions are computed with `configure_conditions` on first use and cached next
+    to the binary cache of `csv_path`, keyed by the data and the configurator version.
+
+    Parameters
+    ----------
+    csv_path : str, optional
+        Path to the csv file with the trial-wise data (default is the data of the context STORE).
+
+    Returns
+    -------
+    dict
+        A dictionary containing the following keys:
+        - "summary_conditions": Array of shape (num_subjects, max_steps, NUM_FEATURES).
+        - "lengths": The number of trials of every subject.
+        - "subjects": The subject ids.
+    """
+    return empirical_conditions(
+        csv_path, empirical_forward_dict, configure_conditions, CONFIGURATOR_VERSION,
+        subjects=STORE.keep_subjects,
     )
-    return out_dict
\ No newline at end of file
@@ -1,36 +1,65 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-import pandas as pd
 
-RNG = np.random.default_rng()
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from context_store import ContextStore
 
-DATA = pd.read_csv("../data/data_fontanesi_prep.csv")
-DATA.f_cor = DATA.f_cor / 60
-DATA.f_inc = DATA.f_inc / 60
+RNG = np.random.default_rng()
 
 RELEVANT_SUB = np.array([1, 3, 5, 6, 7, 8, 16, 20, 22, 23, 24, 26, 27])
 # BLOCKS = np.arange(3)
 
+STORE = ContextStore(
+    "../data/data_fontanesi_prep.csv",
+    columns=['f_cor', 'f_inc', 'cor_option', 'inc_option'],
+    subjects=RELEVANT_SUB,
+    scale=[60, 60, 1, 1],
+    dtype=np.float32,
+    rng=RNG,
+)
+
 
-def generate_context():
+def generate_context(rng=None):
     """
     Generate contextual information from a random subject and block.
 
-    Randomly selects a subject from the unique subjects in the data and a block number from a predefined
-    set of blocks. Retrieves the corresponding data for the selected subject and block from the global
-    DATA dataframe, and returns an array containing features 'f_cor', 'f_inc', 'cor_option', and 'inc_option'
-    for the selected subject and block.
+    Randomly selects a subject from the relevant subjects in the data. Retrieves the corresponding data
+    for the selected subject from the global context STORE, and returns an array containing features
+    'f_cor', 'f_inc', 'cor_option', and 'inc_option' for the selected subject.
+
+    Parameters
+    ----------
+    rng : np.random.Generator, optional
+        The random number generator of the draw. If None, the module-level RNG is used.
 
     Returns
     -------
     np.ndarray
-        A numpy array of shape (80, 4) containing contextual information:
+        A numpy array of shape (240, 4) containing contextual information:
         - f_cor: Feedback correct option
         - f_inc: Feedback incorrect option
         - cor_option: Correct option
         - inc_option: Incorrect option
     """
-    sub = RNG.choice(RELEVANT_SUB)
     # block = RNG.choice(BLOCKS)
-    # sub_data = DATA.loc[(DATA.id == sub) & (DATA.block == block)]
-    sub_data = DATA.loc[DATA.id == sub]
-    return sub_data[['f_cor', 'f_inc', 'cor_option', 'inc_option']].to_numpy()
\ No newline at end of file
+    return STORE.generate_context(rng)
+
+def generate_contexts(batch_size, rng=None):
+    """
+    Generate the contexts of `batch_size` randomly drawn subjects in a single call.
+
+    Parameters
+    ----------
+    batch_size : int
+        The number of contexts to draw.
+    rng : np.random.Generator, optional
+        The random number generator of the draw. If None, the module-level RNG is used.
+
+    Returns
+    -------
+    np.ndarray
+        A numpy array of shape (batch_size, 240, 4) with the same features as `generate_context`.
+    """
+    return STORE.generate_contexts(batch_size, rng)
\ No newline at end of file
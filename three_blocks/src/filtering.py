@@ -0,0 +1,67 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from particle_filter import run_filter
+from priors import draw_theta_0, transition_sampler
+from likelihood import loglik_step, NUM_VALUES, TRANSITIONS
+
+# jitted transitions of the filter by registry name, compiled on first use
+_FILTER_TRANSITIONS = {}
+
+def filter_transition(name):
+    """
+    Returns the jitted transition of the filter for the transition `name` of
+    `likelihood.generative_model`, drawn with the flags, initial prior, bounds and block
+    starts of `priors.transition_sampler`, together with the number of hyper parameters
+    it reads.
+    """
+    name = TRANSITIONS.get(name, name)
+    if name not in _FILTER_TRANSITIONS:
+        sampler = transition_sampler(name)
+        _FILTER_TRANSITIONS[name] = sampler.filter_transition(), sampler.num_eta
+    return _FILTER_TRANSITIONS[name]
+
+def filter_subject(context, data, eta, transition="random_walk", num_particles=2000,
+                   ess_threshold=0.5, seed=None):
+    """
+    Estimate the filtered and smoothed trajectories of theta_t = (alpha, tau) of one subject
+    with a bootstrap particle filter, as a training-free reference for the amortizer.
+
+    Parameters
+    ----------
+    context : np.ndarray
+        A 2D numpy array of shape (num_steps, 4) as returned by `generate_context`.
+    data : np.ndarray
+        A 1D numpy array of length `num_steps` with the indices of the chosen alternatives.
+    eta : array_like
+        The hyper parameters of the transition model: the scales of the random walk, followed
+        by the switching probabilities for the mixture random walk.
+    transition : str, optional
+        The transition model, "random_walk" (default), "mixture_random_walk" or any name
+        accepted by `likelihood.generative_model`.
+    num_particles : int, optional
+        The number of particles (default is 2000).
+    ess_threshold : float, optional
+        Relative effective sample size that triggers resampling (default is 0.5).
+    seed : int or None, optional
+        The seed of the filter.
+
+    Returns
+    -------
+    dict
+        The filtered and smoothed means and standard deviations of shape (num_steps, 2), the
+        effective sample sizes and the log evidence, see `particle_filter.run_filter`.
+    """
+    transition, size = filter_transition(transition)
+    eta = np.asarray(eta, dtype=np.float64)
+    if eta.shape != (size,):
+        raise ValueError(f"The transition reads {size} hyper parameters, got eta of shape {eta.shape}.")
+    return run_filter(
+        draw_theta_0, transition, loglik_step, eta,
+        np.asarray(context, dtype=np.float64), np.asarray(data, dtype=np.float64),
+        num_params=2, num_values=NUM_VALUES, num_particles=num_particles,
+        ess_threshold=ess_threshold, seed=seed
+    )
@@ -1,8 +1,19 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from numba import njit
-from helpers import softmax, select_action
+from numba import njit, prange
+from helpers import sample_softmax_at, log_softmax_at, delta_update
+from priors import sample_transition_eta, transition_sampler
+from context import generate_contexts
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from rng import batch_streams
+from profiling import stage
+from autotune import apply as apply_tuning
+from predictive import group_bins, learning_curves
 
-@njit
+@njit(cache=True)
 def sample_softmax_rl(theta, context):
     """
     Perform softmax action selection in a reinforcement learning context.
@@ -27,23 +38,319 @@ def sample_softmax_rl(theta, context):
     Returns
     -------
     np.ndarray
-        A 1D numpy array of length `num_steps`, containing the selected actions for each time step
-        based on the softmax action selection process.
+        A 1D int8 numpy array of length `num_steps`, containing the selected actions for each time
+        step based on the softmax action selection process.
 
     Notes
     -----
-    This function requires pre-defined functions `softmax` and `select_action` to be defined in the
-    environment. This function is optimized with Numba's @njit decorator for faster execution.
+    The response is drawn with `sample_softmax_at` and the values are updated with `delta_update`
+    from the shared kernels. This function is optimized with Numba's @njit decorator for faster execution.
     """
     num_steps = theta.shape[0]
     values = np.full(4, 27.5) / 60
-    resp = np.zeros(num_steps)
+    resp = np.zeros(num_steps, dtype=np.int8)
     for t in range(num_steps):
         if t == 80 or t == 160:
             mean_value = np.mean(values)
             values = np.full(4, mean_value)
-        curr_alt = (context[t, 2:]).astype(np.int32)
-        action_probs = softmax(values[curr_alt], theta[t, 1])
-        resp[t] = select_action(curr_alt, action_probs)
-        values[curr_alt] = values[curr_alt] + theta[t, 0] * (context[t, :2] - values[curr_alt])
+        curr_alt = context[t, 2:]
+        resp[t] = int(curr_alt[sample_softmax_at(values, curr_alt, theta[t, 1])])
+        for k in range(2):
+            delta_update(values, int(curr_alt[k]), context[t, k], theta[t, 0])
+    return resp
+
+@njit(parallel=True, cache=True)
+def sample_softmax_rl_batch(theta, context, seeds):
+    """
+    Perform `sample_softmax_rl` for a batch of data sets in parallel.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D numpy array of shape (batch_size, num_steps, 2) with the alpha and tau values.
+    context : np.ndarray
+        A 3D numpy array of shape (batch_size, num_steps, 4) with the contexts.
+    seeds : np.ndarray
+        A 1D numpy array of shape (batch_size,) with one integer seed per batch row.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D int8 numpy array of shape (batch_size, num_steps) with the selected actions.
+
+    Notes
+    -----
+    Every batch row reseeds numba's random state with `seeds[i]`, so a batch is reproducible
+    regardless of the number of threads.
+    """
+    resp = np.zeros((theta.shape[0], theta.shape[1]), dtype=np.int8)
+    for i in prange(theta.shape[0]):
+        np.random.seed(seeds[i])
+        resp[i] = sample_softmax_rl(theta[i], context[i])
     return resp
+
+# first trials of the three blocks, at which the values are reset to their mean
+BLOCK_STARTS = np.array([0, 80, 160])
+
+@njit(parallel=True, cache=True)
+def predictive_batch(theta, context, bins, num_bins, seeds):
+    """
+    Perform `sample_softmax_rl` for a batch of posterior draws on the same context and sum
+    the choices of the correct option per bin of a learning curve.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D numpy array of shape (num_draws, num_steps, 2) with the alpha and tau values.
+    context : np.ndarray
+        A 2D numpy array of shape (num_steps, 4), shared by all draws.
+    bins : np.ndarray
+        A 1D integer numpy array of shape (num_steps,) with the bin of every trial.
+    num_bins : int
+        The number of bins.
+    seeds : np.ndarray
+        A 1D numpy array of shape (num_draws,) with one integer seed per draw.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D numpy array of shape (num_draws, num_bins) with the number of correct choices.
+
+    Notes
+    -----
+    Only the responses of the draw at hand are kept while they are reduced, so the memory does
+    not grow with the number of draws and trials. Every draw reseeds numba's random state with
+    `seeds[i]`, so the result is reproducible regardless of the number of threads.
+    """
+    num_draws = theta.shape[0]
+    num_steps = context.shape[0]
+    sums = np.zeros((num_draws, num_bins))
+    for i in prange(num_draws):
+        np.random.seed(seeds[i])
+        resp = sample_softmax_rl(theta[i], context)
+        for t in range(num_steps):
+            sums[i, bins[t]] += resp[t] == context[t, 2]
+    return sums
+
+def block_index(num_steps):
+    """
+    Return the block (0, 1 or 2) of each of the first `num_steps` trials.
+    """
+    return np.searchsorted(BLOCK_STARTS, np.arange(num_steps), side="right") - 1
+
+# keys of the learning curves of `posterior_predictive`, computed from a (num_steps, 4) context
+GROUPINGS = {
+    "block": lambda context: block_index(context.shape[0]),
+    "trial_in_block": lambda context: np.arange(context.shape[0]) - BLOCK_STARTS[block_index(context.shape[0])],
+    "cor_option": lambda context: context[:, 2],
+    "trial": lambda context: np.arange(context.shape[0]),
+}
+
+def posterior_predictive(theta, context, data=None, by=("block", "trial_in_block"), seed=None):
+    """
+    Generate learning curves of the accuracy from the posterior draws of one subject.
+
+    All draws are simulated on the empirical context of the subject by `predictive_batch`,
+    which reduces them to the number of correct choices per bin on the fly.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D numpy array of shape (num_draws, num_steps, 2) with posterior draws of alpha and
+        tau, e.g. from `predictive.subject_draws`.
+    context : np.ndarray
+        A 2D numpy array of shape (num_steps, 4) with the empirical context of the subject.
+    data : np.ndarray or None, optional
+        A 1D numpy array of length `num_steps` with the observed responses. If given, the
+        observed learning curve is added.
+    by : tuple of str, optional
+        The keys of GROUPINGS that define the bins (default is block and trial in block).
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the simulations.
+
+    Returns
+    -------
+    dict
+        The learning curves, see `predictive.learning_curves`.
+    """
+    context = np.asarray(context)
+    bins, labels = group_bins([GROUPINGS[name](context) for name in by])
+    _, seeds = batch_streams(seed, theta.shape[0])
+    sums = predictive_batch(theta, context, bins, len(labels), seeds)
+    observed = None
+    if data is not None:
+        observed = np.asarray(data, dtype=np.float64) == context[:, 2]
+    return learning_curves(sums, bins, labels, by, observed)
+
+NUM_VALUES = 4
+
+@njit(cache=True)
+def loglik_step(theta, params, values, context, data, t):
+    """
+    Compute the log-probability of the observed choice at trial t and update the values in place.
+
+    This is the update rule of `sample_softmax_rl`: the values are initialized at the first trial,
+    reset to their mean at trials 80 and 160, and both available alternatives are updated with
+    their feedback. The log-probability of a choice is the log-softmax of the values of the two
+    available alternatives.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 1D numpy array of shape (2,) with alpha and tau at trial t.
+    params : np.ndarray
+        Unused, the model has no time-constant parameters.
+    values : np.ndarray
+        A 1D numpy array of shape (NUM_VALUES,) with the values of all alternatives.
+    context : np.ndarray
+        A 2D numpy array of shape (num_steps, 4) with the feedback of the correct and incorrect
+        alternative, followed by the indices of the correct and incorrect alternative.
+    data : np.ndarray
+        A 1D numpy array of length `num_steps` with the indices of the chosen alternatives.
+        Choices that match neither available alternative are treated as missing.
+    t : int
+        The current trial.
+
+    Returns
+    -------
+    float
+        The log-probability of the observed choice, or zero for a missing choice.
+
+    Notes
+    -----
+    This function is optimized with Numba's @njit decorator for faster execution.
+    """
+    if t == 0:
+        values[:] = 27.5 / 60
+    elif t == 80 or t == 160:
+        values[:] = np.mean(values)
+    curr_alt = context[t, 2:]
+    log_p = 0.0
+    if data[t] == curr_alt[0]:
+        log_p = log_softmax_at(values, curr_alt, theta[1], 0)
+    elif data[t] == curr_alt[1]:
+        log_p = log_softmax_at(values, curr_alt, theta[1], 1)
+    for k in range(2):
+        delta_update(values, int(curr_alt[k]), context[t, k], theta[0])
+    return log_p
+
+@njit(cache=True)
+def loglik_softmax_rl(theta, context, data):
+    """
+    Compute the per-trial log-probabilities of observed choices under the softmax RL model.
+
+    Since both alternatives receive feedback on every trial, the value trajectories do not
+    depend on the choices.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 2D numpy array of shape (num_steps, 2) with the alpha and tau values at each time step.
+    context : np.ndarray
+        A 2D numpy array of shape (num_steps, 4) with the feedback of the correct and incorrect
+        alternative, followed by the indices of the correct and incorrect alternative.
+    data : np.ndarray
+        A 1D numpy array of length `num_steps` with the indices of the chosen alternatives.
+
+    Returns
+    -------
+    np.ndarray
+        A 1D numpy array of length `num_steps` with the log-probability of every observed choice.
+        Missing choices contribute zero (see `loglik_step`).
+
+    Notes
+    -----
+    This function is optimized with Numba's @njit decorator for faster execution.
+    """
+    num_steps = theta.shape[0]
+    log_p = np.zeros(num_steps)
+    values = np.zeros(NUM_VALUES)
+    params = np.zeros(0)
+    for t in range(num_steps):
+        log_p[t] = loglik_step(theta[t], params, values, context, data, t)
+    return log_p
+
+@njit(parallel=True, cache=True)
+def loglik_softmax_rl_batch(theta, context, data):
+    """
+    Compute `loglik_softmax_rl` for a batch of theta trajectories on the same observed data.
+
+    Parameters
+    ----------
+    theta : np.ndarray
+        A 3D numpy array of shape (num_draws, num_steps, 2) with theta trajectories, e.g.
+        posterior draws.
+    context : np.ndarray
+        A 2D numpy array of shape (num_steps, 4), shared by all draws.
+    data : np.ndarray
+        A 1D numpy array of length `num_steps` with the indices of the chosen alternatives.
+
+    Returns
+    -------
+    np.ndarray
+        A 2D numpy array of shape (num_draws, num_steps) with per-trial log-probabilities.
+
+    Notes
+    -----
+    The draws are evaluated in parallel with numba's prange.
+    """
+    num_draws = theta.shape[0]
+    log_p = np.zeros((num_draws, theta.shape[1]))
+    for i in prange(num_draws):
+        log_p[i] = loglik_softmax_rl(theta[i], context, data)
+    return log_p
+
+# the two transition models of the notebooks, by their names in `transitions.TRANSITIONS`
+TRANSITIONS = {
+    "random_walk": "random_walk+block_reset",
+    "mixture_random_walk": "mixture_random_walk",
+}
+
+def generative_model(batch_size=32, transition="random_walk", seed=None):
+    """
+    Generate a batch of data sets from the non-stationary softmax RL model.
+
+    Mirrors the bayesflow `TwoLevelGenerativeModel` of the notebooks (hyper and local
+    prior of the chosen transition model, simulator `sample_softmax_rl` with empirical
+    contexts) and returns its keys, but draws the theta trajectories and the choices with
+    the batched kernels. All random draws derive from `seed`.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        The number of data sets to simulate (default is 32). The numba threads of the
+        calling thread are set to the tuned value of this model on the first call (see
+        `autotune.apply`).
+    transition : str, optional
+        The transition model of theta, "random_walk" (default) or "mixture_random_walk" of
+        the notebooks, or any transition of the registry in `common/transitions.py`, e.g.
+        "regime_switching+block_reset". The hyper prior is chosen by `sample_transition_eta`.
+    seed : int, np.random.SeedSequence or None, optional
+        The seed of the batch, e.g. `rng.batch_sequence(experiment_seed, index)`. If None,
+        fresh entropy is drawn from the OS.
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys 'hyper_prior_draws', 'local_prior_draws',
+        'sim_batchable_context' and 'sim_data'.
+    """
+    transition = TRANSITIONS.get(transition, transition)
+    sample_theta = transition_sampler(transition)
+    apply_tuning("three_blocks")
+    rng, prior_seeds, sim_seeds = batch_streams(seed, batch_size, num_kernels=2)
+    with stage("prior"):
+        eta = np.stack([sample_transition_eta(transition, rng=rng) for _ in range(batch_size)])
+    with stage("context") as s:
+        context = s.record(generate_contexts(batch_size, rng=rng))
+    with stage("prior") as s:
+        theta = s.record(sample_theta(eta, context.shape[1], prior_seeds))
+    with stage("simulator") as s:
+        sim_data = s.record(sample_softmax_rl_batch(theta, context, sim_seeds))
+    with stage("outputs") as s:
+        return s.record({
+            'hyper_prior_draws': eta.astype(np.float32),
+            'local_prior_draws': theta,
+            'sim_batchable_context': np.asarray(context),
+            'sim_data': sim_data,
+        })
@@ -1,5 +1,21 @@
+import sys
+from pathlib import Path
+
 import numpy as np
-from scipy.stats import halfnorm
+from numba import njit, prange
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+import transitions
+from transitions import TransitionSampler, draw_initial, initial_prior, num_eta, transition_flags
+
+LOWER_BOUNDS = np.array([0., 0.])
+UPPER_BOUNDS = np.array([1., 80.])
+# the initial prior of `sample_theta_0` and the block starts of `sample_random_walk`
+INITIAL_PRIOR = initial_prior(("uniform", 0, 1), ("softplus_normal", 1, 30))
+BLOCK_STARTS = (80, 160)
+# the transitions of `sample_random_walk` and `sample_mixture_random_walk` in the registry
+RW_FLAGS = transition_flags("random_walk+block_reset")
+MRW_FLAGS = transition_flags("mixture_random_walk")
 
 def sample_theta_0(rng=None):
     """
@@ -70,7 +86,9 @@ def sample_mrw_eta(rng=None):
     # Configure RNG, if not provided
     if rng is None:
         rng = np.random.default_rng()
-    scales = halfnorm.rvs(loc=0, scale=[0.05, 3])
+    from scipy.stats import halfnorm
+
+    scales = halfnorm.rvs(loc=0, scale=[0.05, 3], random_state=rng)
     switch_probabilities = rng.uniform(low=0, high=0.1, size=2)
     return np.concatenate([scales, switch_probabilities])
 
@@ -162,3 +180,181 @@ def sample_mixture_random_walk(eta, num_steps=240, lower_bounds=(0, 0), upper_bo
         else:
             theta_t[t, 1] = rng.uniform(lower_bounds[1], upper_bounds[1])
     return theta_t
+
+@njit(cache=True)
+def draw_theta_0(theta):
+    """
+    Draws the initial values of alpha and tau into `theta`, with the same distributions
+    as `sample_theta_0`, using numba's random state.
+    """
+    for k in range(theta.shape[0]):
+        theta[k] = draw_initial(INITIAL_PRIOR, k)
+
+@njit(cache=True)
+def rw_transition_step(theta_prev, theta, eta, reset):
+    """
+    Draws theta_t given theta_{t-1} into `theta` under the random walk of `sample_random_walk`,
+    using `transitions.transition_step` with RW_FLAGS.
+
+    Parameters
+    ----------
+    theta_prev : np.ndarray
+        A 1D numpy array of shape (2,) with theta at the previous time step.
+    theta : np.ndarray
+        A 1D numpy array of shape (2,) that receives the new theta.
+    eta : np.ndarray
+        The scales of the random walk.
+    reset : bool
+        Whether a new block starts, in which case theta is drawn from the initial prior.
+    """
+    transitions.transition_step(theta_prev, theta, eta, reset, RW_FLAGS, INITIAL_PRIOR, LOWER_BOUNDS, UPPER_BOUNDS)
+
+@njit(cache=True)
+def mrw_transition_step(theta_prev, theta, eta):
+    """
+    Draws theta_t given theta_{t-1} into `theta` under the mixture random walk of
+    `sample_mixture_random_walk`, using `transitions.transition_step` with MRW_FLAGS.
+
+    Parameters
+    ----------
+    theta_prev : np.ndarray
+        A 1D numpy array of shape (2,) with theta at the previous time step.
+    theta : np.ndarray
+        A 1D numpy array of shape (2,) that receives the new theta.
+    eta : np.ndarray
+        The scales followed by the switching probabilities of the mixture random walk.
+    """
+    transitions.transition_step(theta_prev, theta, eta, False, MRW_FLAGS, INITIAL_PRIOR, LOWER_BOUNDS, UPPER_BOUNDS)
+
+@njit(parallel=True, cache=True)
+def sample_random_walk_batch(eta, num_steps, seeds):
+    """
+    Draws a batch of theta trajectories from the random walk of `sample_random_walk`.
+
+    Every batch row reseeds numba's random state with `seeds[i]`, so a batch is
+    reproducible regardless of the number of threads. The bounds are LOWER_BOUNDS and
+    UPPER_BOUNDS, the defaults of `sample_random_walk`.
+
+    Parameters
+    ----------
+    eta : np.ndarray
+        A 2D numpy array of shape (batch_size, 2) with the scales of the random walk.
+    num_steps : int
+        The number of steps of the random walk.
+    seeds : np.ndarray
+        A 1D numpy array of shape (batch_size,) with one integer seed per batch row.
+
+    Returns
+    -------
+    np.ndarray
+        A float32 numpy array of shape (batch_size, num_steps, 2) with the theta trajectories,
+        like `sample_random_walk`.
+    """
+    batch_size = eta.shape[0]
+    theta_t = np.empty((batch_size, num_steps, 2), dtype=np.float32)
+    for i in prange(batch_size):
+        np.random.seed(seeds[i])
+        # the walk runs in float64 on two swapped buffers and is stored as float32
+        prev = np.empty(2)
+        cur = np.empty(2)
+        draw_theta_0(prev)
+        for k in range(2):
+            theta_t[i, 0, k] = prev[k]
+        for t in range(1, num_steps):
+            rw_transition_step(prev, cur, eta[i], t in BLOCK_STARTS)
+            for k in range(2):
+                theta_t[i, t, k] = cur[k]
+            prev, cur = cur, prev
+    return theta_t
+
+@njit(parallel=True, cache=True)
+def sample_mixture_random_walk_batch(eta, num_steps, seeds):
+    """
+    Draws a batch of theta trajectories from the mixture random walk of
+    `sample_mixture_random_walk`.
+
+    Every batch row reseeds numba's random state with `seeds[i]`, so a batch is
+    reproducible regardless of the number of threads. The bounds are LOWER_BOUNDS and
+    UPPER_BOUNDS, the defaults of `sample_mixture_random_walk`.
+
+    Parameters
+    ----------
+    eta : np.ndarray
+        A 2D numpy array of shape (batch_size, 4) with the scales followed by the switching
+        probabilities of the mixture random walk.
+    num_steps : int
+        The number of steps of the random walk.
+    seeds : np.ndarray
+        A 1D numpy array of shape (batch_size,) with one integer seed per batch row.
+
+    Returns
+    -------
+    np.ndarray
+        A float32 numpy array of shape (batch_size, num_steps, 2) with the theta trajectories.
+    """
+    batch_size = eta.shape[0]
+    theta_t = np.empty((batch_size, num_steps, 2), dtype=np.float32)
+    for i in prange(batch_size):
+        np.random.seed(seeds[i])
+        # the walk runs in float64 on two swapped buffers and is stored as float32
+        prev = np.empty(2)
+        cur = np.empty(2)
+        draw_theta_0(prev)
+        for k in range(2):
+            theta_t[i, 0, k] = prev[k]
+        for t in range(1, num_steps):
+            mrw_transition_step(prev, cur, eta[i])
+            for k in range(2):
+                theta_t[i, t, k] = cur[k]
+            prev, cur = cur, prev
+    return theta_t
+
+def transition_sampler(name):
+    """
+    Returns the batched sampler of theta trajectories under the transition `name` of the
+    registry in `common/transitions.py`, with the initial prior, bounds and block starts
+    of this model.
+
+    "random_walk+block_reset" draws the same trajectories as `sample_random_walk_batch`
+    and "mixture_random_walk" the same as `sample_mixture_random_walk_batch`, given the
+    same seeds.
+
+    Parameters
+    ----------
+    name : str
+        A registered transition or a "+" combination of them.
+
+    Returns
+    -------
+    TransitionSampler
+        Called as `sampler(eta, num_steps, seeds)`, returns a float32 array of shape
+        (batch_size, num_steps, 2).
+    """
+    return TransitionSampler(name, INITIAL_PRIOR, LOWER_BOUNDS, UPPER_BOUNDS, BLOCK_STARTS)
+
+def sample_transition_eta(name, rng=None):
+    """
+    Generates random draws from the hyper prior of the registered transition `name`.
+
+    Transitions that switch read the scales and switching probabilities of
+    `sample_mrw_eta`, random walks the scales of `sample_rw_eta`, and transitions without a
+    random walk read no hyper parameters.
+
+    Parameters
+    ----------
+    name : str
+        A registered transition or a "+" combination of them.
+    rng : np.random.Generator, optional
+        An instance of numpy's random number generator. If None, a new default generator is used.
+
+    Returns
+    -------
+    np.ndarray
+        A numpy array of shape (4,), (2,) or (0,) with the sampled eta values.
+    """
+    size = num_eta(transition_flags(name), 2)
+    if size == 4:
+        return sample_mrw_eta(rng=rng)
+    elif size == 2:
+        return sample_rw_eta(rng=rng)
+    return np.zeros(0)
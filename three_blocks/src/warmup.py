@@ -0,0 +1,23 @@
+import numpy as np
+
+from likelihood import sample_softmax_rl_batch, loglik_softmax_rl_batch
+from priors import transition_sampler
+
+
+def warmup(num_steps=240):
+    """
+    Compiles the jitted prior, simulation and likelihood kernels, or loads them from numba's
+    on-disk cache, by running them once on a small synthetic input.
+
+    The inputs have the same types as the contexts of the store and the simulated data,
+    so the first real batch does not trigger another compilation. No empirical data is
+    read.
+    """
+    seeds = np.random.SeedSequence(0).generate_state(1)
+    # one kernel serves every transition of the registry
+    theta = transition_sampler("random_walk+block_reset")(np.full((1, 2), 0.02), num_steps, seeds)
+    context = np.zeros((1, num_steps, 4), dtype=np.float32)
+    context[:, :, 2] = 1
+    data = sample_softmax_rl_batch(theta, context, seeds)
+    # observed data are float64, with NaN for missed responses
+    loglik_softmax_rl_batch(theta, context[0], data[0].astype(np.float64))